@@ -1,11 +1,31 @@
 from tkinter import *
-from geometry import Bounds, Point2D
+from geometry import Bounds, Point2D, Vector2D
+from spatial import SpatialHash
+from profiler import FrameProfiler
+from console import Console
+import queue
+import random
+import struct
 import sys
+import threading
+import time
+import zlib
 
 class Agent:
 
     INTENSITIES = [4,5,6,7,8,7,6,5,4,3,2,1,0,1,2,3]
 
+    # Agents with a radius are kept in the world's spatial index.
+    radius = None
+
+    # Whether render.py may draw this agent with fewer corners when
+    # frames are taking too long.
+    DETAIL_OPTIONAL = False
+
+    # What an agent is made of, for snapshot.py. Subclasses with more
+    # state add theirs, e.g. SNAPSHOT = Agent.SNAPSHOT + (('hp','i'),).
+    SNAPSHOT = (('position','P'), ('ticks','i'))
+
     def __init__(self,position,world):
         self.position = position
         self.world    = world 
@@ -23,6 +43,14 @@ class Agent:
         p4 = self.position + Vector2D( 0.125,-0.125)
         return [p1,p2,p3,p4]
 
+    def outline(self):
+        # The shape for render.py, as a template of (x, y) corners
+        # around the position and a heading to turn it by (None: don't
+        # turn it). Agents whose shape never changes should return the
+        # same template every time.
+        p = self.position
+        return tuple((q.x - p.x, q.y - p.y) for q in self.shape()), None
+
     def update(self):
         self.ticks += 1
 
@@ -31,6 +59,26 @@ class Agent:
 
 class Game(Frame):
 
+    # Side of a cell of the spatial index, in world units.
+    INDEX_CELL_SIZE = 4.0
+
+    # 'run' steps the world this many times per second (each tick moves
+    # bodies by one TIME_STEP), and redraws it at most this many times
+    # per second. If drawing falls behind, up to MAX_CATCH_UP ticks are
+    # run between two frames before the game is allowed to slow down.
+    TICKS_PER_SECOND  = 60.0
+    FRAMES_PER_SECOND = 60.0
+    MAX_CATCH_UP      = 8
+
+    # The part of a game's state that snapshot.py saves besides its
+    # agents; games add their scores, timers and the agents they keep.
+    SNAPSHOT = (('tick','i'), ('mouse_position','P'), ('mouse_down','?'), ('GAME_OVER','?'))
+
+    # The key that shows/hides the frame timing overlay, and how many
+    # frames go by between refreshes of it.
+    HUD_KEY   = '`'
+    HUD_EVERY = 15
+
     # Game(name,w,h,ww,wh)
     #
     # Creates a world with a coordinate system of width w and height
@@ -46,7 +94,16 @@ class Game(Frame):
     # bodies within the frame of the world. (For example, 'wrapped' 
     # yields "SPACEWAR" topology, i.e. a torus.)
     #
-    def __init__(self, name, w, h, ww, wh, topology = 'wrapped', console_lines = 0):
+    # A headless game never touches Tk: there is no window, canvas or
+    # console, and 'update' only runs the agents. Use 'simulate' to step
+    # it as fast as the CPU allows.
+    #
+    # All of a game's randomness comes from its own 'random' (a
+    # random.Random seeded with 'seed', or with a fresh seed if none is
+    # given), so a game made with the same seed and fed the same inputs
+    # on the same ticks plays out the same way; see replay.py.
+    #
+    def __init__(self, name, w, h, ww, wh, topology = 'wrapped', console_lines = 0, headless = False, seed = None):
 
         # Register the world coordinate and graphics parameters.
         self.WINDOW_WIDTH = ww
@@ -55,22 +112,110 @@ class Game(Frame):
         self.topology = topology
 
         # Populate the world with creatures
-        self.agents = []
+        #
+        # 'slots' maps each agent to its place in 'agents', so that
+        # removing one is a swap with the last agent rather than a
+        # search. While the agents are being updated ('ticking'), adds
+        # and removes are queued in 'spawned' and 'despawned' and only
+        # applied, in the order they were made, once every agent has
+        # had its turn (see 'apply_pending'). Agents that leave part way
+        # through a tick are in 'leaving' and skip the rest of it.
+        self.agents    = []
+        self.slots     = {}
+        self.ticking   = False
+        self.spawned   = []
+        self.despawned = []
+        self.leaving   = set()
         self.GAME_OVER = False
 
+        # 'tick' counts the updates so far. Every window event goes
+        # through 'dispatch', which also hands it to 'recording' (a
+        # replay.Recorder) if there is one.
+        if seed == None:
+            seed = random.randrange(2**31)
+        self.seed      = seed
+        self.random    = random.Random(seed)
+        self.tick      = 0
+        self.recording = None
+
+        # A snapshot.Rewind, if the last few seconds are being kept.
+        self.rewind = None
+
+        # While 'run' is driving the game, 'update' only simulates and
+        # 'run' decides when to draw. 'previous' holds where each agent
+        # was one tick before the latest, for drawing in between.
+        self.running  = False
+        self.previous = {}
+
+        # When 'run' simulates on a worker thread, window events wait in
+        # 'inputs' for the worker, and the worker leaves the latest
+        # render snapshot in 'latest' for the Tk thread to draw; 'shown'
+        # is what that thread has on the canvas. See 'run_threaded'.
+        self.worker    = None
+        self.inputs    = queue.SimpleQueue()
+        self.latest    = None
+        self.presented = None
+        self.shown     = {}
+
+        # Frame timing, off until 'profile' is called or the HUD_KEY is
+        # pressed; see profiler.py. 'hud' is the overlay's canvas item.
+        self.profiler = None
+        self.hud      = None
+
+        # The canvas polygon for each live agent, as [item, color].
+        self.items = {}
+
+        # Worlds of MovingBodies may set this to an Integrator (see
+        # integrator.py) to move all of their bodies at once.
+        self.integrator = None
+
+        # A render.Renderer, if agents are drawn in bulk rather than one
+        # shape at a time.
+        self.renderer = None
+
+        # A particles.Emitter, if sparks are kept as arrays rather than
+        # agents; it steps once per tick, before the agents move.
+        self.particles = None
+
+        # A projectiles.Projectiles, if photons are kept as arrays
+        # rather than agents; it moves them once per tick, before the
+        # agents, and sees what they hit after.
+        self.projectiles = None
+
+        # Finds the agents (with a radius) near a point; see spatial.py.
+        self.index = SpatialHash(self.bounds, self.INDEX_CELL_SIZE, topology == 'wrapped')
+
+        # A contacts.Contacts, if agents touching each other matters;
+        # it runs once per tick, after every agent has moved.
+        self.contacts = None
+
+        # A netsync.Registry, if the world is played over a network; it
+        # hears of every agent that joins or leaves.
+        self.netsync = None
+
+        self.mouse_position = Point2D(0.0,0.0)
+        self.mouse_down     = False
+
+        self.headless = headless
+        if headless:
+            self.root    = None
+            self.canvas  = None
+            self.text    = None
+            self.console = Console()
+            return
+
         # Initialize the graphics window.
         self.root = Tk()
         self.root.title(name)
         Frame.__init__(self, self.root)
         self.canvas = Canvas(self.root, width=self.WINDOW_WIDTH, height=self.WINDOW_HEIGHT)
+        self.background = self.canvas.create_rectangle(0, 0, self.WINDOW_WIDTH, self.WINDOW_HEIGHT, fill="#000000")
 
         # Handle mouse pointer motion and keypress events.
-        self.mouse_position = Point2D(0.0,0.0)
-        self.mouse_down     = False
-        self.bind_all('<Motion>',self.handle_mouse_motion)
-        self.canvas.bind('<Button-1>',self.handle_mouse_press)
-        self.canvas.bind('<ButtonRelease-1>',self.handle_mouse_release)
-        self.bind_all('<Key>',self.handle_keypress)
+        self.bind_all('<Motion>',lambda event: self.post('motion',event))
+        self.canvas.bind('<Button-1>',lambda event: self.post('press',event))
+        self.canvas.bind('<ButtonRelease-1>',lambda event: self.post('release',event))
+        self.bind_all('<Key>',lambda event: self.post('key',event))
 
         self.canvas.pack()
         if console_lines > 0:
@@ -78,55 +223,523 @@ class Game(Frame):
             self.text.pack()
         else:
             self.text = None
+        self.console = Console(self.text)
         self.pack()
 
+    # report(line)
+    #
+    # Adds a line to the console (or standard output). Lines are only
+    # queued here; they are shown all at once, when the frame is drawn
+    # (see console.py).
+    #
     def report(self,line=""):
         line += "\n"
         if self.text == None:
-            print(line)
-        else:
-            self.text.insert(END,line)
-            self.text.see(END)
+            line += "\n" # as print(line) always did
+        self.console.write(line)
 
     def trim(self,agent):
         if self.topology == 'wrapped':
-            agent.position = self.bounds.wrap(agent.position)
+            agent.position = self.bounds.wrap_in_place(agent.position)
         elif self.topology == 'bound':
-            agent.position = self.bounds.clip(agent.position)
+            agent.position = self.bounds.clip_in_place(agent.position)
         elif self.topology == 'open':
             pass
 
+    def offset(self, p, q):
+        # The vector that takes you from point q to point p. In a
+        # wrapped world this is the shortest one, which may go across
+        # the edge of the world.
+        dx = p.x - q.x
+        dy = p.y - q.y
+        if self.topology == 'wrapped':
+            w = self.bounds.width()
+            h = self.bounds.height()
+            if dx > w/2.0:
+                dx -= w
+            elif dx < -w/2.0:
+                dx += w
+            if dy > h/2.0:
+                dy -= h
+            elif dy < -h/2.0:
+                dy += h
+        return Vector2D(dx, dy)
+
+    # add(agent), remove(agent)
+    #
+    # An agent joins or leaves the spatial index right away, so photons
+    # later in the same tick see the change. Its place in 'agents' is
+    # only changed at the end of the tick if one is under way; one that
+    # is added and removed within a tick never gets one.
+    #
     def add(self, agent):
-        self.agents.append(agent)
+        if agent.radius != None:
+            self.index.insert(agent)
+        if self.netsync != None:
+            self.netsync.spawned(agent)
+        if self.ticking:
+            self.spawned.append(agent)
+        else:
+            self.insert(agent)
 
     def remove(self, agent):
-        self.agents.remove(agent)
+        self.index.remove(agent)
+        if self.netsync != None:
+            self.netsync.despawned(agent)
+        if self.ticking:
+            if agent not in self.slots and agent in self.spawned:
+                # Added earlier in this tick: it never joins 'agents'.
+                self.spawned.remove(agent)
+            self.despawned.append(agent)
+            self.leaving.add(agent)
+        else:
+            self.delete(agent)
+
+    def insert(self, agent):
+        if agent not in self.slots:
+            self.slots[agent] = len(self.agents)
+            self.agents.append(agent)
+
+    def delete(self, agent):
+        slot = self.slots.pop(agent, None)
+        if slot == None:
+            return
+        last = self.agents.pop()
+        if last is not agent:
+            self.agents[slot] = last
+            self.slots[last] = slot
+        item = self.items.pop(agent, None)
+        if item is not None:
+            self.canvas.delete(item[0])
+
+    def apply_pending(self):
+        # Removes go first: a pooled agent can leave and be spawned
+        # again within one tick, and should end up in the world.
+        for agent in self.despawned:
+            self.delete(agent)
+        for agent in self.spawned:
+            self.insert(agent)
+            self.previous.pop(agent, None)
+        self.spawned   = []
+        self.despawned = []
+        self.leaving.clear()
 
     def update(self):
+        profiler = self.profiler
+        if profiler != None:
+            profiler.lap()
+        if self.integrator != None:
+            self.integrator.step()
+            if profiler != None:
+                profiler.lap('integrate')
+        if self.particles != None:
+            self.particles.step()
+            if profiler != None:
+                profiler.lap('particles')
+        if self.projectiles != None:
+            self.projectiles.step()
+            if profiler != None:
+                profiler.lap('projectiles')
+        self.ticking = True
+        if profiler != None:
+            self.timed_updates(profiler)
+        else:
+            leaving = self.leaving
+            for agent in self.agents:
+                if agent not in leaving:
+                    agent.update()
+        if self.projectiles != None:
+            self.projectiles.collide() # after the agents, as Photon agents come after the ships
+            if profiler != None:
+                profiler.lap('projectiles')
+        self.ticking = False
+        self.apply_pending()
+        if profiler != None:
+            profiler.lap('pending')
+        self.index.refresh(self.integrator)
+        if self.contacts != None:
+            if profiler != None:
+                profiler.lap('index')
+            self.contacts.step()
+            if profiler != None:
+                profiler.lap('contacts')
+        self.tick += 1
+        if self.recording != None:
+            self.recording.ticked()
+        if self.rewind != None:
+            self.rewind.record()
+        if profiler != None:
+            profiler.lap('index')
+            profiler.tick()
+            if self.headless or self.worker != None:
+                profiler.end_frame()
+        if self.headless:
+            self.console.flush()
+            return
+        if self.running:
+            return
+        self.draw()
+
+    def timed_updates(self, profiler):
+        # The agent loop of 'update', timing each class of agent.
+        clock = time.perf_counter
+        leaving = self.leaving
+        by_class = {}
         for agent in self.agents:
-            agent.update()
-        self.clear()
-        for agent in self.agents:
-            self.draw_shape(agent.shape(),agent.color())
+            if agent not in leaving:
+                start = clock()
+                agent.update()
+                kind = type(agent)
+                by_class[kind] = by_class.get(kind, 0.0) + (clock() - start)
+        for kind, seconds in by_class.items():
+            profiler.add('update ' + kind.__name__, seconds)
+        profiler.lap()
+
+    def draw(self, alpha=1.0):
+        # Draw every agent 'alpha' of the way from where it was one tick
+        # ago (see 'remember_positions') to where it is now.
+        start = time.perf_counter()
+        profiler = self.profiler
+        if profiler != None:
+            profiler.lap()
+        if self.renderer != None:
+            self.renderer.draw(alpha)
+        else:
+            previous = self.previous
+            for agent in self.agents:
+                dx = dy = 0.0
+                if alpha < 1.0 and agent in previous:
+                    back = self.offset(previous[agent], agent.position)
+                    dx = back.dx * (1.0 - alpha)
+                    dy = back.dy * (1.0 - alpha)
+                self.draw_shape(agent, agent.shape(), agent.color(), dx, dy)
+        if self.particles != None:
+            self.particles.draw(alpha)
+        if self.projectiles != None:
+            self.projectiles.draw(alpha)
+        self.console.flush()
+        if profiler != None:
+            profiler.lap('draw')
         Frame.update(self)
+        if self.renderer != None:
+            self.renderer.governor.frame(time.perf_counter() - start)
+        if profiler != None:
+            profiler.lap('flush')
+            if self.hud != None and profiler.frames % self.HUD_EVERY == 0:
+                self.canvas.itemconfig(self.hud, text="\n".join(profiler.summary()))
+                self.canvas.tag_raise(self.hud)
+            profiler.end_frame()
+
+    def profile(self, path=None):
+        # Start timing frames, also writing every frame's times to
+        # 'path' if one is given (see profiler.py).
+        if self.profiler != None:
+            self.profiler.close()
+        self.profiler = FrameProfiler(path)
+        return self.profiler
+
+    def toggle_hud(self):
+        if self.hud != None:
+            self.canvas.delete(self.hud)
+            self.hud = None
+            return
+        if self.profiler == None:
+            self.profile()
+        self.hud = self.canvas.create_text(8, 8, anchor=NW, fill="#A0F090", font=("Courier", 10), text="\n".join(self.profiler.summary()))
+
+    def remember_positions(self):
+        previous = {}
+        for agent in self.agents:
+            p = agent.position
+            previous[agent] = Point2D(p.x, p.y)
+        self.previous = previous
+
+    def run(self, threaded=False):
+        # Play the game until it is over, with a fixed time step.
+        # (With 'threaded', see 'run_threaded' instead.)
+        #
+        # Real time is banked in 'lag' and spent one tick at a time, so
+        # the world advances TICKS_PER_SECOND ticks per second however
+        # long each tick or frame takes. A frame is drawn (if one is due)
+        # after the ticks that were owed; when ticks get expensive,
+        # frames are skipped rather than ticks. The frame shows each
+        # agent part of the way through the next tick, by the fraction
+        # of a tick left over in 'lag'.
+        if threaded and not self.headless:
+            return self.run_threaded()
+        tick_length  = 1.0 / self.TICKS_PER_SECOND
+        frame_length = 1.0 / self.FRAMES_PER_SECOND
+        self.running = True
+        lag = 0.0
+        last = time.perf_counter()
+        next_frame = last
+        try:
+            while not self.GAME_OVER:
+                now = time.perf_counter()
+                lag += now - last
+                last = now
+
+                ticks = int(lag / tick_length)
+                if ticks > self.MAX_CATCH_UP:
+                    lag -= (ticks - self.MAX_CATCH_UP) * tick_length
+                    ticks = self.MAX_CATCH_UP
+                for n in range(ticks):
+                    if n == ticks - 1 and not self.headless:
+                        self.remember_positions()
+                    self.update()
+                    lag -= tick_length
+                    if self.GAME_OVER:
+                        return
+
+                if not self.headless and now >= next_frame:
+                    self.draw(lag / tick_length)
+                    next_frame = max(next_frame + frame_length, now)
+
+                now = time.perf_counter()
+                wait = tick_length - (lag + now - last)
+                if not self.headless:
+                    wait = min(wait, next_frame - now)
+                if wait > 0.0:
+                    time.sleep(wait)
+        finally:
+            self.running = False
+            self.console.close()
+            if self.profiler != None:
+                self.profiler.close()
+
+    # run_threaded()
+    #
+    # Like 'run', but the world is simulated on a worker thread while
+    # the Tk thread only draws and takes input, so a slow repaint can't
+    # hold up the physics and a slow tick can't hold up the window.
+    #
+    # Window events are put on 'inputs' (see 'post') and handled by the
+    # worker before its next tick. After each tick the worker publishes
+    # a render snapshot, a tuple
+    #
+    #   (tick, ((agent, coords, color), ...))
+    #
+    # with every agent's polygon already in window coordinates, by
+    # replacing 'latest'. Nothing in a snapshot is changed afterwards,
+    # so the Tk thread can draw it while the next one is being made.
+    # The Tk thread looks for a new one FRAMES_PER_SECOND times a second
+    # (see 'present'); it never touches the agents themselves.
+    #
+    def run_threaded(self):
+        self.running = True
+        self.shown = self.items # anything already drawn is the Tk thread's
+        self.items = {}
+        self.worker = threading.Thread(target=self.simulate_loop, name="simulation", daemon=True)
+        self.root.protocol("WM_DELETE_WINDOW", self.stop)
+        try:
+            self.worker.start()
+            self.root.after(0, self.present)
+            self.root.mainloop()
+        finally:
+            self.GAME_OVER = True
+            self.worker.join()
+            self.worker = None
+            self.running = False
+            self.console.close()
+            if self.profiler != None:
+                self.profiler.close()
+
+    def stop(self):
+        self.GAME_OVER = True
+
+    def simulate_loop(self):
+        # The worker thread: ticks at TICKS_PER_SECOND, as in 'run'.
+        tick_length = 1.0 / self.TICKS_PER_SECOND
+        lag = 0.0
+        last = time.perf_counter()
+        try:
+            while not self.GAME_OVER:
+                now = time.perf_counter()
+                lag += now - last
+                last = now
+                ticks = int(lag / tick_length)
+                if ticks > self.MAX_CATCH_UP:
+                    lag -= (ticks - self.MAX_CATCH_UP) * tick_length
+                    ticks = self.MAX_CATCH_UP
+                for n in range(ticks):
+                    self.handle_inputs()
+                    self.update()
+                    lag -= tick_length
+                    if self.GAME_OVER:
+                        break
+                if ticks > 0:
+                    self.latest = (self.tick, self.render_snapshot())
+                wait = tick_length - (lag + time.perf_counter() - last)
+                if wait > 0.0:
+                    time.sleep(wait)
+        finally:
+            self.GAME_OVER = True # so the window closes if a tick failed
+
+    def handle_inputs(self):
+        inputs = self.inputs
+        while not inputs.empty():
+            kind, event = inputs.get_nowait()
+            self.dispatch(kind, event)
+
+    def render_snapshot(self):
+        if self.renderer != None:
+            agents = tuple(self.renderer.shapes())
+        else:
+            agents = tuple((agent, tuple(self.screen_coords(agent.shape())), agent.color()) for agent in self.agents)
+        if self.particles != None:
+            agents += self.particles.render_snapshot()
+        if self.projectiles != None:
+            agents += self.projectiles.render_snapshot()
+        return agents
+
+    def present(self):
+        # The Tk thread: draw the latest render snapshot, if it is new.
+        if self.GAME_OVER:
+            self.root.quit()
+            return
+        self.root.after(int(1000.0 / self.FRAMES_PER_SECOND), self.present)
+        latest = self.latest
+        if latest is self.presented:
+            return
+        self.presented = latest
+        start = time.perf_counter()
+        canvas = self.canvas
+        shown = self.shown
+        now_shown = {}
+        for agent, coords, color in latest[1]:
+            item = shown.pop(agent, None)
+            if item == None:
+                item = [canvas.create_polygon(coords, fill=color), color]
+            else:
+                canvas.coords(item[0], coords)
+                if item[1] != color:
+                    canvas.itemconfig(item[0], fill=color)
+                    item[1] = color
+            now_shown[agent] = item
+        for item in shown.values():
+            canvas.delete(item[0])
+        self.shown = now_shown
+        self.console.flush()
+        if self.renderer != None:
+            self.renderer.governor.frame(time.perf_counter() - start)
+        profiler = self.profiler
+        if self.hud != None and profiler != None and latest[0] % self.HUD_EVERY == 0:
+            canvas.itemconfig(self.hud, text="\n".join(profiler.summary()))
+            canvas.tag_raise(self.hud)
+
+    def simulate(self, ticks):
+        # Step the world 'ticks' times back to back, with no sleeping
+        # in between. Stops early if the game ends; returns the number
+        # of ticks that were run.
+        for tick in range(ticks):
+            if self.GAME_OVER:
+                return tick
+            self.update()
+        return ticks
+
+    def state_hash(self):
+        # A CRC of every agent's class, position and velocity, in the
+        # order they are updated, then of the photons in 'projectiles'.
+        # Two runs that agree on this every tick are (for all practical
+        # purposes) playing the same game.
+        crc = 0
+        for agent in self.agents:
+            p = agent.position
+            v = getattr(agent, 'velocity', None)
+            crc = zlib.crc32(type(agent).__name__.encode(), crc)
+            if v == None:
+                crc = zlib.crc32(struct.pack('<dd', p.x, p.y), crc)
+            else:
+                crc = zlib.crc32(struct.pack('<dddd', p.x, p.y, v.dx, v.dy), crc)
+        if self.projectiles != None:
+            crc = self.projectiles.hash(crc)
+        return crc
 
-    def draw_shape(self, shape, color):
-        wh,ww = self.WINDOW_HEIGHT,self.WINDOW_WIDTH
-        h = self.bounds.height()
-        x = self.bounds.xmin
-        y = self.bounds.ymin
-        points = [ ((p.x - x)*wh/h, wh - (p.y - y)* wh/h) for p in shape ]
-        first_point = points[0]
-        points.append(first_point)
-        self.canvas.create_polygon(points, fill=color)
+    # draw_shape(agent,shape,color,dx,dy)
+    #
+    # Each agent keeps one canvas polygon for as long as it is in the
+    # world. The first call creates it; later calls just move it with
+    # 'coords', and only recolor it when the color actually changed.
+    # The polygon is deleted when the agent leaves (see 'remove').
+    # The shape is drawn shifted by (dx,dy) world units. 'draw_coords'
+    # does the same with the window coordinates already worked out.
+    #
+    def draw_shape(self, agent, shape, color, dx=0.0, dy=0.0):
+        self.draw_coords(agent, self.screen_coords(shape, dx, dy), color)
+
+    def draw_coords(self, agent, coords, color):
+        item = self.items.get(agent)
+        if item == None:
+            self.items[agent] = [self.canvas.create_polygon(coords, fill=color), color]
+        else:
+            self.canvas.coords(item[0], coords)
+            if item[1] != color:
+                self.canvas.itemconfig(item[0], fill=color)
+                item[1] = color
+
+    def screen_coords(self, shape, dx=0.0, dy=0.0):
+        # The window coordinates of a shape's points (shifted by dx,dy
+        # world units), flattened as x0,y0,x1,y1,... and closed by
+        # repeating the first point.
+        wh = self.WINDOW_HEIGHT
+        scale = wh / self.bounds.height()
+        x = self.bounds.xmin - dx
+        y = self.bounds.ymin - dy
+        coords = []
+        for p in shape:
+            coords.append((p.x - x) * scale)
+            coords.append(wh - (p.y - y) * scale)
+        coords.append(coords[0])
+        coords.append(coords[1])
+        return coords
 
     def clear(self):
+        # Throw away every canvas item and start over with a fresh
+        # background. Agents get new polygons the next time they are drawn.
         self.canvas.delete('all')
-        self.canvas.create_rectangle(0, 0, self.WINDOW_WIDTH, self.WINDOW_HEIGHT, fill="#000000")
+        self.items = {}
+        if self.particles != None:
+            self.particles.sprites.forget()
+        if self.projectiles != None:
+            self.projectiles.sprites.forget()
+        if self.renderer != None:
+            self.renderer.hidden = set()
+        self.background = self.canvas.create_rectangle(0, 0, self.WINDOW_WIDTH, self.WINDOW_HEIGHT, fill="#000000")
 
     def window_to_world(self,x,y):
         return self.bounds.point_at(x/self.WINDOW_WIDTH, 1.0-y/self.WINDOW_HEIGHT)
 
+    def post(self, kind, event):
+        # Where the window's bindings send events. While a worker thread
+        # is simulating they wait for it in 'inputs' (all but the HUD
+        # key, which is the Tk thread's business).
+        if self.worker == None:
+            self.dispatch(kind, event)
+        elif kind == 'key' and event.char == self.HUD_KEY:
+            self.toggle_hud()
+        else:
+            self.inputs.put((kind, event))
+
+    # dispatch(kind,event)
+    #
+    # Hands a window event to its handler: 'key' to handle_keypress,
+    # and 'motion', 'press' and 'release' to the handle_mouse_* ones.
+    # The event only needs the fields the handlers read, 'char' for a
+    # key and 'x','y' (in pixels) for the mouse, which is how replay.py
+    # plays a recorded game back.
+    #
+    def dispatch(self, kind, event):
+        if self.recording != None:
+            self.recording.log(kind, event)
+        if kind == 'key':
+            self.handle_keypress(event)
+        elif kind == 'motion':
+            self.handle_mouse_motion(event)
+        elif kind == 'press':
+            self.handle_mouse_press(event)
+        elif kind == 'release':
+            self.handle_mouse_release(event)
+
     def handle_mouse_motion(self,event):
         self.mouse_position = self.window_to_world(event.x,event.y)
         #print("MOUSE MOVED",self.mouse_position,self.mouse_down)
@@ -144,3 +757,5 @@ class Game(Frame):
     def handle_keypress(self,event):
         if event.char == 'q':
             self.GAME_OVER = True
+        elif event.char == self.HUD_KEY and not self.headless and self.worker == None:
+            self.toggle_hud()
@@ -1,18 +1,41 @@
 from tkinter import *
 from Game import Game, Agent
-from geometry import Point2D, Vector2D
+from geometry import Point2D, Vector2D, heading, time_of_impact
+from pool import Pooled
 import math
 import random
+import replay
+import sys
 import time
 
 TIME_STEP = 0.5
 
 class MovingBody(Agent):
     '''Parent class for anything that moves. Pretty sure these are all just default values in case the child class doesn't specify any of them.'''
+    row              = None #Row of the world's integrator holding this body, if the world has one (see integrator.py)
+    SLOWDOWN_IN_BULK = None #Set to a slowdown to let the integrator do steer() for every such body at once
+    SNAPSHOT         = Agent.SNAPSHOT + (('velocity','V'), ('accel','V'))
+
     def __init__(self, p0, v0, world):
         self.velocity = v0
         self.accel    = Vector2D(0.0,0.0)
-        Agent.__init__(self,p0,world)
+        Agent.__init__(self,p0.copy(),world) #copied because update() moves the position in place, and p0 is often another body's position
+        if world.integrator != None:
+            world.integrator.add(self)
+
+    @classmethod
+    def spawn(cls, *args):
+        '''Make a new one. Pooled classes reuse one that left instead (see pool.py)'''
+        return cls(*args)
+
+    def rejoin(self, world):
+        '''Put a body that has left its world back into one, as if it was just made. Used by respawn()'''
+        self.accel.set(0.0,0.0)
+        self.ticks = 0
+        self.world = world
+        world.add(self)
+        if world.integrator != None:
+            world.integrator.add(self)
 
     def color(self):
         return "#000080"
@@ -24,73 +47,127 @@ class MovingBody(Agent):
         p4 = self.position + Vector2D( 0.125,-0.125)
         return [p1,p2,p3,p4]
 
+    OUTLINE = ((0.125, 0.125), (-0.125, 0.125), (-0.125, -0.125), (0.125, -0.125))
+    def outline(self):
+        '''The shape as corners around the position, for render.py'''
+        return self.OUTLINE, None
+
     def steer(self):
-        return Vector2D(0.0)
+        return self.accel.set(0.0,0.0)
 
     def update(self):
-        self.position = self.position + self.velocity * TIME_STEP
-        self.velocity = self.velocity + self.accel * TIME_STEP
+        if self.row != None:
+            '''The integrator already moved every body this tick, so only steering is left. Bodies that never steer keep their zero accel'''
+            if self.SLOWDOWN_IN_BULK == None and type(self).steer is not MovingBody.steer:
+                self.accel = self.steer()
+            return
+        self.position.scale_add(self.velocity, TIME_STEP) #in place, so no new vectors each tick
+        self.velocity.scale_add(self.accel, TIME_STEP)
         self.accel    = self.steer()
         self.world.trim(self)
 
+    def leave(self):
+        if self.row != None:
+            self.world.integrator.remove(self)
+        Agent.leave(self)
+
 class Shootable(MovingBody):
     '''Parent class for anything that can be shot'''
     SHRAPNEL_CLASS  = None
     SHRAPNEL_PIECES = 0
     WORTH           = 1
+    SNAPSHOT        = MovingBody.SNAPSHOT + (('radius','d'),)
 
     def __init__(self, position0, velocity0, radius, world):
         self.radius = radius
         MovingBody.__init__(self, position0, velocity0, world)
 
-    def is_hit_by(self, photon): '''is the vector between the photon and the asteroid center smaller than the asteroid radius? Basically, is the photon inside the asteroid?'''
-        return ((self.position - photon.position).magnitude() < self.radius)
+    def is_hit_by(self, photon):
+        return self.hit_time(photon) != None
+
+    def hit_time(self, photon):
+        '''When during this tick's move (0 to 1) did the photon first touch the asteroid, or None if it didn't. The photon's whole path is checked, not just where it ended up, so fast photons can't skip past small asteroids'''
+        travel = photon.velocity * TIME_STEP
+        start = self.world.offset(photon.position, self.position) - travel #shortest way across the world's edge, from where the photon ends up
+        return time_of_impact(start, travel, self.radius)
 
     def explode(self):
         self.world.score += self.WORTH
-        if self.SHRAPNEL_CLASS == None: '''Return None if the object doesn't create shrapnel when destroyed'''
+        if self.SHRAPNEL_CLASS == None:
+            '''Return None if the object doesn't create shrapnel when destroyed'''
             return
-        for _ in range(self.SHRAPNEL_PIECES): '''Otherwise, make objects in the object's shrapnel class at its position SHRAPNEL_PIECES number of times'''
-            self.SHRAPNEL_CLASS(self.position,self.world)
+        '''Otherwise, make objects in the object's shrapnel class at its position SHRAPNEL_PIECES number of times'''
+        self.shrapnel(self.SHRAPNEL_PIECES)
         self.leave()
 
+    def shrapnel(self, pieces):
+        '''Make pieces of shrapnel at our position. Embers go to the world's particle emitter if it has one (see particles.py)'''
+        if self.SHRAPNEL_CLASS is Ember and self.world.particles != None:
+            self.world.particles.emit(self.position, pieces)
+            return
+        for _ in range(pieces):
+            self.SHRAPNEL_CLASS.spawn(self.position,self.world)
+
+OUTLINES_PER_SIZE = 32
+OUTLINES = {} #size -> its asteroid outlines
+
+def asteroid_outlines(size):
+    '''OUTLINES_PER_SIZE bumpy outlines for asteroids of this size, made the first time they're needed. They come from their own random numbers, so they're the same in every game and using them costs the game's random numbers nothing'''
+    outlines = OUTLINES.get(size)
+    if outlines == None:
+        rng = random.Random("asteroid outlines %r" % size)
+        dA = 2.0 * math.pi / 15.0
+        directions = [Vector2D(math.cos(i * dA), math.sin(i * dA)) for i in range(15)]
+        outlines = []
+        for n in range(OUTLINES_PER_SIZE):
+            polygon = []
+            for i, direction in enumerate(directions):
+                if i % 3 == 0 and rng.random() < 0.2:
+                    r = size/2.0 + rng.random() * 0.25
+                else:
+                    r = size - rng.random() * 0.25
+                polygon.append(direction * r)
+            outlines.append(polygon)
+        OUTLINES[size] = outlines
+    return outlines
+
 class Asteroid(Shootable):
     WORTH     = 5
     MIN_SPEED = 0.1
     MAX_SPEED = 0.3
     SIZE      = 3.0
+    SNAPSHOT  = Shootable.SNAPSHOT + (('outline_number','i'),)
+    DETAIL_OPTIONAL = True #drawn with fewer corners when frames run slow (see render.py)
 
     def __init__(self, position0, velocity0, world):
         Shootable.__init__(self,position0, velocity0, self.SIZE, world)
         self.make_shape()
 
     def choose_velocity(self):
-        return Vector2D.random() * random.uniform(self.MIN_SPEED,self.MAX_SPEED)
+        return Vector2D.random(rng=self.world.random) * self.world.random.uniform(self.MIN_SPEED,self.MAX_SPEED)
 
     def make_shape(self):
-        angle = 0.0
-        dA = 2.0 * math.pi / 15.0
-        center = Point2D(0.0,0.0)
-        self.polygon = []
-        for i in range(15):
-            if i % 3 == 0 and random.random() < 0.2:
-                r = self.radius/2.0 + random.random() * 0.25
-            else:
-                r = self.radius - random.random() * 0.25
-            dx = math.cos(angle)
-            dy = math.sin(angle)
-            angle += dA
-            offset = Vector2D(dx,dy) * r
-            self.polygon.append(offset)
+        '''Pick one of the ready-made outlines for our size (see asteroid_outlines), with a single random number'''
+        self.outline_number = self.world.random.randrange(OUTLINES_PER_SIZE)
+
+    @property
+    def polygon(self):
+        '''Our outline, as offsets from our position. Shared with every asteroid that picked the same one, so don't change it'''
+        return asteroid_outlines(self.SIZE)[self.outline_number]
 
     def shape(self):
-        return [self.position + offset for offset in self.polygon]
+        position = self.position
+        return [position.fast_plus(offset) for offset in self.polygon]
+
+    def outline(self):
+        return self.polygon, None
 
 class ParentAsteroid(Asteroid):
     def __init__(self,world):
+        self.world = world
         world.number_of_asteroids += 1
         velocity0 = self.choose_velocity()
-        position0 = world.bounds.point_at(random.random(),random.random())
+        position0 = world.bounds.point_at(world.random.random(),world.random.random())
         if abs(velocity0.dx) >= abs(velocity0.dy):
             if velocity0.dx > 0.0:
                 # LEFT SIDE
@@ -111,36 +188,55 @@ class ParentAsteroid(Asteroid):
         Asteroid.explode(self)
         self.world.number_of_asteroids -= 1
 
-class Ember(MovingBody): '''Little sparks that come off when an asteroid is destroyed'''
+class Ember(Pooled, MovingBody):
+    '''Little sparks that come off when an asteroid is destroyed'''
     INITIAL_SPEED = 2.0
     SLOWDOWN      = 0.2
     TOO_SLOW      = INITIAL_SPEED / 20.0
+    SLOWDOWN_IN_BULK = SLOWDOWN
 
     def __init__(self, position0, world):
-        velocity0 = Vector2D.random() * self.INITIAL_SPEED
+        velocity0 = Vector2D.random(rng=world.random) * self.INITIAL_SPEED
         MovingBody.__init__(self, position0, velocity0, world)
 
+    def respawn(self, position0, world):
+        angle = world.random.random() * 2 * math.pi #same draw as Vector2D.random()
+        self.position.set(position0.x, position0.y)
+        self.velocity.set(math.cos(angle) * self.INITIAL_SPEED, math.sin(angle) * self.INITIAL_SPEED)
+        self.rejoin(world)
+
+    COLORS        = ("#FFFFFF", "#FF8080", "#808040") #white-hot, burning, smoldering
+    BANDS         = (0.5, 0.25) #Fractions of INITIAL_SPEED below which an ember turns the next color
+
     def color(self):
-        white_hot  = "#FFFFFF"
-        burning    = "#FF8080"
-        smoldering = "#808040"
         speed = self.velocity.magnitude()
-        if speed / self.INITIAL_SPEED > 0.5:
-            return white_hot
-        if speed / self.INITIAL_SPEED > 0.25:
-            return burning
-        return smoldering
+        if speed / self.INITIAL_SPEED > self.BANDS[0]:
+            return self.COLORS[0]
+        if speed / self.INITIAL_SPEED > self.BANDS[1]:
+            return self.COLORS[1]
+        return self.COLORS[2]
 
     def steer(self):
-        return -self.velocity.direction() * self.SLOWDOWN
+        '''Slow down against the direction of motion. Reuses self.accel instead of making new vectors'''
+        speed = self.velocity.magnitude()
+        if speed <= Vector2D.EPSILON:
+            return self.accel.set(0.0,0.0)
+        accel = self.accel.set(self.velocity.dx, self.velocity.dy)
+        accel *= -self.SLOWDOWN / speed
+        return accel
 
     def update(self):
         MovingBody.update(self)
-        if self.velocity.magnitude() < self.TOO_SLOW:
+        if self.row != None:
+            speed = self.world.integrator.speed_of(self.row) #already worked out in bulk
+        else:
+            speed = self.velocity.magnitude()
+        if speed < self.TOO_SLOW:
             self.leave()
 
 class ShrapnelAsteroid(Asteroid):
     def __init__(self, position0, world):
+        self.world = world
         world.number_of_shrapnel += 1
         velocity0 = self.choose_velocity()
         Asteroid.__init__(self, position0, velocity0, world)
@@ -180,36 +276,60 @@ class LargeAsteroid(ParentAsteroid):
 
 '''I don't know how useful the asteroid code is to us, but it's written so that there isn't any code that's needlessly repeated. The asteroid and shootable classes handle almost everything, while the child classes just specify the color, shrapnel pieces, and type of shrapnel. IDK how feasible it would be, but we could try to implement something similar with either powerups or with the photons our players will shoot (assuming that some powerups will change how the photons act) '''
 
-class Photon(MovingBody): '''Projectiles that the player shoots out'''
+def first_hit(photon):
+    '''The Shootable the photon ran into first on its way this tick, if any'''
+    travel = photon.velocity.magnitude() * TIME_STEP
+    first = None
+    for t in photon.world.index.query(photon.position, travel): #only the Shootables near the photon's path
+        when = t.hit_time(photon)
+        if when != None and (first == None or when < first_time):
+            first, first_time = t, when
+    return first
+
+class Photon(Pooled, MovingBody):
+    '''Projectiles that the player shoots out'''
     INITIAL_SPEED = 2.0 * SmallAsteroid.MAX_SPEED
     LIFETIME      = 40
+    SHAPES        = {True: ((0.125, 0.125), (-0.125, 0.125), (-0.125, -0.125), (0.125, -0.125))} #as MovingBody.shape; the ship's photons, for projectiles.py
+    COLORS        = {True: "#8080FF"}
+    SNAPSHOT      = MovingBody.SNAPSHOT + (('age','i'),)
 
     def __init__(self,source,world):
         self.age  = 0
         v0 = source.velocity + (source.get_heading() * self.INITIAL_SPEED)
         MovingBody.__init__(self, source.position, v0, world)
 
+    def respawn(self, source, world):
+        self.age = 0
+        self.position.set(source.position.x, source.position.y)
+        self.velocity.set(source.velocity.dx, source.velocity.dy).scale_add(source.get_heading(), self.INITIAL_SPEED)
+        self.rejoin(world)
+
     def color(self):
-        return "#8080FF"
+        return self.COLORS[True]
 
     def update(self):
         MovingBody.update(self)
         self.age += 1
         if self.age >= self.LIFETIME:
             self.leave()
-        else:
-            targets = [a for a in self.world.agents if isinstance(a,Shootable)]
-            for t in targets:
-                if t.is_hit_by(self):
-                    t.explode()
-                    self.leave()
-                    return
+        elif photon_hits(self):
+            self.leave()
+
+def photon_hits(photon):
+    '''Whether the photon hit something this tick, blowing it up if so. Also used for the photons kept in a projectile store (see projectiles.py)'''
+    t = first_hit(photon)
+    if t == None:
+        return False
+    t.explode()
+    return True
 
 class Ship(MovingBody):
     TURNS_IN_360   = 24
     IMPULSE_FRAMES = 4
     ACCELERATION   = 0.05
     MAX_SPEED      = 2.0
+    SNAPSHOT       = MovingBody.SNAPSHOT + (('speed','d'), ('angle','d'), ('impulse','i'))
 
     def __init__(self,world):
         position0    = Point2D()
@@ -223,8 +343,7 @@ class Ship(MovingBody):
         return "#F0C080"
 
     def get_heading(self):
-        angle = self.angle * math.pi / 180.0
-        return Vector2D(math.cos(angle), math.sin(angle))
+        return heading(self.angle) #from a table, since the ship turns by whole degrees
 
     def turn_left(self):
         self.angle += 360.0 / self.TURNS_IN_360
@@ -236,16 +355,24 @@ class Ship(MovingBody):
         self.impulse = self.IMPULSE_FRAMES
 
     def shoot(self):
-        Photon(self, self.world)
+        projectiles = self.world.projectiles
+        if projectiles != None: #photons as arrays, not agents (see projectiles.py)
+            projectiles.fire(self.position, self.velocity + self.get_heading() * Photon.INITIAL_SPEED)
+            return
+        Photon.spawn(self, self.world)
 
     def shape(self):
         h  = self.get_heading()
         hp = h.perp()
-        p1 = self.position + h
-        p2 = self.position + hp * 0.5
-        p3 = self.position - hp * 0.5
+        p1 = self.position.fast_plus(h)
+        p2 = self.position.copy().scale_add(hp, 0.5)
+        p3 = self.position.copy().scale_add(hp,-0.5)
         return [p1,p2,p3]
 
+    OUTLINE = ((1.0, 0.0), (0.0, 0.5), (0.0, -0.5)) #along and across the heading
+    def outline(self):
+        return self.OUTLINE, self.get_heading()
+
     def steer(self):
         if self.impulse > 0:
             self.impulse -= 1
@@ -266,9 +393,22 @@ class PlayAsteroids(Game):
     DELAY_START      = 150
     MAX_ASTEROIDS    = 6
     INTRODUCE_CHANCE = 0.01
-
-    def __init__(self):
-        Game.__init__(self,"ASTEROIDS!!!",60.0,45.0,800,600,topology='wrapped')
+    SNAPSHOT         = Game.SNAPSHOT + (('number_of_asteroids','i'), ('number_of_shrapnel','i'), ('level','i'), ('score','i'),
+                                        ('before_start_ticks','i'), ('started','?'), ('ship','A'))
+
+    def __init__(self, headless=False, vectorized=False, seed=None):
+        Game.__init__(self,"ASTEROIDS!!!",60.0,45.0,800,600,topology='wrapped',headless=headless,seed=seed)
+        if vectorized:
+            from integrator import Integrator # needs NumPy, so only imported when asked for
+            from particles import Emitter
+            from projectiles import Projectiles
+            from render import Renderer
+            self.integrator  = Integrator(self.bounds, self.topology, TIME_STEP)
+            self.particles   = Emitter(self, Ember, TIME_STEP) #embers as arrays, not agents
+            self.projectiles = Projectiles(self, Photon, TIME_STEP, photon_hits) #and photons too
+            self.renderer    = Renderer(self) #every agent's shape in one go
+
+        self.index.slack = SmallAsteroid.MAX_SPEED * TIME_STEP #the farthest an asteroid moves in a tick
 
         self.number_of_asteroids = 0
         self.number_of_shrapnel = 0
@@ -306,14 +446,14 @@ class PlayAsteroids(Game):
         if self.started:
             tense = (self.number_of_asteroids >= self.max_asteroids())
             tense = tense or (self.number_of_shrapnel >= 2*self.level)
-            if not tense and random.random() < self.INTRODUCE_CHANCE:
+            if not tense and self.random.random() < self.INTRODUCE_CHANCE:
                 LargeAsteroid(self)
 
         Game.update(self)
 
 
-print("Hit j and l to turn, i to create thrust, and SPACE to shoot. Press q to quit.")
-game = PlayAsteroids()
-while not game.GAME_OVER:
-    time.sleep(1.0/60.0)
-    game.update()
+if __name__ == "__main__":
+    print("Hit j and l to turn, i to create thrust, and SPACE to shoot. Press q to quit.")
+    game = PlayAsteroids()
+    with replay.recording(game, sys.argv[1:]):
+        game.run(threaded='--threaded' in sys.argv[1:]) #simulate on a worker thread
@@ -2,7 +2,8 @@ from tkinter import *
 from Game import Game, Agent
 from geometry import Point2D, Vector2D
 import math
-import random
+import replay
+import sys
 import time
 
 class Paddle(Agent):
@@ -12,6 +13,7 @@ class Paddle(Agent):
     WIDTH     = 1.0
     LENGTH    = 8.0
     AGILITY   = 0.2
+    SNAPSHOT  = Agent.SNAPSHOT + (('on_left','?'), ('length','d'), ('width','d'))
 
     def __init__(self,world,left_paddle=True):
         self.on_left = left_paddle
@@ -29,21 +31,30 @@ class Paddle(Agent):
             self.position.y = self.world.bounds.ymax - self.length/2.0
 
     def hits_between(self,p0,p1):
+        return self.time_of_impact(p0,p1) != None
+
+    def time_of_impact(self,p0,p1):
+        # How far (0 to 1) along the move from p0 to p1 the ball crosses
+        # the paddle's x, coming from in front of it and within its
+        # length, or None if it doesn't.
 
         if self.on_left and p1.x > self.position.x:
-            return False
+            return None
         if (not self.on_left) and p1.x < self.position.x:
-            return False
+            return None
         if self.on_left and p0.x < self.position.x:
-            return False
+            return None
         if (not self.on_left) and p0.x > self.position.x:
-            return False
+            return None
 
         if abs(p1.x-p0.x) < 0.0000001:
-            return False
-        
-        y_intercept = p0.y + (p1.y - p0.y)/(p1.x - p0.x)
-        return abs(y_intercept - self.position.y) < self.length/2.0
+            return None
+
+        t = (self.position.x - p0.x)/(p1.x - p0.x)
+        y_intercept = p0.y + (p1.y - p0.y)*t #where the ball is when it gets to the paddle's x
+        if abs(y_intercept - self.position.y) < self.length/2.0:
+            return t
+        return None
 
     def color(self):
         if self.on_left:
@@ -57,6 +68,15 @@ class Paddle(Agent):
         p3 = self.position + Vector2D(-self.width/2.0,-self.length/2.0)       
         p4 = self.position + Vector2D( self.width/2.0,-self.length/2.0)       
         return [p1,p2,p3,p4]
+
+    OUTLINES = {} # (width, length) -> the shape's corners, for render.py
+    def outline(self):
+        size = (self.width, self.length)
+        template = self.OUTLINES.get(size)
+        if template == None:
+            w, l = self.width/2.0, self.length/2.0
+            template = self.OUTLINES[size] = ((w, l), (-w, l), (-w, -l), (w, -l))
+        return template, None
         
     def move_down(self):
         self.position.y += self.length * self.AGILITY
@@ -88,13 +108,14 @@ class Ball(Agent):
 
     START_X   = 0.75
     SPEED     = 0.25
+    SNAPSHOT  = Agent.SNAPSHOT + (('heading','V'),)
 
     def __init__(self,world,left_serve=True):
         dx = 1.0 if left_serve else -1.0
-        dy = random.uniform(-3.0,3.0)
+        dy = world.random.uniform(-3.0,3.0)
         self.heading = Vector2D(dx,dy)
         offset = -self.START_X if left_serve else self.START_X
-        position = world.bounds.point_at((1.0+offset)/2.0,random.random())
+        position = world.bounds.point_at((1.0+offset)/2.0,world.random.random())
         Agent.__init__(self,position,world)
 
     def check_bounce_horizontal(self,y_value,from_above=True):
@@ -123,8 +144,10 @@ class Ball(Agent):
             new_position = self.position + self.heading * self.SPEED
             self.position = new_position
             if self.world.left_paddle.hits_between(old_position,new_position):
+                self.world.left_returns += 1
                 self.check_bounce_vertical(self.world.left_paddle.position.x,from_left=False)
             if self.world.right_paddle.hits_between(old_position,new_position):
+                self.world.right_returns += 1
                 self.check_bounce_vertical(self.world.right_paddle.position.x,from_left=True)
             self.check_bounce_horizontal(self.world.bounds.ymin,from_above=False)
             self.check_bounce_horizontal(self.world.bounds.ymax,from_above=True)
@@ -144,12 +167,23 @@ class Ball(Agent):
         p3 = self.position + Vector2D(-0.5,-0.5)        
         p4 = self.position + Vector2D( 0.5,-0.5)
         return [p1,p2,p3,p4]
+
+    OUTLINE = ((0.5, 0.5), (-0.5, 0.5), (-0.5, -0.5), (0.5, -0.5))
+    def outline(self):
+        return self.OUTLINE, None
             
 
 class PlayPong(Game):
 
-    def __init__(self):
-        Game.__init__(self,"PONG",60.0,45.0,800,600,topology='bound',console_lines=6)
+    SNAPSHOT = Game.SNAPSHOT + (('left_score','i'), ('right_score','i'), ('use_mouse','?'), ('left_turn','?'),
+                                ('ticks_before_start','i'), ('serving','?'), ('left_returns','i'), ('right_returns','i'),
+                                ('ball','A'), ('left_paddle','A'), ('right_paddle','A'))
+
+    def __init__(self, headless=False, vectorized=False, seed=None):
+        Game.__init__(self,"PONG",60.0,45.0,800,600,topology='bound',console_lines=6,headless=headless,seed=seed)
+        if vectorized:
+            from render import Renderer # needs NumPy, so only imported when asked for
+            self.renderer = Renderer(self)
 
         self.report("Left player:  hit 'a' or 'z'.")
         self.report("Right player: hit apostrophe or '/'.")
@@ -158,8 +192,10 @@ class PlayPong(Game):
 
         self.left_score  = 0
         self.right_score = 0
+        self.left_returns  = 0 #times each paddle sent the ball back (see sweep.py)
+        self.right_returns = 0
         self.use_mouse   = False
-        self.left_turn   = random.choice([True,False])
+        self.left_turn   = self.random.choice([True,False])
         self.reset()
 
         self.left_paddle  = Paddle(self,left_paddle=True)
@@ -192,6 +228,7 @@ class PlayPong(Game):
     def reset(self):
         self.ticks_before_start = 100
         self.ball = None
+        self.serving = False
 
     def serve(self):
         self.ball = Ball(self,left_serve=self.left_turn)
@@ -242,7 +279,7 @@ class PlayPong(Game):
                 self.left_turn = not self.left_turn
                 self.reset()
             
-game = PlayPong()
-while not game.GAME_OVER:
-    time.sleep(1.0/60.0)
-    game.update()
+if __name__ == "__main__":
+    game = PlayPong()
+    with replay.recording(game, sys.argv[1:]):
+        game.run(threaded='--threaded' in sys.argv[1:]) #simulate on a worker thread
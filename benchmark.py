@@ -0,0 +1,260 @@
+import argparse
+import contextlib
+import io
+import json
+import math
+import sys
+import time
+import tracemalloc
+
+import pool
+import contacts
+import PlayAsteroids
+import dogfight
+import PlayPong
+from geometry import Point2D
+
+#
+# benchmark.py
+#
+# Reproducible stress scenes for the three games, so we can tell
+# whether a change made things faster or slower.
+#
+#   python3 benchmark.py                      # every scene, headless
+#   python3 benchmark.py --render             # ...and drawn in a window
+#   python3 benchmark.py --save baseline.json
+#   python3 benchmark.py --compare baseline.json
+#
+# Each scene is built from the games' own classes with a fixed random
+# seed, and comes with a driver that plays its inputs before every tick.
+# For every scene we report ticks per second, the p50/p95/p99/max time
+# of a single tick, and the peak memory allocated while it ran (from a
+# second, tracemalloc'd run, since tracing slows everything down).
+#
+# --compare prints each number next to the stored one and exits with
+# status 1 if any scene got more than --tolerance (default 10%) slower.
+#
+# --check also makes sure every scene left its world in order (each
+# agent in 'agents' once, and the shootable ones in the spatial index),
+# and plays a medium asteroid being shot twice in one tick, where the
+# second photon blows up shrapnel the first one made.
+#
+
+def asteroid_cascade(headless, vectorized, seed, size=150):
+    # 'size' large asteroids; every few ticks the oldest asteroid
+    # explodes, so larges break into mediums, mediums into smalls,
+    # and smalls into embers.
+    game = PlayAsteroids.PlayAsteroids(headless=headless, vectorized=vectorized, seed=seed)
+    for _ in range(size):
+        PlayAsteroids.LargeAsteroid(game)
+    def drive(tick):
+        if tick % 3 == 0:
+            for agent in game.agents:
+                if isinstance(agent, PlayAsteroids.Asteroid):
+                    agent.explode()
+                    break
+        if tick % 50 == 0:
+            PlayAsteroids.LargeAsteroid(game)
+    return game, drive
+
+def asteroid_contacts(headless, vectorized, seed, size=2000, radius=0.3):
+    # 'size' pebble-sized asteroids bouncing off each other, everywhere
+    # in the world and across its edges, through contacts.py.
+    game = PlayAsteroids.PlayAsteroids(headless=headless, vectorized=vectorized, seed=seed)
+    for _ in range(size):
+        position = game.bounds.point_at(game.random.random(), game.random.random())
+        pebble = PlayAsteroids.SmallAsteroid(position, game)
+        pebble.radius = radius
+    game.index.max_radius = radius
+    contacts.Contacts(game).on(PlayAsteroids.Asteroid, PlayAsteroids.Asteroid, contacts.bounce)
+    def drive(tick):
+        pass
+    return game, drive
+
+def dogfight_multishot(headless, vectorized, seed):
+    # Both ships hold fire with multishot and reverse shots, while
+    # player one circles and player two chases a moving mouse. Ships are
+    # healed every tick, so the shooting never stops.
+    game = dogfight.PlayDogfight(headless=headless, vectorized=vectorized, seed=seed)
+    for ship in (game.ship_one, game.ship_two):
+        ship.multiShot = 3
+        ship.has_reverseShot = True
+        ship.shotTimer = 0
+    def drive(tick):
+        for ship in (game.ship_one, game.ship_two):
+            ship.hp = ship.hpMax
+        game.ship_one.turn_left()
+        game.ship_one.speed_up()
+        game.ship_one.shoot()
+        game.ship_two.shoot()
+        angle = tick / 40.0
+        game.mouse_position = Point2D(20.0 * math.cos(angle), 15.0 * math.sin(angle))
+    return game, drive
+
+def pong_rally(headless, vectorized, seed):
+    # Both paddles always meet the ball, so the rally never ends.
+    game = PlayPong.PlayPong(headless=headless, vectorized=vectorized, seed=seed)
+    def drive(tick):
+        if game.ball == None:
+            game.ticks_before_start = 0
+            return
+        game.serving = False
+        for paddle in (game.left_paddle, game.right_paddle):
+            paddle.position.y = game.ball.position.y
+            paddle.keep_within_bounds()
+    return game, drive
+
+SCENES = {
+    'asteroid_cascade':   asteroid_cascade,
+    'asteroid_contacts':  asteroid_contacts,
+    'dogfight_multishot': dogfight_multishot,
+    'pong_rally':         pong_rally,
+}
+
+def play(scene, ticks, headless, vectorized, seed, found=None):
+    # Scenes print nothing: the games report on every hit and point.
+    pool.clear()
+    with contextlib.redirect_stdout(io.StringIO()):
+        game, drive = SCENES[scene](headless, vectorized, seed)
+        clock = time.perf_counter
+        times = []
+        for tick in range(ticks):
+            start = clock()
+            drive(tick)
+            game.update()
+            times.append(clock() - start)
+    if found != None:
+        for problem in problems(game):
+            print("%s: %s" % (scene, problem))
+            found.append(problem)
+    if not headless:
+        game.root.destroy()
+    return times
+
+def problems(game):
+    # What is out of order in a world between ticks.
+    found = []
+    if len(game.agents) != len(game.slots) or len(set(game.agents)) != len(game.agents):
+        found.append("%d agents but %d slots" % (len(game.agents), len(game.slots)))
+    for agent in game.agents:
+        if game.slots.get(agent) == None or game.agents[game.slots[agent]] is not agent:
+            found.append("%s is in the wrong slot" % type(agent).__name__)
+        if agent.radius != None and agent not in game.index.where:
+            found.append("%s is missing from the index" % type(agent).__name__)
+    for agent in game.index.where:
+        if agent not in game.slots:
+            found.append("%s is in the index but not in the world" % type(agent).__name__)
+    return found
+
+def shot_twice(vectorized, seed):
+    # Two photons from the same place hit a medium asteroid in one tick:
+    # the first breaks it up, the second a piece of it, which must not
+    # turn up in the world afterwards.
+    pool.clear()
+    with contextlib.redirect_stdout(io.StringIO()):
+        game = PlayAsteroids.PlayAsteroids(headless=True, vectorized=vectorized, seed=seed)
+        target = PlayAsteroids.MediumAsteroid(game.bounds.point_at(0.5, 0.5), game)
+        target.velocity.set(0.0, 0.0)
+        ship = game.ship
+        ship.position.set(target.position.x, target.position.y - 1.2)
+        ship.angle = 90.0
+        ship.shoot()
+        ship.shoot()
+        game.update()
+    found = problems(game)
+    shrapnel = [a for a in game.agents if isinstance(a, PlayAsteroids.ShrapnelAsteroid)]
+    if len(shrapnel) != game.number_of_shrapnel or len(shrapnel) != PlayAsteroids.MediumAsteroid.SHRAPNEL_PIECES - 1:
+        found.append("%d pieces of shrapnel, counted %d" % (len(shrapnel), game.number_of_shrapnel))
+    return found
+
+def percentile(ordered, p):
+    return ordered[min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))]
+
+def measure(scene, ticks, headless, vectorized, seed, found=None):
+    times = play(scene, ticks, headless, vectorized, seed, found)
+    ordered = sorted(times)
+    tracemalloc.start()
+    play(scene, ticks, headless, vectorized, seed)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        'ticks_per_second': ticks / sum(times),
+        'p50_ms':  percentile(ordered, 50) * 1000.0,
+        'p95_ms':  percentile(ordered, 95) * 1000.0,
+        'p99_ms':  percentile(ordered, 99) * 1000.0,
+        'max_ms':  ordered[-1] * 1000.0,
+        'peak_kb': peak / 1024.0,
+    }
+
+def can_render():
+    try:
+        from tkinter import Tk
+        Tk().destroy()
+        return True
+    except Exception:
+        return False
+
+def report(results, baseline, tolerance):
+    # Print the results (and how they compare); True if none regressed.
+    ok = True
+    columns = ('ticks_per_second', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms', 'peak_kb')
+    print("%-28s" % "scene" + "".join("%18s" % c for c in columns))
+    for name, result in results.items():
+        row = "%-28s" % name
+        old = baseline.get(name)
+        for column in columns:
+            cell = "%.1f" % result[column]
+            if old != None and column in old and old[column] > 0:
+                change = (result[column] - old[column]) / old[column] * 100.0
+                cell += " (%+.0f%%)" % change
+            row += "%18s" % cell
+        print(row)
+        if old != None and result['ticks_per_second'] < old['ticks_per_second'] * (1.0 - tolerance):
+            print("    ^ slower than the baseline")
+            ok = False
+    return ok
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmark stress scenes for Asteroids, Dogfight and Pong.")
+    parser.add_argument('--scenes', default=",".join(SCENES), help="comma-separated scenes to run")
+    parser.add_argument('--ticks', type=int, default=600)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--vectorized', action='store_true', help="use the NumPy integrator (and particle emitter, projectile store and renderer) where the game has one")
+    parser.add_argument('--render', action='store_true', help="also run every scene drawn in a Tk window")
+    parser.add_argument('--save', help="store the results as a baseline JSON file")
+    parser.add_argument('--compare', help="compare against a baseline JSON file")
+    parser.add_argument('--tolerance', type=float, default=0.10)
+    parser.add_argument('--check', action='store_true', help="also check that every world stays in order (see above)")
+    args = parser.parse_args(argv)
+
+    modes = ['headless']
+    if args.render:
+        if can_render():
+            modes.append('rendered')
+        else:
+            print("No display, so only headless scenes were run.")
+
+    found = [] if args.check else None
+    if args.check:
+        for problem in shot_twice(args.vectorized, args.seed):
+            print("shot_twice: %s" % problem)
+            found.append(problem)
+
+    results = {}
+    for scene in args.scenes.split(","):
+        for mode in modes:
+            name = scene + "/" + mode
+            results[name] = measure(scene, args.ticks, mode == 'headless', args.vectorized, args.seed, found)
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    ok = report(results, baseline, args.tolerance)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    return 0 if ok and not found else 1
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
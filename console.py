@@ -0,0 +1,125 @@
+import atexit
+import collections
+import queue
+import sys
+import threading
+
+#
+# console.py
+#
+# Where Game.report's lines go. Reporting a line only queues it; the
+# game calls 'flush' once per frame (or per tick, headless), and
+# everything queued since goes out in one piece:
+#
+#   - into the game's Text widget, as a single insert, after which the
+#     oldest lines are deleted so the widget never holds more than
+#     MAX_LINES (it used to grow for as long as the game ran, and the
+#     bigger it got the slower every repaint was);
+#
+#   - or, without a widget, to standard output, written by a
+#     background thread so the game never waits on the terminal;
+#
+#   - or, given a 'sink', to that: it is called with each chunk (the
+#     match server sends them to the match's players).
+#
+# Lines written to standard output are never dropped; 'drain' (also
+# run at exit) waits until they have all been written.
+#
+# Lines are queued on a SimpleQueue, so a game simulating on another
+# thread (see Game.run) can report while the Tk thread flushes.
+#
+
+class Console:
+
+    MAX_LINES = 500 # lines kept in the Text widget
+
+    def __init__(self, text=None, max_lines=None, sink=None):
+        self.text      = text
+        self.max_lines = self.MAX_LINES if max_lines == None else max_lines
+        self.lines     = 0 # lines now in the widget
+        self.pending   = queue.SimpleQueue()
+        self.sink      = sink
+
+    def write(self, line):
+        # 'line' ends with a newline.
+        self.pending.put(line)
+
+    def flush(self):
+        if self.pending.empty():
+            return
+        if self.text == None:
+            lines = []
+        else:
+            # Only the last max_lines could be shown anyway.
+            lines = collections.deque(maxlen=self.max_lines)
+        try:
+            while True:
+                lines.append(self.pending.get_nowait())
+        except queue.Empty:
+            pass
+        chunk = "".join(lines)
+        if self.sink != None:
+            self.sink(chunk)
+            return
+        if self.text == None:
+            WRITER.write(sys.stdout, chunk)
+            return
+        self.text.insert('end', chunk)
+        self.lines += chunk.count("\n")
+        if self.lines > self.max_lines:
+            self.text.delete('1.0', '%d.0' % (self.lines - self.max_lines + 1))
+            self.lines = self.max_lines
+        self.text.see('end')
+
+    def close(self):
+        # Write out what is left. (A widget is not worth updating when
+        # the game is over; it may already be gone.)
+        if self.text == None:
+            self.flush()
+            if self.sink == None:
+                WRITER.drain()
+
+
+class Writer:
+    # One background thread that writes (stream, text) chunks in the
+    # order they were handed over. The stream is the sys.stdout of the
+    # moment the chunk was flushed, so redirect_stdout still works.
+
+    def __init__(self):
+        self.chunks = queue.SimpleQueue()
+        self.thread = None
+        self.lock   = threading.Lock()
+
+    def write(self, stream, chunk):
+        if stream == None:
+            return
+        if self.thread == None:
+            with self.lock:
+                if self.thread == None:
+                    self.thread = threading.Thread(target=self.run, name="console writer", daemon=True)
+                    self.thread.start()
+        self.chunks.put((stream, chunk))
+
+    def run(self):
+        while True:
+            stream, chunk = self.chunks.get()
+            if stream == None: # from 'drain'
+                chunk.set()
+                continue
+            try:
+                stream.write(chunk)
+                stream.flush()
+            except (OSError, ValueError): # closed or gone
+                pass
+
+    def drain(self):
+        # Wait until everything handed over so far is written.
+        if self.thread == None:
+            return
+        done = threading.Event()
+        self.chunks.put((None, done))
+        done.wait()
+
+
+WRITER = Writer()
+atexit.register(WRITER.drain)
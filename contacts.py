@@ -0,0 +1,252 @@
+import math
+
+#
+# contacts.py
+#
+# Finds the pairs of bodies that touch each other, once per tick, and
+# hands each pair to a callback chosen by the two bodies' classes:
+#
+#   contacts = Contacts(world)      # becomes world.contacts
+#   contacts.on(Ship, Asteroid, crash)
+#   contacts.on(Asteroid, Asteroid, bounce)
+#
+# A body is anything in the world's spatial index, i.e. anything with a
+# 'radius' (the Shootables), and two bodies touch when their discs
+# overlap. 'on(A, B, f)' calls f(a, b) with the A first, for every pair
+# of an A and a B that touch; subclasses count, and the most specific
+# registration wins. Pairs nothing is registered for cost almost
+# nothing.
+#
+# Game.update runs the pass after every agent has moved and the tick's
+# spawns and removals are applied, so a callback may explode or move
+# bodies as it likes. Bodies that leave are skipped in the pairs that
+# are left.
+#
+# The pass is sweep-and-prune along x: every disc is an interval
+# [x - r, x + r], the intervals are sorted, and each one only meets the
+# ones that start before it ends. So that a crowded world doesn't have
+# every disc overlapping dozens of others in x alone, the world is
+# first cut into horizontal bands about as tall as the largest disc,
+# and each band is swept on its own; a disc goes into every band it
+# reaches into, and a pair is only reported by the band its overlap
+# starts in. The pass grows with the number of bodies plus the number
+# of near misses, not with the number of pairs.
+#
+# In a wrapped world a disc that sticks out past the left or right
+# edge also gets a "ghost" on the other side, and y distances (and
+# bands) wrap round the top and bottom.
+#
+# Pairs come out in the order of world.agents, whatever order the
+# sweep found them in, so a game with contacts stays deterministic.
+#
+
+class Contacts:
+
+    MAX_BANDS = 64
+
+    def __init__(self, world):
+        self.world     = world
+        self.callbacks = {}  # (class, class) -> callback
+        self.resolved  = {}  # (type, type) -> (callback, swapped) or None
+        self.interested = {} # type -> whether any callback involves it
+        world.contacts = self
+
+    def on(self, first, second, callback):
+        self.callbacks[(first, second)] = callback
+        self.resolved = {}
+        self.interested = {}
+
+    def callback_for(self, a, b):
+        # The callback for a pair of these types, and whether it wants
+        # them the other way round.
+        key = (type(a), type(b))
+        found = self.resolved.get(key, False)
+        if found is not False:
+            return found
+        found = None
+        for first in type(a).__mro__:
+            for second in type(b).__mro__:
+                callback = self.callbacks.get((first, second))
+                if callback != None:
+                    found = (callback, False)
+                    break
+                callback = self.callbacks.get((second, first))
+                if callback != None:
+                    found = (callback, True)
+                    break
+            if found != None:
+                break
+        self.resolved[key] = found
+        return found
+
+    def involved(self, body):
+        # Whether any callback could want 'body' at all.
+        kind = type(body)
+        found = self.interested.get(kind)
+        if found == None:
+            classes = set(cls for pair in self.callbacks for cls in pair)
+            found = any(cls in classes for cls in kind.__mro__)
+            self.interested[kind] = found
+        return found
+
+    def pairs(self):
+        # Every touching (a, b), each pair once, a before b in the
+        # order of world.agents.
+        world  = self.world
+        bounds = world.bounds
+        slots  = world.slots
+        wrapped = world.topology == 'wrapped'
+        width  = bounds.width()
+        height = bounds.height()
+        ymin   = bounds.ymin
+
+        integrator = world.integrator
+        if integrator != None:
+            xs = integrator.position[:integrator.count, 0].tolist()
+            ys = integrator.position[:integrator.count, 1].tolist()
+        bodies = []
+        largest = 0.0
+        interested = self.interested
+        for body in world.index.where:
+            wanted = interested.get(type(body))
+            if wanted == None:
+                wanted = self.involved(body)
+            if wanted and body in slots:
+                row = body.row if integrator != None else None
+                if row != None:
+                    x, y = xs[row], ys[row]
+                else:
+                    p = body.position
+                    x, y = p.x, p.y
+                r = body.radius
+                bodies.append((x, y, r, slots[body], body))
+                if r > largest:
+                    largest = r
+
+        # The bands, each as tall as the widest disc (but no more than
+        # MAX_BANDS of them), so a disc is in one or two.
+        count = 1 if largest == 0.0 else max(1, min(self.MAX_BANDS, int(height / (2.0 * largest))))
+        band_height = height / count
+        bands = [[] for n in range(count)]
+        ghosted = set()
+        for x, y, r, slot, body in bodies:
+            entry = (x - r, slot, x + r, x, y, r, body)
+            ghost = None
+            if wrapped and (x - r < bounds.xmin or x + r >= bounds.xmax):
+                shift = width if x - r < bounds.xmin else -width
+                ghost = (x - r + shift, slot, x + r + shift, x + shift, y, r, body)
+                ghosted.add(body)
+            first = int((y - r - ymin) // band_height)
+            last  = int((y + r - ymin) // band_height)
+            for band in (first,) if first == last else (first, last):
+                band = band % count if wrapped else min(max(band, 0), count - 1)
+                bands[band].append(entry)
+                if ghost != None:
+                    bands[band].append(ghost)
+
+        found = []
+        seen = set() # pairs with a ghost in them, which can turn up twice
+        half = height / 2.0
+        for band, entries in enumerate(bands):
+            entries.sort() # (start, slot) is never the same twice, so bodies are never compared
+            n = len(entries)
+            for i in range(n):
+                start, slot_a, end, xa, ya, ra, a = entries[i]
+                for j in range(i + 1, n):
+                    entry = entries[j]
+                    if entry[0] >= end:
+                        break
+                    b = entry[6]
+                    if b is a:
+                        continue
+                    dy = entry[4] - ya
+                    if wrapped:
+                        if dy > half:
+                            dy -= height
+                        elif dy < -half:
+                            dy += height
+                    reach = ra + entry[5]
+                    if dy >= reach or dy <= -reach:
+                        continue
+                    dx = entry[3] - xa
+                    if dx * dx + dy * dy >= reach * reach:
+                        continue
+                    # Both discs are in every band their overlap is in;
+                    # count the pair in the one where it starts.
+                    overlap = max(ya - ra, ya + dy - entry[5])
+                    home = int((overlap - ymin) // band_height)
+                    home = home % count if wrapped else min(max(home, 0), count - 1)
+                    if home != band:
+                        continue
+                    pair = (a, b) if slot_a < entry[1] else (b, a)
+                    if a in ghosted or b in ghosted:
+                        if pair in seen:
+                            continue
+                        seen.add(pair)
+                    found.append(pair)
+        found.sort(key=lambda pair: (slots[pair[0]], slots[pair[1]]))
+        return found
+
+    def step(self):
+        world = self.world
+        slots = world.slots
+        for a, b in self.pairs():
+            if a not in slots or b not in slots:
+                continue # left in an earlier callback
+            found = self.callback_for(a, b)
+            if found == None:
+                continue
+            callback, swapped = found
+            if swapped:
+                callback(b, a)
+            else:
+                callback(a, b)
+
+
+def bounce(a, b):
+    # A callback: the two bodies bounce off each other like billiard
+    # balls, weighing as much as their areas. Bodies already moving
+    # apart are left alone, so a pair that overlaps for a few ticks
+    # only bounces once. With an integrator, the bodies' rows are read
+    # and written directly.
+    world = a.world
+    integrator = world.integrator
+    if integrator != None and a.row != None and b.row != None:
+        position, velocity = integrator.position, integrator.velocity
+        ra, rb = a.row, b.row
+        ax, ay, bx, by = position.item(ra, 0), position.item(ra, 1), position.item(rb, 0), position.item(rb, 1)
+        vax, vay, vbx, vby = velocity.item(ra, 0), velocity.item(ra, 1), velocity.item(rb, 0), velocity.item(rb, 1)
+    else:
+        position = None
+        pa, pb, va, vb = a.position, b.position, a.velocity, b.velocity
+        ax, ay, bx, by = pa.x, pa.y, pb.x, pb.y
+        vax, vay, vbx, vby = va.dx, va.dy, vb.dx, vb.dy
+    dx, dy = bx - ax, by - ay # as world.offset(b.position, a.position)
+    if world.topology == 'wrapped':
+        w = world.bounds.width()
+        h = world.bounds.height()
+        if dx > w/2.0:
+            dx -= w
+        elif dx < -w/2.0:
+            dx += w
+        if dy > h/2.0:
+            dy -= h
+        elif dy < -h/2.0:
+            dy += h
+    distance = math.sqrt(dx*dx + dy*dy)
+    if distance == 0.0:
+        return
+    nx, ny = dx / distance, dy / distance
+    closing = (vax - vbx) * nx + (vay - vby) * ny
+    if closing <= 0.0:
+        return
+    ma, mb = a.radius * a.radius, b.radius * b.radius
+    push = 2.0 * closing / (ma + mb)
+    if position is not None:
+        velocity[ra, 0] = vax - push * mb * nx
+        velocity[ra, 1] = vay - push * mb * ny
+        velocity[rb, 0] = vbx + push * ma * nx
+        velocity[rb, 1] = vby + push * ma * ny
+    else:
+        a.velocity = va.set(vax - push * mb * nx, vay - push * mb * ny)
+        b.velocity = vb.set(vbx + push * ma * nx, vby + push * ma * ny)
@@ -1,18 +1,40 @@
 from tkinter import *
 from Game import Game, Agent
-from geometry import Point2D, Vector2D
+from geometry import Point2D, Vector2D, heading, time_of_impact
+from pool import Pooled
 import math
-import random
+import replay
+import sys
 import time
 
 TIME_STEP = 0.5
 
 class MovingBody(Agent):
     '''Parent class for anything that moves. Pretty sure these are all just default values in case the child class doesn't specify any of them.'''
+    row              = None #Row of the world's integrator holding this body, if the world has one (see integrator.py)
+    SLOWDOWN_IN_BULK = None #Set to a slowdown to let the integrator do steer() for every such body at once
+    SNAPSHOT         = Agent.SNAPSHOT + (('velocity','V'), ('accel','V'))
+
     def __init__(self, p0, v0, world):
         self.velocity = v0
         self.accel    = Vector2D(0.0,0.0)
-        Agent.__init__(self,p0,world)
+        Agent.__init__(self,p0.copy(),world) #copied because update() moves the position in place, and p0 is often another body's position
+        if world.integrator != None:
+            world.integrator.add(self)
+
+    @classmethod
+    def spawn(cls, *args):
+        '''Make a new one. Pooled classes reuse one that left instead (see pool.py)'''
+        return cls(*args)
+
+    def rejoin(self, world):
+        '''Put a body that has left its world back into one, as if it was just made. Used by respawn()'''
+        self.accel.set(0.0,0.0)
+        self.ticks = 0
+        self.world = world
+        world.add(self)
+        if world.integrator != None:
+            world.integrator.add(self)
 
     def color(self):
         return "#000080"
@@ -24,19 +46,35 @@ class MovingBody(Agent):
         p4 = self.position + Vector2D( 0.125,-0.125)
         return [p1,p2,p3,p4]
 
+    OUTLINE = ((0.125, 0.125), (-0.125, 0.125), (-0.125, -0.125), (0.125, -0.125))
+    def outline(self):
+        '''The shape as corners around the position, for render.py'''
+        return self.OUTLINE, None
+
     def steer(self):
-        return Vector2D(0.0)
+        return self.accel.set(0.0,0.0)
 
     def update(self):
-        self.position = self.position + self.velocity * TIME_STEP
-        self.velocity = self.velocity + self.accel * TIME_STEP
+        if self.row != None:
+            '''The integrator already moved every body this tick, so only steering is left. Bodies that never steer keep their zero accel'''
+            if self.SLOWDOWN_IN_BULK == None and type(self).steer is not MovingBody.steer:
+                self.accel = self.steer()
+            return
+        self.position.scale_add(self.velocity, TIME_STEP) #in place, so no new vectors each tick
+        self.velocity.scale_add(self.accel, TIME_STEP)
         self.accel    = self.steer()
         self.world.trim(self)
 
+    def leave(self):
+        if self.row != None:
+            self.world.integrator.remove(self)
+        Agent.leave(self)
+
 class Shootable(MovingBody):
     '''Parent class for anything that can be shot'''
     SHRAPNEL_CLASS  = None
     SHRAPNEL_PIECES = 0
+    SNAPSHOT        = MovingBody.SNAPSHOT + (('radius','d'), ('has_Shield','?'))
     is_powerup = False
 
     def __init__(self, position0, velocity0, radius, world):
@@ -45,65 +83,109 @@ class Shootable(MovingBody):
         MovingBody.__init__(self, position0, velocity0, world)
 
     def is_hit_by(self, photon):
+        return self.hit_time(photon) != None
+
+    def hit_time(self, photon):
+        '''When during this tick's move (0 to 1) the photon first touched us, or None if it didn't. The whole path is checked so fast photons can't skip past small targets'''
         if photon.player_one == self.player_one and self.is_powerup == False: #Players can't shoot themselves
-            return False
-        return ((self.position - photon.position).magnitude() < self.radius)
+            return None
+        travel = photon.velocity * TIME_STEP
+        start = self.world.offset(photon.position, self.position) - travel #shortest way across the world's edge, from where the photon ends up
+        return time_of_impact(start, travel, self.radius)
 
     def explode(self):
         if self.has_Shield:
             self.has_Shield = False
             #print("Shielded!") #Debugging
-            self.SHRAPNEL_CLASS(self.position,self.world)
+            self.shrapnel(1)
         else:
             self.hp -= 1
             if self.is_powerup == False:
+                self.times_hit += 1
                 self.world.hpReport()
             if self.hp > 0: #If the shot doesn't kill, create some shrapnel (embers for ships, nothing for asteroids since they only have 1 hp)
-                for x in range(self.hpMax - self.hp): #Produce more shrapnel as health decreases, always making at least one
-                    self.SHRAPNEL_CLASS(self.position,self.world)
+                self.shrapnel(self.hpMax - self.hp) #Produce more shrapnel as health decreases, always making at least one
             else:
                 if self.SHRAPNEL_CLASS == None:
                     '''Return None if the object doesn't create shrapnel when destroyed'''
                     return
-                for x in range(self.SHRAPNEL_PIECES):
-                    '''Otherwise, make objects in the object's shrapnel class at its position SHRAPNEL_PIECES number of times'''
-                    self.SHRAPNEL_CLASS(self.position,self.world)
+                '''Otherwise, make objects in the object's shrapnel class at its position SHRAPNEL_PIECES number of times'''
+                self.shrapnel(self.SHRAPNEL_PIECES)
                 self.world.ship_two.freeze_blue()
                 self.leave()
 
-class Ember(MovingBody):
+    def shrapnel(self, pieces):
+        '''Make pieces of shrapnel at our position. Embers go to the world's particle emitter if it has one (see particles.py)'''
+        if self.SHRAPNEL_CLASS is Ember and self.world.particles != None:
+            self.world.particles.emit(self.position, pieces)
+            return
+        for x in range(pieces):
+            self.SHRAPNEL_CLASS.spawn(self.position,self.world)
+
+class Ember(Pooled, MovingBody):
     '''Little sparks that come off when an asteroid is destroyed'''
     INITIAL_SPEED = 2.0
     SLOWDOWN      = 0.2
     TOO_SLOW      = INITIAL_SPEED / 20.0
+    SLOWDOWN_IN_BULK = SLOWDOWN
 
     def __init__(self, position0, world):
-        velocity0 = Vector2D.random() * self.INITIAL_SPEED
+        velocity0 = Vector2D.random(rng=world.random) * self.INITIAL_SPEED
         MovingBody.__init__(self, position0, velocity0, world)
 
+    def respawn(self, position0, world):
+        angle = world.random.random() * 2 * math.pi #same draw as Vector2D.random()
+        self.position.set(position0.x, position0.y)
+        self.velocity.set(math.cos(angle) * self.INITIAL_SPEED, math.sin(angle) * self.INITIAL_SPEED)
+        self.rejoin(world)
+
+    COLORS        = ("#FFFFFF", "#FF8080", "#808040") #white-hot, burning, smoldering
+    BANDS         = (0.5, 0.25) #Fractions of INITIAL_SPEED below which an ember turns the next color
+
     def color(self):
-        white_hot  = "#FFFFFF"
-        burning    = "#FF8080"
-        smoldering = "#808040"
         speed = self.velocity.magnitude()
-        if speed / self.INITIAL_SPEED > 0.5:
-            return white_hot
-        if speed / self.INITIAL_SPEED > 0.25:
-            return burning
-        return smoldering
+        if speed / self.INITIAL_SPEED > self.BANDS[0]:
+            return self.COLORS[0]
+        if speed / self.INITIAL_SPEED > self.BANDS[1]:
+            return self.COLORS[1]
+        return self.COLORS[2]
 
     def steer(self):
-        return -self.velocity.direction() * self.SLOWDOWN
+        '''Slow down against the direction of motion. Reuses self.accel instead of making new vectors'''
+        speed = self.velocity.magnitude()
+        if speed <= Vector2D.EPSILON:
+            return self.accel.set(0.0,0.0)
+        accel = self.accel.set(self.velocity.dx, self.velocity.dy)
+        accel *= -self.SLOWDOWN / speed
+        return accel
 
     def update(self):
         MovingBody.update(self)
-        if self.velocity.magnitude() < self.TOO_SLOW:
+        if self.row != None:
+            speed = self.world.integrator.speed_of(self.row) #already worked out in bulk
+        else:
+            speed = self.velocity.magnitude()
+        if speed < self.TOO_SLOW:
             self.leave()
 
-class Photon(MovingBody):
+def first_hit(photon):
+    '''The Shootable the photon ran into first on its way this tick, if any'''
+    travel = photon.velocity.magnitude() * TIME_STEP
+    first = None
+    for t in photon.world.index.query(photon.position, travel): #only the Shootables near the photon's path
+        when = t.hit_time(photon)
+        if when != None and (first == None or when < first_time):
+            first, first_time = t, when
+    return first
+
+class Photon(Pooled, MovingBody):
     '''Projectiles that the player shoots out'''
     INITIAL_SPEED = 2.6
     LIFETIME      = 30 #Measured in tics, not distance travelled
+    SHAPES        = {True:  ((0, 0.4), (-0.4, 0), (0, -0.4), (0.4, 0)), #Player one's photons are diamonds
+                     False: ((0.125, 0.125), (-0.125, 0.125), (-0.125, -0.125), (0.125, -0.125))}
+    COLORS        = {True: "#ffaaa1", False: "#93c5fc"} #Player one is red
+    SNAPSHOT      = MovingBody.SNAPSHOT + (('reversed','d'), ('player_one','?'), ('age','i'))
 
     def __init__(self,source,world, player_one, reverse):
         if reverse:
@@ -116,39 +198,49 @@ class Photon(MovingBody):
         '''v0 = source.velocity + (source.get_heading() * self.INITIAL_SPEED) * self.reversed #Photons inherit the player's momentum. When testing the game, we should try having a version where photons don't do this'''
         MovingBody.__init__(self, source.position, v0, world)
 
+    def respawn(self, source, world, player_one, reverse):
+        if reverse:
+            self.reversed = -1.0
+        else:
+            self.reversed = 1.0
+        self.player_one = player_one
+        self.age  = 0
+        self.position.set(source.position.x, source.position.y)
+        self.velocity.set(0.0,0.0).scale_add(source.get_heading(), self.INITIAL_SPEED * self.reversed)
+        self.rejoin(world)
+
     def color(self):
-        if self.player_one: #Player one is red
-            return "#ffaaa1"
-        return "#93c5fc"
+        return self.COLORS[self.player_one]
 
     def shape(self):
-        if self.player_one:
-            p1 = self.position + Vector2D( 0, 0.4)
-            p2 = self.position + Vector2D(-0.4, 0)
-            p3 = self.position + Vector2D(0,-0.4)
-            p4 = self.position + Vector2D( 0.4,0)
-            return [p1,p2,p3,p4]
-        else:
-            p1 = self.position + Vector2D( 0.125, 0.125)
-            p2 = self.position + Vector2D(-0.125, 0.125)
-            p3 = self.position + Vector2D(-0.125,-0.125)
-            p4 = self.position + Vector2D( 0.125,-0.125)
-            return [p1,p2,p3,p4]
+        return [self.position + Vector2D(dx, dy) for dx, dy in self.SHAPES[self.player_one]]
+
+    def outline(self):
+        return self.SHAPES[self.player_one], None
 
     def update(self):
         MovingBody.update(self)
         self.age += 1
         if self.age >= self.LIFETIME:
             self.leave()
-        else:
-            targets = [a for a in self.world.agents if isinstance(a,Shootable)]
-            for t in targets:
-                if t.is_hit_by(self):
-                    if t.is_powerup == True:
-                        t.player_one = self.player_one
-                    t.explode()
-                    self.leave()
-                    return
+        elif photon_hits(self):
+            self.leave()
+
+def photon_hits(photon):
+    '''Whether the photon hit something this tick, blowing it up if so. Also used for the photons kept in a projectile store (see projectiles.py)'''
+    t = first_hit(photon)
+    if t == None:
+        return False
+    if t.is_powerup == True:
+        t.player_one = photon.player_one
+    t.explode()
+    return True
+
+def photon_side(target):
+    '''Whose photons pass through the target (a player can't shoot themselves, see Shootable.hit_time), or None. For the projectile store, so it doesn't check photons against their own ship'''
+    if target.is_powerup:
+        return None
+    return target.player_one
 
 class Ship(Shootable):
     #Shootable variables
@@ -169,10 +261,16 @@ class Ship(Shootable):
     MAX_SPEED      = 2
     DRAG           = 0.05 #Amount of drag applied to a player who isn't inputting anything.
 
+    SNAPSHOT = Shootable.SNAPSHOT + (('player_one','?'), ('hp','i'), ('hpMax','i'), ('SCALE','d'),
+                                     ('angle','d'), ('impulse','i'), ('lrImpulse','i'), ('mBungee','d'), ('freeze','V'),
+                                     ('shotTimer','i'), ('shootDelay','i'),
+                                     ('has_reverseShot','?'), ('multiShot','i'), ('times_multiShot','i'),
+                                     ('times_hit','i'), ('powerups','i'))
+
     def __init__(self, world, player_one):
         self.player_one = player_one
         self.shotTimer = 120 #Players can shoot two seconds after spawning
-        self.shootDelay = 20 #Delay between shots
+        self.shootDelay = 10 #Delay between shots
         if not self.player_one:
             self.hpMax = 5
         self.hp = self.hpMax
@@ -196,6 +294,10 @@ class Ship(Shootable):
         self.multiShot = 0 #Number of times the player will multishot
         self.times_multiShot = 0 #Counter to make sure that the player is multishotting the correct num of times
 
+        '''Match statistics (see sweep.py)'''
+        self.times_hit = 0 #Shots that cost this ship health
+        self.powerups = 0 #Power-ups this ship collected
+
     def color(self):
         if self.player_one: #Player one is red
             if self.has_Shield == True or self.shotTimer > (self.shootDelay - self.colorFrames):
@@ -211,22 +313,30 @@ class Ship(Shootable):
 
     def get_heading(self):
         if self.player_one:
-            angle = self.angle * math.pi / 180.0
-            return Vector2D(math.cos(angle), math.sin(angle))
+            return heading(self.angle) #from a table, since the ship turns by whole degrees
         else:
-            if self.world.ship_one.hp == 0:
-                mouseShip = self.freeze
-            else: #Stop tracking the mouse position if player one has died
-                mouseShip = Vector2D(self.world.mouse_position.x - self.position.x, self.world.mouse_position.y - self.position.y) #Draw a line between mouse and ship
+            mouseShip = self.mouse_offset()
             msMagnitude = mouseShip.magnitude()
-            mouseShip = mouseShip * msMagnitude**-1 #makes the magnitude of the vector 1, which is necessary for other code to work because magnitude affects how large the ship is drawn.
-
-            #Accelerate ship
-            self.speed_up()
-            self.mBungee = msMagnitude ** 0.5 #The further the mouse is from the ship, the faster it will move later in the code. The **0.5 is so that the ship doesn't go too fast and isn't too reactive.
-            if self.velocity.magnitude() > self.MAX_SPEED: #I made my own speedcap because the existing one doesn't work
-                self.slow_down()
-            return mouseShip
+            return mouseShip * msMagnitude**-1 #makes the magnitude of the vector 1, which is necessary for other code to work because magnitude affects how large the ship is drawn.
+
+    def mouse_offset(self):
+        if self.world.ship_one.hp == 0:
+            return self.freeze
+        else: #Stop tracking the mouse position if player one has died
+            return Vector2D(self.world.mouse_position.x - self.position.x, self.world.mouse_position.y - self.position.y) #Draw a line between mouse and ship
+
+    def follow_mouse(self):
+        # Player two always accelerates towards the mouse. This used to
+        # happen in get_heading, i.e. whenever the ship was drawn, so
+        # the ship moved differently (or not at all, headless) depending
+        # on the frame rate; now it happens once per tick, in steer.
+        msMagnitude = self.mouse_offset().magnitude()
+
+        #Accelerate ship
+        self.speed_up()
+        self.mBungee = msMagnitude ** 0.5 #The further the mouse is from the ship, the faster it will move later in the code. The **0.5 is so that the ship doesn't go too fast and isn't too reactive.
+        if self.velocity.magnitude() > self.MAX_SPEED: #I made my own speedcap because the existing one doesn't work
+            self.slow_down()
 
     def turn_left(self):
         #self.angle += 360.0 / self.TURNS_IN_360
@@ -251,13 +361,18 @@ class Ship(Shootable):
             self.times_multiShot = 0
             self.shotTimer = self.shootDelay
     def shooting(self):
-        Photon(self, self.world, self.player_one, False)
+        projectiles = self.world.projectiles
+        if projectiles != None: #photons as arrays, not agents (see projectiles.py)
+            v0 = self.get_heading() * Photon.INITIAL_SPEED
+            projectiles.fire(self.position, v0, self.player_one)
+            if self.has_reverseShot:
+                projectiles.fire(self.position, -v0, self.player_one)
+            return
+        Photon.spawn(self, self.world, self.player_one, False)
         if self.has_reverseShot:
-            Photon(self, self.world, self.player_one, True)
+            Photon.spawn(self, self.world, self.player_one, True)
 
     def update(self):
-        if (float(self.hp) * 0.4 <= float(self.hpMax)):
-            self.shootDelay = 10
         if self.shotTimer > 0:
             self.shotTimer -= 1
         if self.multiShot > 0 and self.shotTimer == self.shootDelay - 4 *(self.times_multiShot+1) and self.times_multiShot < self.multiShot:
@@ -269,11 +384,18 @@ class Ship(Shootable):
     def shape(self):
         h  = self.get_heading()
         hperp = h.perp()
-        p1 = self.position + h * 1.5 * self.SCALE #making ships a little longer
-        p2 = self.position + hperp * .5 * self.SCALE
-        p3 = self.position - hperp * .5 * self.SCALE
+        p1 = self.position.copy().scale_add(h, 1.5 * self.SCALE) #making ships a little longer
+        p2 = self.position.copy().scale_add(hperp, .5 * self.SCALE)
+        p3 = self.position.copy().scale_add(hperp,-.5 * self.SCALE)
         return [p1,p2,p3]
 
+    OUTLINES = {} #SCALE -> the shape's corners along and across the heading, for render.py
+    def outline(self):
+        template = self.OUTLINES.get(self.SCALE)
+        if template == None:
+            template = self.OUTLINES[self.SCALE] = ((1.5 * self.SCALE, 0.0), (0.0, .5 * self.SCALE), (0.0, -.5 * self.SCALE))
+        return template, self.get_heading()
+
     def steer(self):
         '''End of Game:'''
         if self.world.ship_one.hp == 0 or self.world.ship_two.hp == 0:
@@ -288,6 +410,8 @@ class Ship(Shootable):
         self.angle += self.lrImpulse * self.TURN_MULTIPLIER #Change in angle slows down as ship loses lrImpulse
 
         '''Moving forward/Backwards:'''
+        if not self.player_one:
+            self.follow_mouse()
         if self.impulse > 0:
             self.impulse -= 1
             return self.get_heading() * self.ACCELERATION * self.mBungee
@@ -303,6 +427,7 @@ class Ship(Shootable):
 
 class PowerUp(Shootable):
     SCALE = 1.25
+    OUTLINE = ((0.0, SCALE), (-SCALE, 0.0), (0.0, -SCALE), (SCALE, 0.0)) #diamonds
     is_powerup = True
     COLOR = "#ffffff"
 
@@ -310,17 +435,25 @@ class PowerUp(Shootable):
     SHRAPNEL_CLASS  = Ember
     SHRAPNEL_PIECES = 2
     hp = 1
+    SNAPSHOT = Shootable.SNAPSHOT + (('player_one','?'), ('START_X','i'), ('START_Y','i'))
 
     def __init__(self, world):
         self.world = world
-        self.START_X = random.randrange(-self.world.worldW//2.0, self.world.worldW//2.0) #spawn locations are a random coordinate in the world. Integer division used to avoid error in random.py
-        self.START_Y = random.randrange(-self.world.worldH//2.0, self.world.worldH//2.0)
+        self.START_X = self.world.random.randrange(int(-self.world.worldW//2.0), int(self.world.worldW//2.0)) #spawn locations are a random coordinate in the world. Integer division used to avoid error in random.py
+        self.START_Y = self.world.random.randrange(int(-self.world.worldH//2.0), int(self.world.worldH//2.0))
         position = Point2D(self.START_X, self.START_Y)
         radius = self.SCALE
         self.player_one = True
 
         Shootable.__init__(self, position, Vector2D(0.0,0.0), radius, world)
 
+    def explode(self):
+        if self.player_one:
+            self.world.ship_one.powerups += 1
+        else:
+            self.world.ship_two.powerups += 1
+        super().explode()
+
     def shape(self):
         p1 = self.position + Vector2D( 0.0, self.SCALE)
         p2 = self.position + Vector2D(-self.SCALE, 0.0)
@@ -358,15 +491,29 @@ class MultiShot(PowerUp):
 class PlayDogfight(Game):
     MIN_DELAY = 90 #minimum delay before spawning a power-up
     MAX_DELAY = 400 #maximum delay before spawning a power-up
+    POWERUPS        = (ReverseLaser, MultiShot, Shield)
+    POWERUP_WEIGHTS = (1, 1, 1) #how likely each kind of power-up is to spawn
 
     hpScale = 3 #Make the hp bars wider/narrower
 
     worldW = 60.0 #world width
     worldH = 45.0 #world height
-    def __init__(self):
-        Game.__init__(self,"Dogfight!",self.worldW,self.worldH,800,600,topology='wrapped',console_lines=6)
-
-        self.before_powerup = random.randint(self.MIN_DELAY, self.MAX_DELAY) #just wanna make this random
+    SNAPSHOT = Game.SNAPSHOT + (('before_powerup','i'), ('ship_one','A'), ('ship_two','A'))
+    def __init__(self, headless=False, vectorized=False, seed=None):
+        Game.__init__(self,"Dogfight!",self.worldW,self.worldH,800,600,topology='wrapped',console_lines=6,headless=headless,seed=seed)
+        if vectorized:
+            from integrator import Integrator # needs NumPy, so only imported when asked for
+            from particles import Emitter
+            from projectiles import Projectiles
+            from render import Renderer
+            self.integrator  = Integrator(self.bounds, self.topology, TIME_STEP)
+            self.particles   = Emitter(self, Ember, TIME_STEP) #embers as arrays, not agents
+            self.projectiles = Projectiles(self, Photon, TIME_STEP, photon_hits, photon_side) #and photons too
+            self.renderer    = Renderer(self) #every agent's shape in one go
+
+        self.index.slack = Ship.MAX_SPEED * TIME_STEP #the farthest a Shootable moves in a tick (power-ups don't)
+
+        self.before_powerup = self.random.randint(self.MIN_DELAY, self.MAX_DELAY) #just wanna make this random
 
         self.ship_one = Ship(self, player_one=True)
         self.ship_two = Ship(self, player_one=False)
@@ -414,18 +561,13 @@ class PlayDogfight(Game):
         if self.before_powerup > 0:
             self.before_powerup -= 1
         elif self.ship_one.hp != 0 and self.ship_two.hp != 0: #Don't spawn powerups if one player is dead
-            spawnChoice = random.randint(1, 3)
-            if spawnChoice == 1:
-                ReverseLaser(self)
-            if spawnChoice == 2:
-                MultiShot(self)
-            if spawnChoice == 3:
-                Shield(self)
-            self.before_powerup = random.randint(self.MIN_DELAY, self.MAX_DELAY)
+            spawnChoice = self.random.choices(self.POWERUPS, self.POWERUP_WEIGHTS)[0]
+            spawnChoice(self)
+            self.before_powerup = self.random.randint(self.MIN_DELAY, self.MAX_DELAY)
 
         Game.update(self)
 
-game = PlayDogfight()
-while not game.GAME_OVER:
-    time.sleep(1.0/60.0)
-    game.update()
+if __name__ == "__main__":
+    game = PlayDogfight()
+    with replay.recording(game, sys.argv[1:]):
+        game.run(threaded='--threaded' in sys.argv[1:]) #simulate on a worker thread
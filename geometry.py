@@ -36,15 +36,46 @@ import math
 #   v.dot(w) : the dot product of v with w (see the description, a float)
 #   v.cross(w) : the cross product (or turn) of v with w (a float)
 #
+# All of the above make a new object. Bodies that update their
+# position and velocity every tick can instead change them in place,
+# which makes no garbage:
+#
+#   p += v, p -= v : move point p by vector v
+#   v += w, v -= w : add/subtract vector w into v
+#   v *= s : scale v by the float factor s
+#   p.set(x,y), v.set(dx,dy) : overwrite the coordinates
+#   p.scale_add(v,s), v.scale_add(w,s) : same as p += v * s, v += w * s
+#
+# These all return the object they changed. Point2D and Vector2D also
+# use __slots__, so each one is just its two floats.
+#
+# The fast_ methods (fast_plus, fast_minus, fast_times, fast_dot,
+# fast_cross) are the same as plus, minus, times, dot and cross but skip
+# the type asserts. Use them in hot loops where the types are known.
+#
 # Finally, we have a 'bounds' class for operating on points within a 2-D
-# rectangular region.
+# rectangular region, and
+#
+#   time_of_impact(start,travel,radius) : when a point moving by
+#     'travel' from 'start' (both relative to a circle's center) first
+#     touches the circle, as a fraction of the move, or None
+#
+# which lets a fast body check its whole path for a hit, not just
+# where it ends up, and
+#
+#   heading(degrees) : the unit vector at an angle, counterclockwise
+#     from the x axis. Ships only ever turn by whole degrees, so for
+#     those it is made from a table of (x, y) worked out once, with no
+#     cos or sin. Each call gives a new vector, free to change.
 #
 
 class Point2D:
 
+    __slots__ = ('x', 'y')
+
     @classmethod
-    def random(cls, bounds):
-        return bounds.point_at(random.random(),random.random())
+    def random(cls, bounds, rng = random):
+        return bounds.point_at(rng.random(),rng.random())
 
     def __init__(self, xCoord=0.0, yCoord=0.0):
         self.x = xCoord
@@ -67,6 +98,34 @@ class Point2D:
         else:
             assert(type(arg) == Vector2D or type(arg) == Point2D)
 
+    def fast_plus(self, offset):
+        return Point2D(self.x+offset.dx, self.y+offset.dy)
+
+    def fast_minus(self, other):
+        return Vector2D(self.x-other.x, self.y-other.y)
+
+    def set(self, xCoord, yCoord):
+        self.x = xCoord
+        self.y = yCoord
+        return self
+
+    def scale_add(self, offset, amount):
+        self.x += offset.dx * amount
+        self.y += offset.dy * amount
+        return self
+
+    def move_by(self, offset):
+        assert(type(offset) == Vector2D)
+        self.x += offset.dx
+        self.y += offset.dy
+        return self
+
+    def move_back_by(self, offset):
+        assert(type(offset) == Vector2D)
+        self.x -= offset.dx
+        self.y -= offset.dy
+        return self
+
     def get(self,coord):
         assert(coord == 0 or coord == 1 or coord == 'x' or coord == 'y')
         if coord == 0 or coord == 'x':
@@ -79,6 +138,8 @@ class Point2D:
 
     __add__  = plus
     __sub__  = minus
+    __iadd__ = move_by
+    __isub__ = move_back_by
     __str__  = to_string
     __repr__ = to_string
     __getitem__ = get
@@ -86,17 +147,22 @@ class Point2D:
 
 class Vector2D:
 
+    __slots__ = ('dx', 'dy')
+
     EPSILON = 0.000001
 
     @classmethod
-    def random(cls,length = 1.0):
-        angle = random.random() * 2 * math.pi
+    def random(cls,length = 1.0, rng = random):
+        angle = rng.random() * 2 * math.pi
         return Vector2D(math.cos(angle), math.sin(angle)) * length
 
     def __init__(self, xOffset=0.0, yOffset=0.0):
         self.dx = xOffset
         self.dy = yOffset
 
+    def copy(self):
+        return Vector2D(self.dx, self.dy)
+
     def perp(self):
         return Vector2D(-self.dy, self.dx)
 
@@ -127,8 +193,51 @@ class Vector2D:
         assert(type(amount) == float)
         return Vector2D(self.dx/amount, self.dy/amount)
 
+    def fast_cross(self, vec):
+        return self.dx*vec.dy - self.dy*vec.dx
+
+    def fast_dot(self, vec):
+        return self.dx*vec.dx + self.dy*vec.dy
+
+    def fast_plus(self, vec):
+        return Vector2D(self.dx+vec.dx, self.dy+vec.dy)
+
+    def fast_minus(self, vec):
+        return Vector2D(self.dx-vec.dx, self.dy-vec.dy)
+
+    def fast_times(self, amount):
+        return Vector2D(amount*self.dx, amount*self.dy)
+
+    def set(self, xOffset, yOffset):
+        self.dx = xOffset
+        self.dy = yOffset
+        return self
+
+    def scale_add(self, vec, amount):
+        self.dx += vec.dx * amount
+        self.dy += vec.dy * amount
+        return self
+
+    def add_in(self, vec):
+        assert(type(vec) == Vector2D)
+        self.dx += vec.dx
+        self.dy += vec.dy
+        return self
+
+    def subtract_out(self, vec):
+        assert(type(vec) == Vector2D)
+        self.dx -= vec.dx
+        self.dy -= vec.dy
+        return self
+
+    def scale(self, amount):
+        assert(type(amount) == float)
+        self.dx *= amount
+        self.dy *= amount
+        return self
+
     def magnitude(self):
-        return math.sqrt(self.dot(self))
+        return math.sqrt(self.dx*self.dx + self.dy*self.dy)
 
     def direction(self):
         mag = self.magnitude()
@@ -146,6 +255,9 @@ class Vector2D:
     __neg__ = negated
     __mul__ = times
     __rmul__ = times
+    __iadd__ = add_in
+    __isub__ = subtract_out
+    __imul__ = scale
     __div__ = over
     x = cross
     __str__ = to_string
@@ -171,6 +283,30 @@ class Bounds:
         y = self.ymin + fractiony * self.height()
         return Point2D(x,y)
 
+    def wrap_in_place(self,position):
+        # Same as wrap, but moves 'position' itself and returns it.
+        while position.x >= self.xmax:
+            position.x -= self.width()
+        while position.x < self.xmin:
+            position.x += self.width()
+        while position.y >= self.ymax:
+            position.y -= self.height()
+        while position.y < self.ymin:
+            position.y += self.height()
+        return position
+
+    def clip_in_place(self,position):
+        # Same as clip, but moves 'position' itself and returns it.
+        if position.x >= self.xmax:
+            position.x = self.xmax
+        if position.x < self.xmin:
+            position.x = self.xmin
+        if position.y >= self.ymax:
+            position.y = self.ymax
+        if position.y < self.ymin:
+            position.y = self.ymin
+        return position
+
     def wrap(self,position):
         p = position.copy()
         while p.x >= self.xmax:
@@ -195,3 +331,35 @@ class Bounds:
             p.y = self.ymin
         return p
         
+
+
+def time_of_impact(start, travel, radius):
+    # Solve |start + s*travel| = radius for the smallest s in [0,1].
+    c = start.fast_dot(start) - radius * radius
+    if c < 0.0:
+        return 0.0 # started inside
+    a = travel.fast_dot(travel)
+    if a == 0.0:
+        return None
+    b = start.fast_dot(travel)
+    if b >= 0.0:
+        return None # moving away
+    discriminant = b * b - a * c
+    if discriminant < 0.0:
+        return None # passes by
+    s = (-b - math.sqrt(discriminant)) / a
+    if s > 1.0:
+        return None # not this tick
+    return s
+
+# The unit vector for every whole number of degrees, as (x, y), for
+# 'heading'. Tuples, so nothing can change the table by accident.
+HEADINGS = tuple((math.cos(n * math.pi / 180.0), math.sin(n * math.pi / 180.0)) for n in range(360))
+
+def heading(degrees):
+    n = int(degrees)
+    if n == degrees:
+        dx, dy = HEADINGS[n % 360]
+        return Vector2D(dx, dy)
+    angle = degrees * math.pi / 180.0
+    return Vector2D(math.cos(angle), math.sin(angle))
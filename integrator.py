@@ -0,0 +1,244 @@
+import numpy
+from geometry import Point2D, Vector2D
+
+#
+# integrator.py
+#
+# Moves all of a world's moving bodies at once. Instead of each body
+# doing
+#
+#   position = position + velocity * TIME_STEP
+#   velocity = velocity + accel * TIME_STEP
+#   world.trim(body)
+#
+# on its own, the positions, velocities and accelerations of every
+# body live as rows of three contiguous NumPy arrays, and 'step'
+# advances (and wraps or clips) all of them with a handful of array
+# operations.
+#
+# A world turns this on by setting its 'integrator' before any bodies
+# are made, e.g.
+#
+#   self.integrator = Integrator(self.bounds, self.topology, TIME_STEP)
+#
+# Game.update then calls 'step' once at the start of every tick, and
+# MovingBody.update only has to compute the body's next acceleration
+# with steer(). Bodies whose steering is just a constant slowdown
+# against their own velocity (Embers) can leave that to 'step' too, by
+# setting SLOWDOWN_IN_BULK.
+#
+# While a body has a row, reading its position, velocity or accel
+# gives a fresh Point2D/Vector2D copy of that row; assigning one
+# writes the row. So 'body.position.x = 3.0' does NOT move the body,
+# but 'body.position = Point2D(3.0, body.position.y)' does.
+#
+
+class Integrated:
+    # A data descriptor for one of a body's three integrated
+    # attributes. Without a row, the value lives in the body's own
+    # __dict__ just like a plain attribute would.
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, body, owner):
+        if body is None:
+            return self
+        if body.row is None:
+            return body.__dict__[self.name]
+        return body.world.integrator.read(self.name, body.row)
+
+    def __set__(self, body, value):
+        if body.row is None:
+            body.__dict__[self.name] = value
+        else:
+            body.world.integrator.write(self.name, body.row, value)
+
+
+def array_class(cls):
+    # The subclass of 'cls' whose position, velocity and accel are read
+    # from and written to the world's integrator. Made once per class;
+    # isinstance checks and class constants still work because it only
+    # adds the three descriptors (and 'plain_class', which is 'cls').
+    array_cls = ARRAY_CLASSES.get(cls)
+    if array_cls is None:
+        fields = dict((name, Integrated(name)) for name in Integrator.FIELDS)
+        fields['row'] = None
+        fields['plain_class'] = cls
+        array_cls = type(cls.__name__, (cls,), fields)
+        array_cls.__qualname__ = cls.__qualname__
+        array_cls.__module__ = cls.__module__
+        ARRAY_CLASSES[cls] = array_cls
+    return array_cls
+
+ARRAY_CLASSES = {}
+
+
+class Integrator:
+
+    GROWTH = 2
+    FIELDS = ('position', 'velocity', 'accel')
+
+    def __init__(self, bounds, topology, time_step, capacity=256):
+        self.bounds    = bounds
+        self.topology  = topology
+        self.time_step = time_step
+        self.count     = 0
+        self.bodies    = []
+        self.position  = numpy.zeros((capacity, 2))
+        self.velocity  = numpy.zeros((capacity, 2))
+        self.accel     = numpy.zeros((capacity, 2))
+        self.slowdown  = numpy.zeros(capacity)
+        self.speed     = numpy.zeros(capacity)
+
+    def capacity(self):
+        return len(self.slowdown)
+
+    def grow(self):
+        size = self.capacity() * self.GROWTH
+        for name in self.FIELDS:
+            old = getattr(self, name)
+            new = numpy.zeros((size, 2))
+            new[:self.count] = old[:self.count]
+            setattr(self, name, new)
+        slowdown = numpy.zeros(size)
+        slowdown[:self.count] = self.slowdown[:self.count]
+        self.slowdown = slowdown
+        self.speed = numpy.zeros(size)
+
+    def add(self, body):
+        # Give 'body' the next free row, copying in its current
+        # position, velocity and accel.
+        if body.row is not None:
+            return
+        if self.count == self.capacity():
+            self.grow()
+        row = self.count
+        if not isinstance(type(body).__dict__.get('position'), Integrated):
+            body.__class__ = array_class(type(body))
+        for name in self.FIELDS:
+            self.write(name, row, body.__dict__.pop(name))
+        slowdown = body.SLOWDOWN_IN_BULK
+        self.slowdown[row] = 0.0 if slowdown is None else slowdown
+        self.bodies.append(body)
+        body.row = row
+        self.count += 1
+
+    def remove(self, body):
+        # Free 'body's row by moving the last row into it. The body
+        # keeps its final position, velocity and accel as plain values.
+        row = body.row
+        if row is None:
+            return
+        for name in self.FIELDS:
+            body.__dict__[name] = self.read(name, row)
+        body.row = None
+        last = self.count - 1
+        moved = self.bodies.pop()
+        if row != last:
+            for name in self.FIELDS:
+                array = getattr(self, name)
+                array[row] = array[last]
+            self.slowdown[row] = self.slowdown[last]
+            self.speed[row] = self.speed[last]
+            self.bodies[row] = moved
+            moved.row = row
+        self.count = last
+
+    def add_all(self, bodies):
+        # 'add' for many bodies at once, filling their rows in one go.
+        bodies = [body for body in bodies if body.row is None]
+        while self.count + len(bodies) > self.capacity():
+            self.grow()
+        start = self.count
+        values = dict((name, []) for name in self.FIELDS)
+        slowdowns = []
+        for row, body in enumerate(bodies, start):
+            if not isinstance(type(body).__dict__.get('position'), Integrated):
+                body.__class__ = array_class(type(body))
+            state = body.__dict__
+            p = state.pop('position')
+            values['position'].append((p.x, p.y))
+            for name in ('velocity', 'accel'):
+                v = state.pop(name)
+                values[name].append((v.dx, v.dy))
+            slowdown = body.SLOWDOWN_IN_BULK
+            slowdowns.append(0.0 if slowdown is None else slowdown)
+            body.row = row
+        end = start + len(bodies)
+        if bodies:
+            for name in self.FIELDS:
+                getattr(self, name)[start:end] = values[name]
+            self.slowdown[start:end] = slowdowns
+        self.bodies.extend(bodies)
+        self.count = end
+
+    def remove_all(self):
+        # 'remove' every body at once.
+        n = self.count
+        position = self.position[:n].tolist()
+        velocity = self.velocity[:n].tolist()
+        accel    = self.accel[:n].tolist()
+        for row, body in enumerate(self.bodies):
+            state = body.__dict__
+            state['position'] = Point2D(*position[row])
+            state['velocity'] = Vector2D(*velocity[row])
+            state['accel']    = Vector2D(*accel[row])
+            body.row = None
+        self.bodies = []
+        self.count = 0
+
+    def read(self, name, row):
+        array = getattr(self, name)
+        if name == 'position':
+            return Point2D(array.item(row, 0), array.item(row, 1))
+        return Vector2D(array.item(row, 0), array.item(row, 1))
+
+    def write(self, name, row, value):
+        array = getattr(self, name)
+        if name == 'position':
+            array[row, 0] = value.x
+            array[row, 1] = value.y
+        else:
+            array[row, 0] = value.dx
+            array[row, 1] = value.dy
+
+    def step(self):
+        # Advance every body by one time step, then keep them in the
+        # world according to its topology (see Game.trim).
+        n = self.count
+        if n == 0:
+            return
+        p = self.position[:n]
+        v = self.velocity[:n]
+        a = self.accel[:n]
+        p += v * self.time_step
+        v += a * self.time_step
+
+        b = self.bounds
+        if self.topology == 'wrapped':
+            corner = (b.xmin, b.ymin)
+            size = (b.width(), b.height())
+            p -= corner
+            numpy.mod(p, size, out=p)
+            # mod can round a tiny negative up to exactly the width
+            p[p >= size] = 0.0
+            p += corner
+        elif self.topology == 'bound':
+            numpy.clip(p, (b.xmin, b.ymin), (b.xmax, b.ymax), out=p)
+
+        # Every body's new speed, so bodies can check it without
+        # reading back their velocity (see 'speed_of').
+        speed = self.speed[:n]
+        numpy.hypot(v[:, 0], v[:, 1], out=speed)
+
+        # Bulk steering: slow down against the new velocity.
+        slowing = self.slowdown[:n] > 0.0
+        if slowing.any():
+            moving = slowing & (speed > Vector2D.EPSILON)
+            a[slowing] = 0.0
+            a[moving] = v[moving] * (-self.slowdown[:n][moving] / speed[moving])[:, None]
+
+    def speed_of(self, row):
+        # The speed of the body in 'row' as of the last step.
+        return self.speed.item(row)
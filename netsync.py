@@ -0,0 +1,628 @@
+import argparse
+import collections
+import contextlib
+import math
+import random
+import sys
+
+import pool
+from dogfight import PlayDogfight, Ship, Photon, Ember, ReverseLaser, MultiShot, Shield, TIME_STEP
+from geometry import Point2D
+from replay import Event
+from sweep import DogfightBots
+
+#
+# netsync.py
+#
+# Plays PlayDogfight between two machines: the server runs the match,
+# and each player's client shows it and sends the player's inputs.
+#
+#   python3 netsync.py --latency 6 --jitter 2 --loss 0.05 --multishot 5
+#
+# plays a match between two bots through a simulated network (latency
+# and jitter in ticks, loss as a fraction of packets) and reports the
+# bytes sent per tick each way, how far off the clients' predicted
+# ships were, and how far their photons, embers and power-ups were from
+# the server's.
+#
+# The server sends each client a snapshot every SEND_EVERY ticks, as
+# the difference from the last snapshot that client acknowledged (or
+# everything, if it hasn't acknowledged one in MAX_BASELINE_AGE
+# ticks), so a lost packet only costs the next ones a bit more. Every
+# agent gets a number when it joins the world (see Registry; a pooled
+# agent that is spawned again gets a new one), and a snapshot holds
+#
+#   - the agents that left since the baseline,
+#   - the agents that joined since, with their state,
+#   - the fields of the other agents that changed, as the difference
+#     in each quantized field (position to 1/POS of a unit, and so on).
+#
+# Only ships are ever updated. Photons, Embers and power-ups move the
+# same way every tick, so they are sent once, when they show up, and
+# the client moves them itself (see 'extrapolate') until they leave.
+# All numbers are zigzag varints, so small changes take a byte.
+#
+# A client sends one command per tick -- the keys its player pressed,
+# and for player two where the mouse is -- along with every command
+# the server hasn't acknowledged yet, and the last snapshot it got.
+# It doesn't wait for the server to move its own ship: it runs the
+# command on a copy of the ship right away (prediction), and when a
+# snapshot says which command the server got to, it puts the ship
+# where the server has it and runs the later commands again
+# (reconciliation). The server runs one command per player per tick,
+# a couple of ticks behind so late ones still come in time, catching
+# up by running more at once if they pile up.
+#
+
+SEND_EVERY       = 2  # ticks between snapshots
+MAX_BASELINE_AGE = 60 # ticks a baseline is good for
+MAX_COMMANDS     = 32 # unacknowledged commands resent with each input
+JITTER_BUFFER    = 2  # commands a server keeps waiting, for packets that are late
+MAX_BACKLOG      = 2  # more than that a server lets wait before running them together
+
+POS   = 256.0  # quantization steps per world unit
+VEL   = 1024.0 # ... per world unit per tick
+ACCEL = 65536.0 # ... per world unit per tick per tick
+ANGLE = 64.0   # ... per degree
+
+# The agents that are sent, by number on the wire, and their fields.
+CLASSES = (Ship, Photon, Ember, ReverseLaser, MultiShot, Shield)
+CODES   = dict((cls, code) for code, cls in enumerate(CLASSES))
+FIELDS  = {
+    Ship:   ('x', 'y', 'vx', 'vy', 'ax', 'ay', 'angle', 'impulse', 'lrImpulse', 'hp', 'shotTimer', 'flags', 'multiShot'),
+    Photon: ('x', 'y', 'vx', 'vy', 'age', 'flags'),
+    Ember:  ('x', 'y', 'vx', 'vy', 'steering'),
+}
+SENT_ONCE = frozenset((Photon, Ember, ReverseLaser, MultiShot, Shield))
+
+# The keys each player may send.
+KEYS = {True: 'wsadc', False: ']'}
+
+
+def fields_of(cls):
+    return FIELDS.get(cls, ('x', 'y'))
+
+def quantize(agent):
+    # An agent's fields, as ints, in the order of its FIELDS.
+    p, v = agent.position, agent.velocity
+    values = [round(p.x * POS), round(p.y * POS), round(v.dx * VEL), round(v.dy * VEL)]
+    cls = type(agent)
+    if cls is Ship:
+        values.extend((round(agent.accel.dx * ACCEL), round(agent.accel.dy * ACCEL),
+                       round(agent.angle * ANGLE) % round(360 * ANGLE), agent.impulse, agent.lrImpulse,
+                       agent.hp, agent.shotTimer,
+                       agent.has_Shield | agent.has_reverseShot << 1 | agent.player_one << 2,
+                       agent.multiShot))
+    elif cls is Photon:
+        values.extend((agent.age, agent.player_one | (agent.reversed < 0.0) << 1))
+    elif cls is Ember:
+        values.append(1 if agent.accel.dx != 0.0 or agent.accel.dy != 0.0 else 0)
+    else:
+        del values[2:]
+    return tuple(values)
+
+
+# Varints: 7 bits a byte, low bits first; signed ones zigzagged first
+# (0, -1, 1, -2, ... -> 0, 1, 2, 3, ...).
+
+def put(out, n):
+    while n >= 0x80:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+def put_signed(out, n):
+    put(out, n * 2 if n >= 0 else -n * 2 - 1)
+
+def get(data, offset):
+    n = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        n |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return n, offset
+        shift += 7
+
+def get_signed(data, offset):
+    n, offset = get(data, offset)
+    return (n >> 1 if n & 1 == 0 else -(n >> 1) - 1), offset
+
+
+class Registry:
+    # Numbers the agents of a world (as world.netsync) and takes
+    # snapshots of them: {number: (class code, fields)}.
+
+    def __init__(self, world):
+        self.world   = world
+        self.ids     = {}
+        self.next_id = 1
+        for agent in world.agents:
+            self.spawned(agent)
+        world.netsync = self
+
+    def spawned(self, agent):
+        self.ids[agent] = self.next_id
+        self.next_id += 1
+
+    def despawned(self, agent):
+        self.ids.pop(agent, None)
+
+    def capture(self):
+        snapshot = {}
+        for agent, id in self.ids.items():
+            code = CODES.get(type(agent))
+            if code != None:
+                snapshot[id] = (code, quantize(agent))
+        return snapshot
+
+
+class Encoder:
+    # What the server keeps for one client: the snapshots it sent,
+    # until the client says which of them it got.
+
+    def __init__(self):
+        self.sent   = {} # tick -> snapshot
+        self.acked  = None
+
+    def ack(self, tick):
+        if tick in self.sent and (self.acked == None or tick > self.acked):
+            self.acked = tick
+            for old in [t for t in self.sent if t < tick]:
+                del self.sent[old]
+
+    def encode(self, tick, snapshot, input_ack):
+        base_tick = self.acked
+        if base_tick != None and tick - base_tick > MAX_BASELINE_AGE:
+            base_tick = None
+        base = self.sent[base_tick] if base_tick != None else {}
+        self.sent[tick] = snapshot
+        for old in [t for t in self.sent if tick - t > MAX_BASELINE_AGE]:
+            del self.sent[old]
+
+        out = bytearray()
+        put(out, tick)
+        put(out, 0 if base_tick == None else tick - base_tick)
+        put(out, input_ack)
+
+        gone = sorted(id for id in base if id not in snapshot)
+        put(out, len(gone))
+        last = 0
+        for id in gone:
+            put(out, id - last)
+            last = id
+
+        new = sorted(id for id in snapshot if id not in base)
+        put(out, len(new))
+        last = 0
+        for id in new:
+            code, values = snapshot[id]
+            put(out, id - last)
+            last = id
+            out.append(code)
+            for value in values:
+                put_signed(out, value)
+
+        changed = []
+        for id in sorted(base):
+            code, values = snapshot.get(id, (None, None))
+            if code == None or CLASSES[code] in SENT_ONCE:
+                continue
+            old = base[id][1]
+            mask = 0
+            for n, value in enumerate(values):
+                if value != old[n]:
+                    mask |= 1 << n
+            if mask:
+                changed.append((id, mask, values, old))
+        put(out, len(changed))
+        last = 0
+        for id, mask, values, old in changed:
+            put(out, id - last)
+            last = id
+            put(out, mask)
+            for n, value in enumerate(values):
+                if mask & 1 << n:
+                    put_signed(out, value - old[n])
+        return bytes(out)
+
+
+class Decoder:
+    # What a client keeps of the snapshots it got: {number: (class
+    # code, fields, tick the fields are from)} for each recent tick.
+
+    def __init__(self):
+        self.received = {}
+        self.latest   = None
+
+    def decode(self, data):
+        # (tick, last command the server ran, agents), or None for a
+        # snapshot older than the latest or whose baseline is gone.
+        tick, offset = get(data, 0)
+        back, offset = get(data, offset)
+        input_ack, offset = get(data, offset)
+        if self.latest != None and tick <= self.latest:
+            return None
+        base = {}
+        if back:
+            base = self.received.get(tick - back)
+            if base == None:
+                return None
+        agents = dict(base)
+
+        count, offset = get(data, offset)
+        id = 0
+        for n in range(count):
+            gap, offset = get(data, offset)
+            id += gap
+            del agents[id]
+
+        count, offset = get(data, offset)
+        id = 0
+        for n in range(count):
+            gap, offset = get(data, offset)
+            id += gap
+            code = data[offset]
+            offset += 1
+            values = []
+            for field in fields_of(CLASSES[code]):
+                value, offset = get_signed(data, offset)
+                values.append(value)
+            agents[id] = (code, tuple(values), tick)
+
+        count, offset = get(data, offset)
+        id = 0
+        for n in range(count):
+            gap, offset = get(data, offset)
+            id += gap
+            mask, offset = get(data, offset)
+            code, old, since = agents[id]
+            values = list(old)
+            for field in range(len(values)):
+                if mask & 1 << field:
+                    delta, offset = get_signed(data, offset)
+                    values[field] += delta
+            agents[id] = (code, tuple(values), tick)
+
+        self.received[tick] = agents
+        self.latest = tick
+        for old in [t for t in self.received if tick - t > 2 * MAX_BASELINE_AGE]:
+            del self.received[old]
+        return tick, input_ack, agents
+
+
+def encode_commands(ack, commands):
+    # A mouse position the same as the command before's is left out.
+    out = bytearray()
+    put(out, ack)
+    put(out, commands[0][0] if commands else 0)
+    put(out, len(commands))
+    last = None
+    for seq, keys, mouse in commands:
+        put(out, len(keys))
+        out.extend(keys.encode())
+        if mouse == None or mouse == last:
+            out.append(0)
+        else:
+            out.append(1)
+            put_signed(out, mouse[0])
+            put_signed(out, mouse[1])
+        last = mouse
+    return bytes(out)
+
+def decode_commands(data):
+    ack, offset = get(data, 0)
+    seq, offset = get(data, offset)
+    count, offset = get(data, offset)
+    commands = []
+    mouse = None
+    for n in range(count):
+        length, offset = get(data, offset)
+        keys = data[offset:offset+length].decode()
+        offset += length
+        if data[offset]:
+            x, offset = get_signed(data, offset + 1)
+            y, offset = get_signed(data, offset)
+            mouse = (x, y)
+        else:
+            offset += 1
+        commands.append((seq + n, keys, mouse))
+    return ack, commands
+
+
+class Session:
+    # The server's end of one player's connection.
+
+    def __init__(self, game, player_one):
+        self.game       = game
+        self.player_one = player_one
+        self.encoder    = Encoder()
+        self.waiting    = collections.deque()
+        self.received   = 0 # the last command that arrived
+        self.ran        = 0 # the last command run
+        self.buffering  = True
+
+    def receive(self, data):
+        ack, commands = decode_commands(data)
+        self.encoder.ack(ack)
+        for command in commands:
+            if command[0] > self.received:
+                self.waiting.append(command)
+                self.received = command[0]
+
+    def run_commands(self):
+        # Before each tick: this player's next command, or the next few
+        # if they are piling up. After running out, it waits until
+        # JITTER_BUFFER have come, so a late packet doesn't run it dry.
+        waiting = len(self.waiting)
+        if self.buffering:
+            if waiting < JITTER_BUFFER:
+                return
+            self.buffering = False
+        count = 1 + max(0, waiting - JITTER_BUFFER - MAX_BACKLOG)
+        for n in range(min(count, waiting)):
+            seq, keys, mouse = self.waiting.popleft()
+            if mouse != None and not self.player_one:
+                self.game.dispatch('motion', Event(x=mouse[0], y=mouse[1]))
+            for char in keys:
+                if char in KEYS[self.player_one]:
+                    self.game.dispatch('key', Event(char))
+            self.ran = seq
+        if not self.waiting:
+            self.buffering = True
+
+    def snapshot(self, snapshot):
+        return self.encoder.encode(self.game.tick, snapshot, self.ran)
+
+
+class Client:
+    # A player's end: shows the latest snapshot, with its own ship
+    # predicted, on a world of its own that only ever holds the two
+    # ships ('world', which has no agents of its own doing).
+
+    def __init__(self, player_one, seed=None):
+        self.player_one = player_one
+        self.decoder    = Decoder()
+        with contextlib.redirect_stdout(None):
+            self.world = PlayDogfight(headless=True, seed=seed)
+        self.world.console.sink = lambda chunk: None
+        self.ship       = self.world.ship_one if player_one else self.world.ship_two
+        self.agents     = {}
+        self.tick       = 0 # of the latest snapshot
+        self.seq        = 0
+        self.pending    = collections.deque() # commands the server hasn't run yet
+        self.predicted  = {} # seq -> where the ship was shown after it
+        self.errors     = []
+
+    def command(self, keys, mouse):
+        # Run this tick's input here, and return what to send.
+        self.seq += 1
+        keys = ''.join(char for char in keys if char in KEYS[self.player_one])
+        command = (self.seq, keys, None if self.player_one else mouse)
+        self.pending.append(command)
+        self.run(command)
+        self.predicted[self.seq] = (self.ship.position.x, self.ship.position.y)
+        commands = list(self.pending)[-MAX_COMMANDS:]
+        return encode_commands(self.decoder.latest or 0, commands)
+
+    def run(self, command):
+        seq, keys, mouse = command
+        world = self.world
+        if mouse != None:
+            world.dispatch('motion', Event(x=mouse[0], y=mouse[1]))
+        for char in keys:
+            world.dispatch('key', Event(char))
+        self.ship.update()
+        for agent in world.agents[:]: # the photons the ship just shot; the server's are on their way
+            if type(agent) is not Ship:
+                agent.leave()
+
+    def receive(self, data):
+        decoded = self.decoder.decode(data)
+        if decoded == None:
+            return
+        self.tick, ran, self.agents = decoded
+        alive = set()
+        for code, values, since in self.agents.values():
+            if CLASSES[code] is Ship:
+                ship = self.world.ship_one if values[11] & 4 else self.world.ship_two
+                alive.add(ship)
+                if ship is not self.ship:
+                    set_ship(ship, values)
+                    continue
+                shown = self.predicted.pop(ran, None)
+                if shown != None:
+                    offset = self.world.offset(Point2D(values[0] / POS, values[1] / POS), Point2D(*shown))
+                    self.errors.append(offset.magnitude())
+                set_ship(ship, values)
+        for ship in (self.world.ship_one, self.world.ship_two):
+            if ship not in alive and ship.hp != 0: # ships only leave when they die
+                ship.hp = 0
+                if ship is self.world.ship_one:
+                    self.world.ship_two.freeze_blue()
+        for seq in [seq for seq in self.predicted if seq < ran]:
+            del self.predicted[seq]
+        while self.pending and self.pending[0][0] <= ran:
+            self.pending.popleft()
+        for command in self.pending:
+            self.run(command)
+
+    def view(self, tick):
+        # {number: (class, x, y)} of what the client would draw at
+        # 'tick': its own ship as predicted, the others from the latest
+        # snapshot, moved on to 'tick' if they move by themselves.
+        shown = {}
+        for id, (code, values, since) in self.agents.items():
+            cls = CLASSES[code]
+            if cls is Ship:
+                ship = self.world.ship_one if values[11] & 4 else self.world.ship_two
+                shown[id] = (cls, ship.position.x, ship.position.y)
+                continue
+            p = extrapolate(cls, values, tick - since, self.world)
+            if p != None:
+                shown[id] = (cls, p.x, p.y)
+        return shown
+
+
+def set_ship(ship, values):
+    x, y, vx, vy, ax, ay, angle, impulse, lrImpulse, hp, shotTimer, flags, multiShot = values
+    ship.position.set(x / POS, y / POS)
+    ship.velocity = ship.velocity.set(vx / VEL, vy / VEL)
+    ship.accel     = ship.accel.set(ax / ACCEL, ay / ACCEL)
+    ship.angle     = angle / ANGLE
+    ship.impulse   = impulse
+    ship.lrImpulse = lrImpulse
+    ship.hp        = hp
+    ship.shotTimer = shotTimer
+    ship.has_Shield      = bool(flags & 1)
+    ship.has_reverseShot = bool(flags & 2)
+    ship.multiShot = multiShot
+
+def extrapolate(cls, values, ticks, world):
+    # Where an agent sent once is 'ticks' after its fields, as the
+    # game would move it; None once it would have left.
+    p = Point2D(values[0] / POS, values[1] / POS)
+    if cls is Photon:
+        if values[4] + ticks >= Photon.LIFETIME:
+            return None
+        p.x += values[2] / VEL * TIME_STEP * ticks
+        p.y += values[3] / VEL * TIME_STEP * ticks
+    elif cls is Ember:
+        vx, vy, steering = values[2] / VEL, values[3] / VEL, values[4]
+        for n in range(ticks):
+            p.x += vx * TIME_STEP
+            p.y += vy * TIME_STEP
+            if steering:
+                slower = 1.0 - Ember.SLOWDOWN * TIME_STEP / math.hypot(vx, vy)
+                vx, vy = vx * slower, vy * slower
+            steering = 1
+            if math.hypot(vx, vy) < Ember.TOO_SLOW:
+                return None
+    return world.bounds.wrap_in_place(p)
+
+
+class Link:
+    # One direction of a simulated network: packets arrive 'latency'
+    # ticks later, give or take 'jitter' (so they can arrive out of
+    # order), unless they are lost.
+
+    def __init__(self, latency, jitter, loss, rng):
+        self.latency = latency
+        self.jitter  = jitter
+        self.loss    = loss
+        self.rng     = rng
+        self.flying  = []
+        self.bytes   = 0
+
+    def send(self, now, data):
+        self.bytes += len(data)
+        if self.rng.random() < self.loss:
+            return
+        self.flying.append((now + self.latency + self.rng.randint(-self.jitter, self.jitter), len(self.flying), data))
+
+    def arrived(self, now):
+        ready = sorted(packet for packet in self.flying if packet[0] <= now)
+        self.flying = [packet for packet in self.flying if packet[0] > now]
+        return [data for when, n, data in ready]
+
+
+class Controls:
+    # The bots' game (see sweep.DogfightBots): the client's world, but
+    # what they do is kept for the client to send instead of done.
+
+    def __init__(self, world):
+        self.world  = world
+        self.tick   = 0
+        self.keys   = ''
+        self.mouse  = None
+
+    def __getattr__(self, name):
+        return getattr(self.world, name)
+
+    def dispatch(self, kind, event):
+        if kind == 'key':
+            self.keys += event.char
+        elif kind == 'motion':
+            self.mouse = (event.x, event.y)
+
+
+def loopback(ticks, latency, jitter, loss, multishot, seed):
+    # A bot match through simulated links, until 'ticks' or two
+    # seconds after a ship dies. Returns the players as (session,
+    # client, controls, bots, up link, down link), the ticks played, and
+    # how far the clients' photons and embers were from the server's.
+    pool.clear()
+    with contextlib.redirect_stdout(None):
+        game = PlayDogfight(headless=True, seed=seed)
+    game.console.sink = lambda chunk: None
+    registry = Registry(game)
+    for ship in (game.ship_one, game.ship_two):
+        ship.multiShot = multishot
+    rng = random.Random(seed)
+    players = []
+    for player_one in (True, False):
+        client = Client(player_one, seed)
+        controls = Controls(client.world)
+        players.append((Session(game, player_one), client, controls, DogfightBots(controls, random.Random(rng.random())),
+                        Link(latency, jitter, loss, rng), Link(latency, jitter, loss, rng)))
+
+    extrapolation = []
+    over = None
+    for tick in range(ticks):
+        for session, client, controls, bots, up, down in players:
+            for data in down.arrived(tick):
+                client.receive(data)
+            controls.tick, controls.keys = tick, ''
+            bots.act()
+            up.send(tick, client.command(controls.keys, controls.mouse))
+        for session, client, controls, bots, up, down in players:
+            for data in up.arrived(tick):
+                session.receive(data)
+            session.run_commands()
+        game.update()
+        if game.tick % SEND_EVERY == 0:
+            snapshot = registry.capture()
+            agents = dict((id, agent) for agent, id in registry.ids.items())
+            for session, client, controls, bots, up, down in players:
+                for id, (cls, x, y) in client.view(game.tick).items():
+                    agent = agents.get(id)
+                    if cls in SENT_ONCE and agent != None:
+                        extrapolation.append(game.offset(agent.position, Point2D(x, y)).magnitude())
+                down.send(tick, session.snapshot(snapshot))
+        if over == None and (game.ship_one.hp == 0 or game.ship_two.hp == 0):
+            over = tick
+        if over != None and tick - over >= 2 * game.TICKS_PER_SECOND:
+            break
+    return players, tick + 1, extrapolation
+
+
+def summary(values):
+    if not values:
+        return "-"
+    values = sorted(values)
+    return "mean %.4f, p99 %.4f, max %.4f" % (sum(values) / len(values), values[int(0.99 * (len(values) - 1))], values[-1])
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Play a bot dogfight through a simulated network and measure the protocol.")
+    parser.add_argument('--ticks', type=int, default=3600)
+    parser.add_argument('--latency', type=int, default=6, help="one way, in ticks")
+    parser.add_argument('--jitter', type=int, default=1, help="in ticks either way")
+    parser.add_argument('--loss', type=float, default=0.02, help="fraction of packets lost")
+    parser.add_argument('--multishot', type=int, default=0, help="multishots each ship starts with")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    players, ticks, extrapolation = loopback(args.ticks, args.latency, args.jitter, args.loss, args.multishot, args.seed)
+    rate = PlayDogfight.TICKS_PER_SECOND
+    print("%d ticks, latency %d±%d ticks, %.0f%% loss" % (ticks, args.latency, args.jitter, 100.0 * args.loss))
+    for session, client, controls, bots, up, down in players:
+        name = "player one" if client.player_one else "player two"
+        print("%s: down %.1f bytes/tick (%.2f KB/s), up %.1f bytes/tick (%.2f KB/s)" % (
+            name, down.bytes / ticks, down.bytes / ticks * rate / 1024.0, up.bytes / ticks, up.bytes / ticks * rate / 1024.0))
+        print("  prediction error (world units): %s" % summary(client.errors))
+    print("photons, embers and power-ups, client vs server: %s" % summary(extrapolation))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
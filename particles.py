@@ -0,0 +1,245 @@
+import math
+
+import numpy
+
+#
+# particles.py
+#
+# Keeps a world's Embers as rows of NumPy arrays instead of agents.
+# An explosion that throws out thirty sparks would otherwise make
+# thirty agents, each running its own update, steer (a square root),
+# color (another one) and canvas polygon every tick; here every spark
+# in the world is moved, slowed down, culled and colored with a few
+# array operations, however many explosions there were.
+#
+# A world turns it on by setting its 'particles', e.g.
+#
+#   self.particles = Emitter(self, Ember, TIME_STEP)
+#
+# and Shootable.explode then calls 'emit' instead of spawning Embers
+# (see Shootable.shrapnel). The sparks behave as the agents would:
+# they fly off at Ember.INITIAL_SPEED in a direction drawn from the
+# world's random, one draw each, so the rest of the game draws the same
+# numbers either way; they start slowing down by Ember.SLOWDOWN a tick
+# after they appear, and go out below Ember.TOO_SLOW. Game.update
+# calls 'step' once a tick, before the agents move, so sparks thrown
+# out during a tick first move on the next, like a spawned agent.
+#
+# At most 'budget' sparks are kept. Past that, the oldest (which are
+# the slowest and dimmest) are dropped to make room for new ones.
+#
+# Sparks are only for show: nothing hits them and state_hash leaves
+# them out. Drawing colors each one by its speed in one go (white-hot,
+# burning, smoldering, as Ember.color) and hands them to a Sprites, a
+# pool of canvas polygons that only recolors the ones whose color
+# changed; the pool grows to the most sparks ever shown, and the
+# polygons it has no sparks for are hidden, not deleted. In an 'open'
+# world only the sparks on the canvas are drawn, and when the world's
+# renderer has turned the detail down (see render.py) the dimmer bands
+# are skipped, as are sparks smaller than a pixel.
+#
+
+class Sprites:
+    # Canvas polygons for things that are drawn by the hundred but are
+    # not agents (sparks, and photons in projectiles.py).
+
+    def __init__(self):
+        self.items = [] # [polygon, color]
+        self.shown = 0  # how many of them are showing
+
+    def draw(self, canvas, coords, colors):
+        # Show one polygon per row of 'coords', in its color from
+        # 'colors', and hide the rest.
+        items = self.items
+        shown = self.shown
+        for n, row in enumerate(coords):
+            color = colors[n]
+            if n == len(items):
+                items.append([canvas.create_polygon(row, fill=color), color])
+                continue
+            item = items[n]
+            canvas.coords(item[0], row)
+            if n >= shown:
+                canvas.itemconfig(item[0], state='normal', fill=color)
+                item[1] = color
+            elif item[1] != color:
+                canvas.itemconfig(item[0], fill=color)
+                item[1] = color
+        for item in items[len(coords):shown]:
+            canvas.itemconfig(item[0], state='hidden')
+        self.shown = len(coords)
+
+    def forget(self):
+        # For Game.clear, which deleted the canvas items.
+        self.items = []
+        self.shown = 0
+
+
+def on_canvas(world, coords):
+    # Which rows of window coordinates have some of their shape on the
+    # canvas.
+    xs, ys = coords[:, 0::2], coords[:, 1::2]
+    return ((xs.max(axis=1) >= 0.0) & (xs.min(axis=1) <= world.WINDOW_WIDTH) &
+            (ys.max(axis=1) >= 0.0) & (ys.min(axis=1) <= world.WINDOW_HEIGHT))
+
+
+class Emitter:
+
+    BUDGET = 2048  # most sparks alive at once
+    SIZE   = 0.125 # half the side of a spark's square, as in MovingBody.shape
+
+    def __init__(self, world, kind, time_step, budget=None):
+        self.world     = world
+        self.time_step = time_step
+        self.budget    = self.BUDGET if budget == None else budget
+        self.speed0    = kind.INITIAL_SPEED
+        self.slowdown  = kind.SLOWDOWN
+        self.too_slow  = kind.TOO_SLOW
+        self.bands     = kind.BANDS
+        self.colors    = kind.COLORS
+
+        # One row per spark, the live ones first and in the order they
+        # were made. 'px','py' are where each was a tick ago, for
+        # drawing in between ticks; 'steering' says whether it has
+        # started slowing down.
+        size = self.budget
+        self.x        = numpy.zeros(size)
+        self.y        = numpy.zeros(size)
+        self.vx       = numpy.zeros(size)
+        self.vy       = numpy.zeros(size)
+        self.speed    = numpy.zeros(size)
+        self.px       = numpy.zeros(size)
+        self.py       = numpy.zeros(size)
+        self.steering = numpy.zeros(size, dtype=bool)
+        self.arrays   = (self.x, self.y, self.vx, self.vy, self.speed, self.px, self.py, self.steering)
+        self.count    = 0
+        self.dropped  = 0 # sparks dropped to stay within the budget
+
+        self.sprites = Sprites()
+
+    def emit(self, position, pieces):
+        # 'pieces' sparks at 'position', flying off every which way.
+        rng = self.world.random
+        angles = [rng.random() for n in range(pieces)] # the draws Ember makes
+        if pieces > self.budget:
+            self.dropped += pieces - self.budget
+            angles = angles[-self.budget:]
+            pieces = self.budget
+        if pieces == 0:
+            return
+        extra = self.count + pieces - self.budget
+        if extra > 0:
+            self.dropped += extra
+            left = self.count - extra
+            for array in self.arrays:
+                array[:left] = array[extra:self.count]
+            self.count = left
+        start, end = self.count, self.count + pieces
+        angles = numpy.array(angles) * (2.0 * math.pi)
+        self.x[start:end]  = self.px[start:end] = position.x
+        self.y[start:end]  = self.py[start:end] = position.y
+        self.vx[start:end] = numpy.cos(angles) * self.speed0
+        self.vy[start:end] = numpy.sin(angles) * self.speed0
+        self.speed[start:end]    = self.speed0
+        self.steering[start:end] = False
+        self.count = end
+
+    def step(self):
+        n = self.count
+        if n == 0:
+            return
+        x, y, vx, vy, speed = self.x[:n], self.y[:n], self.vx[:n], self.vy[:n], self.speed[:n]
+        self.px[:n] = x
+        self.py[:n] = y
+        x += vx * self.time_step
+        y += vy * self.time_step
+
+        # Slowing down against the direction of motion only changes the
+        # speed, so the new speed needs no square root.
+        scale = numpy.where(self.steering[:n], 1.0 - self.slowdown * self.time_step / speed, 1.0)
+        vx *= scale
+        vy *= scale
+        speed *= scale
+        self.steering[:n] = True
+
+        world = self.world
+        bounds = world.bounds
+        if world.topology == 'wrapped':
+            for values, low, high in ((x, bounds.xmin, bounds.xmax), (y, bounds.ymin, bounds.ymax)):
+                values -= numpy.floor((values - low) / (high - low)) * (high - low)
+        elif world.topology == 'bound':
+            numpy.clip(x, bounds.xmin, bounds.xmax, out=x)
+            numpy.clip(y, bounds.ymin, bounds.ymax, out=y)
+
+        keep = speed >= self.too_slow
+        left = int(numpy.count_nonzero(keep))
+        if left < n:
+            for array in self.arrays:
+                array[:left] = array[:n][keep]
+            self.count = left
+
+    def band_of_each(self):
+        # 0, 1 or 2 (white-hot, burning, smoldering) for every spark.
+        fraction = self.speed[:self.count] / self.speed0
+        return (fraction <= self.bands[0]).astype(numpy.int8) + (fraction <= self.bands[1])
+
+    def screen_coords(self, alpha=1.0):
+        # Every spark's square as a row of window coordinates, closed
+        # like Game.screen_coords, 'alpha' of the way from where it was
+        # a tick ago.
+        world = self.world
+        bounds = world.bounds
+        n = self.count
+        x, y = self.x[:n], self.y[:n]
+        if alpha < 1.0:
+            back_x, back_y = self.px[:n] - x, self.py[:n] - y
+            if world.topology == 'wrapped':
+                back_x -= numpy.round(back_x / bounds.width()) * bounds.width()
+                back_y -= numpy.round(back_y / bounds.height()) * bounds.height()
+            x = x + back_x * (1.0 - alpha)
+            y = y + back_y * (1.0 - alpha)
+        wh = world.WINDOW_HEIGHT
+        scale = wh / bounds.height()
+        sx = (x - bounds.xmin) * scale
+        sy = wh - (y - bounds.ymin) * scale
+        h = self.SIZE * scale
+        coords = numpy.empty((n, 10))
+        coords[:, 0] = coords[:, 6] = coords[:, 8] = sx + h
+        coords[:, 2] = coords[:, 4] = sx - h
+        coords[:, 1] = coords[:, 3] = coords[:, 9] = sy - h
+        coords[:, 5] = coords[:, 7] = sy + h
+        return coords
+
+    def on_show(self, coords, bands):
+        # Which sparks to draw, or None for all of them.
+        world = self.world
+        keep = None
+        if world.topology == 'open':
+            keep = on_canvas(world, coords)
+        renderer = world.renderer
+        if renderer != None and renderer.governor.level > 0:
+            wanted = bands < renderer.governor.spark_bands()
+            if 2.0 * self.SIZE * world.WINDOW_HEIGHT / world.bounds.height() < 1.0:
+                wanted[:] = False # smaller than a pixel
+            keep = wanted if keep is None else keep & wanted
+        return keep
+
+    def draw(self, alpha=1.0):
+        coords = self.screen_coords(alpha)
+        bands = self.band_of_each()
+        keep = self.on_show(coords, bands)
+        if keep is not None:
+            coords, bands = coords[keep], bands[keep]
+        colors = self.colors
+        self.sprites.draw(self.world.canvas, coords.tolist(), [colors[band] for band in bands.tolist()])
+
+    def render_snapshot(self):
+        # For Game.render_snapshot: (key, coords, color) per spark.
+        coords = self.screen_coords()
+        bands = self.band_of_each()
+        keep = self.on_show(coords, bands)
+        if keep is not None:
+            coords, bands = coords[keep], bands[keep]
+        colors = self.colors
+        bands = bands.tolist()
+        return tuple((('spark', n), row, colors[bands[n]]) for n, row in enumerate(coords.tolist()))
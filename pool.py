@@ -0,0 +1,103 @@
+#
+# pool.py
+#
+# Free lists for the agents that get made and thrown away by the
+# hundreds: Embers from explosions and Photons from shooting.
+#
+# A pooled class mixes in Pooled ahead of its agent base class, e.g.
+#
+#   class Ember(Pooled, MovingBody):
+#
+# and is then made with Ember.spawn(...) instead of Ember(...). When a
+# spawned agent leaves its world it goes back on its class's free list,
+# and the next spawn takes it from there and calls its
+#
+#   respawn(...)
+#
+# method (with the same arguments as __init__) to reset it and put it
+# back in a world, instead of building a new one. Classes that are not
+# pooled still answer spawn(...) (see MovingBody.spawn) by just making
+# a new instance.
+#
+# stats() reports the hits (reused instances), misses (new instances)
+# and free list size of every pool.
+#
+
+class Pool:
+
+    def __init__(self, name, limit):
+        self.name   = name
+        self.limit  = limit
+        self.free   = []
+        self.hits   = 0
+        self.misses = 0
+
+    def take_blank(self, cls):
+        # An instance to be filled in by hand, not respawned.
+        if self.free:
+            self.hits += 1
+            return self.free.pop()
+        self.misses += 1
+        agent = cls.__new__(cls)
+        agent.pool = self
+        return agent
+
+    def take(self, cls, args):
+        if self.free:
+            self.hits += 1
+            agent = self.free.pop()
+            agent.respawn(*args)
+            return agent
+        self.misses += 1
+        agent = cls(*args)
+        agent.pool = self
+        return agent
+
+    def give(self, agent):
+        # Past the limit, let the garbage collector have it.
+        if len(self.free) < self.limit:
+            self.free.append(agent)
+
+    def clear(self):
+        self.free = []
+        self.hits = 0
+        self.misses = 0
+
+
+POOLS = {}
+
+def stats():
+    return dict((pool.name, {'hits': pool.hits, 'misses': pool.misses, 'free': len(pool.free)})
+                for pool in POOLS.values())
+
+def clear():
+    for pool in POOLS.values():
+        pool.clear()
+
+
+class Pooled:
+
+    POOL_LIMIT = 4096 # most free instances kept per class
+    pool       = None # the Pool a spawned instance goes back to
+
+    @classmethod
+    def pool_of(cls):
+        pool = POOLS.get(cls)
+        if pool is None:
+            pool = Pool(cls.__module__ + '.' + cls.__qualname__, cls.POOL_LIMIT)
+            POOLS[cls] = pool
+        return pool
+
+    @classmethod
+    def spawn(cls, *args):
+        return cls.pool_of().take(cls, args)
+
+    @classmethod
+    def blank(cls):
+        # An uninitialized (or free) instance, for snapshot.py to fill in.
+        return cls.pool_of().take_blank(cls)
+
+    def leave(self):
+        super().leave()
+        if self.pool is not None:
+            self.pool.give(self)
@@ -0,0 +1,115 @@
+import collections
+import json
+import time
+
+#
+# profiler.py
+#
+# Times where each frame goes. Game calls
+#
+#   profiler.lap(phase)         -- charge the time since the last lap to 'phase'
+#   profiler.add(phase,seconds) -- charge a measured time to 'phase'
+#   profiler.end_frame()        -- close the frame's record
+#
+# and the profiler keeps the last WINDOW frames of every phase for
+# percentiles (see 'percentiles' and 'summary'). The phases Game uses
+# are:
+#
+#   integrate        -- Integrator.step, if the world has one
+#   particles        -- moving the sparks, if the world keeps them in a
+#                       particles.Emitter
+#   projectiles      -- moving the photons and finding what they hit, if
+#                       the world keeps them in a projectiles.Projectiles
+#   update <Class>   -- agent updates, per class
+#   pending          -- applying queued spawns/removals (and deleting
+#                       the canvas items of agents that left)
+#   index            -- re-bucketing the spatial index
+#   contacts         -- finding touching agents and their callbacks,
+#                       if the world has a contacts.Contacts
+#   draw             -- computing shapes and moving canvas items
+#                       (sparks and photons included)
+#   flush            -- Frame.update, i.e. Tk actually repainting
+#
+# plus 'frame' for the whole frame. In 'run' one frame can hold several
+# ticks; their times are added up, and 'ticks' in the record says how
+# many there were.
+#
+# Given a path, every frame's record is also written out as it ends:
+# one JSON object per line for a .jsonl/.json path, otherwise CSV rows
+# of frame,ticks,phase,ms.
+#
+
+class FrameProfiler:
+
+    WINDOW = 300 # frames kept for percentiles
+
+    def __init__(self, path=None):
+        self.frames  = 0
+        self.ticks   = 0
+        self.current = {}
+        self.history = collections.defaultdict(lambda: collections.deque(maxlen=self.WINDOW))
+        self.started = time.perf_counter()
+        self.last    = self.started
+        self.out     = None
+        self.as_json = False
+        if path != None:
+            self.as_json = path.endswith('.jsonl') or path.endswith('.json')
+            self.out = open(path, 'w')
+            if not self.as_json:
+                self.out.write("frame,ticks,phase,ms\n")
+
+    def lap(self, phase=None):
+        now = time.perf_counter()
+        if phase != None:
+            self.current[phase] = self.current.get(phase, 0.0) + (now - self.last)
+        self.last = now
+
+    def add(self, phase, seconds):
+        self.current[phase] = self.current.get(phase, 0.0) + seconds
+
+    def tick(self):
+        self.ticks += 1
+
+    def end_frame(self):
+        now = time.perf_counter()
+        record = self.current
+        record['frame'] = now - self.started
+        for phase, seconds in record.items():
+            self.history[phase].append(seconds)
+        if self.out != None:
+            self.write(record)
+        self.frames += 1
+        self.current = {}
+        self.ticks   = 0
+        self.started = now
+        self.last    = now
+
+    def write(self, record):
+        if self.as_json:
+            line = {'frame': self.frames, 'ticks': self.ticks}
+            line['ms'] = dict((phase, round(seconds * 1000.0, 4)) for phase, seconds in record.items())
+            self.out.write(json.dumps(line) + "\n")
+        else:
+            for phase, seconds in record.items():
+                self.out.write("%d,%d,%s,%.4f\n" % (self.frames, self.ticks, phase, seconds * 1000.0))
+
+    def percentiles(self, phase, points=(50, 95, 99)):
+        # The given percentiles of 'phase' over the window, in ms.
+        samples = sorted(self.history.get(phase, ()))
+        if not samples:
+            return [0.0 for p in points]
+        last = len(samples) - 1
+        return [samples[min(last, int(round(p / 100.0 * last)))] * 1000.0 for p in points]
+
+    def summary(self):
+        # Lines of 'phase p50 p95 p99' (ms), slowest phases first.
+        phases = sorted(self.history, key=lambda phase: -self.percentiles(phase)[1])
+        lines = ["%-22s %7s %7s %7s" % ("ms", "p50", "p95", "p99")]
+        for phase in phases:
+            lines.append("%-22s %7.2f %7.2f %7.2f" % tuple([phase] + self.percentiles(phase)))
+        return lines
+
+    def close(self):
+        if self.out != None:
+            self.out.close()
+            self.out = None
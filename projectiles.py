@@ -0,0 +1,304 @@
+import struct
+import zlib
+
+import numpy
+
+from geometry import Point2D, Vector2D
+from particles import Sprites, on_canvas
+
+#
+# projectiles.py
+#
+# Keeps a world's Photons as rows of NumPy arrays instead of agents:
+#
+#   self.projectiles = Projectiles(self, Photon, TIME_STEP, photon_hits)
+#
+# and ships 'fire' into it instead of spawning Photons. Every photon
+# lives exactly Photon.LIFETIME ticks unless it hits something, so the
+# rows are a ring in the order they were fired: the oldest is always at
+# the head, and a tick's expiries are just the head moving past them.
+# A photon that hits something is marked dead where it is (a
+# tombstone), and the head skips it when it gets there. If the ring is
+# full the oldest photon makes way for the new one.
+#
+# Game.update calls 'step' once a tick, after the integrator and before
+# the agents, which moves (and wraps) every photon at once, ages them
+# and retires the expired ones; after the agents have updated it calls
+# 'collide', which looks for hits. The photons behave as the agents
+# did, which came after the ships in world.agents: they first move the
+# tick after they are fired, an expiring photon hits nothing, and a
+# hit is whatever 'hits' (the game's photon_hits, given a stand-in
+# photon, a Shot) says, checked oldest photon first. Only the photons
+# whose path this tick came near some Shootable -- checked for all
+# photons against all Shootables in one go -- get that far. A game
+# whose photons pass through some targets can say so with 'side': given
+# a target, the owner (player_one) whose photons can't hit it, or None;
+# the photons near only such targets are then not handed to 'hits'.
+#
+# Photons are drawn through a Sprites (see particles.py) in their
+# owner's shape and color, from the Photon class's SHAPES and COLORS;
+# in an 'open' world only the ones on the canvas are.
+# They count in Game.state_hash, and snapshot.py saves them.
+#
+
+class Shot:
+    # What first_hit and Shootable.hit_time look at of a photon; the
+    # store points it at each photon it checks.
+
+    def __init__(self, world):
+        self.world      = world
+        self.position   = Point2D()
+        self.velocity   = Vector2D()
+        self.player_one = True
+
+
+class Projectiles:
+
+    CAPACITY = 1024 # most photons in flight at once
+    ROW      = struct.Struct('<I')
+
+    def __init__(self, world, kind, time_step, hits, side=None, capacity=None):
+        self.world     = world
+        self.time_step = time_step
+        self.hits      = hits
+        self.side      = side
+        self.lifetime  = kind.LIFETIME
+        self.colors    = kind.COLORS
+        self.capacity  = self.CAPACITY if capacity == None else capacity
+
+        # 'head' and 'tail' count the photons ever retired and fired;
+        # the ones in flight are in rows head..tail-1, modulo capacity.
+        size = self.capacity
+        self.x     = numpy.zeros(size)
+        self.y     = numpy.zeros(size)
+        self.vx    = numpy.zeros(size)
+        self.vy    = numpy.zeros(size)
+        self.px    = numpy.zeros(size) # where each was a tick ago
+        self.py    = numpy.zeros(size)
+        self.age   = numpy.zeros(size, dtype=numpy.int32)
+        self.owner = numpy.zeros(size, dtype=bool) # player_one
+        self.alive = numpy.zeros(size, dtype=bool)
+        self.head  = 0
+        self.tail  = 0
+        self.dropped = 0 # photons retired early because the ring was full
+
+        # Each owner's outline, (owner, corner, x/y).
+        shapes = kind.SHAPES
+        self.outline = numpy.array([shapes.get(False, shapes[True]), shapes[True]], dtype=float)
+        self.shot    = Shot(world)
+        self.sprites = Sprites()
+
+    def __len__(self):
+        return int(numpy.count_nonzero(self.alive))
+
+    def spans(self):
+        # The rows in flight, as one or two (start, end) slices.
+        count = self.tail - self.head
+        if count == 0:
+            return ()
+        start = self.head % self.capacity
+        end = start + count
+        if end <= self.capacity:
+            return ((start, end),)
+        return ((start, self.capacity), (0, end - self.capacity))
+
+    def rows(self):
+        # The live photons' rows, oldest first.
+        spans = self.spans()
+        if not spans:
+            return numpy.zeros(0, dtype=numpy.intp)
+        rows = numpy.concatenate([numpy.arange(start, end) for start, end in spans])
+        return rows[self.alive[rows]]
+
+    def fire(self, position, velocity, owner=True):
+        if self.tail - self.head == self.capacity:
+            self.alive[self.head % self.capacity] = False
+            self.head += 1
+            self.dropped += 1
+        row = self.tail % self.capacity
+        self.x[row] = self.px[row] = position.x
+        self.y[row] = self.py[row] = position.y
+        self.vx[row] = velocity.dx
+        self.vy[row] = velocity.dy
+        self.age[row]   = 0
+        self.owner[row] = owner
+        self.alive[row] = True
+        self.tail += 1
+
+    def clear(self):
+        self.alive[:] = False
+        self.head = self.tail = 0
+
+    def step(self):
+        if self.tail == self.head:
+            return
+        world = self.world
+        bounds = world.bounds
+        dt = self.time_step
+        for start, end in self.spans():
+            x, y = self.x[start:end], self.y[start:end]
+            self.px[start:end] = x
+            self.py[start:end] = y
+            x += self.vx[start:end] * dt
+            y += self.vy[start:end] * dt
+            if world.topology == 'wrapped':
+                for values, low, high in ((x, bounds.xmin, bounds.xmax), (y, bounds.ymin, bounds.ymax)):
+                    values -= numpy.floor((values - low) / (high - low)) * (high - low)
+            elif world.topology == 'bound':
+                numpy.clip(x, bounds.xmin, bounds.xmax, out=x)
+                numpy.clip(y, bounds.ymin, bounds.ymax, out=y)
+            self.age[start:end] += 1
+        self.retire()
+
+    def collide(self):
+        # The photons that moved this tick (not the ones fired during
+        # it) against everything in the spatial index.
+        if self.tail == self.head or not self.world.index.where:
+            return
+        rows = self.near_targets()
+        if len(rows) == 0:
+            return
+        shot = self.shot
+        hits = self.hits
+        x, y, vx, vy, owner, alive = self.x, self.y, self.vx, self.vy, self.owner, self.alive
+        for row in rows.tolist():
+            shot.position.set(x[row], y[row])
+            shot.velocity.set(vx[row], vy[row])
+            shot.player_one = bool(owner[row])
+            if hits(shot):
+                alive[row] = False
+        self.retire()
+
+    def retire(self):
+        # Move the head past the expired photons and the tombstones.
+        alive, age, lifetime, capacity = self.alive, self.age, self.lifetime, self.capacity
+        while self.head < self.tail:
+            row = self.head % capacity
+            if alive[row] and age[row] < lifetime:
+                break
+            alive[row] = False
+            self.head += 1
+
+    def targets(self):
+        # The centers of the bodies in the world's spatial index, their
+        # reach squared, and their sides (see 'side'; None without one).
+        world = self.world
+        bodies = list(world.index.where)
+        integrator = world.integrator
+        places = [body.row for body in bodies] if integrator != None else None
+        if places != None and None not in places:
+            centers = integrator.position[places]
+            cx, cy = centers[:, 0], centers[:, 1]
+        else:
+            cx = numpy.array([body.position.x for body in bodies])
+            cy = numpy.array([body.position.y for body in bodies])
+        reach = numpy.array([body.radius for body in bodies]) + 1e-6
+        sides = None
+        if self.side != None:
+            sides = numpy.array([-1 if side == None else int(side) for side in map(self.side, bodies)])
+        return cx, cy, reach * reach, sides
+
+    def near_targets(self):
+        # The rows of the photons that moved this tick and whose path
+        # passed within reach of something in the world's spatial index
+        # that they can hit, oldest first. Works on the ring's one or
+        # two spans as they are, dead rows and all, rather than picking
+        # the live rows out first.
+        world = self.world
+        cx, cy, reach, sides = self.targets()
+        wrapped = world.topology == 'wrapped'
+        if wrapped:
+            width, height = world.bounds.width(), world.bounds.height()
+        dt = self.time_step
+        found = []
+        for start, end in self.spans():
+            tx = self.vx[start:end] * dt
+            ty = self.vy[start:end] * dt
+            dx = self.x[start:end][:, None] - cx
+            dy = self.y[start:end][:, None] - cy
+            if wrapped:
+                dx -= numpy.round(dx / width) * width
+                dy -= numpy.round(dy / height) * height
+            tx, ty = tx[:, None], ty[:, None]
+            dx -= tx # from the target to where the photon started
+            dy -= ty
+            t = dx * tx + dy * ty
+            t /= -numpy.maximum(tx * tx + ty * ty, 1e-300)
+            numpy.minimum(numpy.maximum(t, 0.0, out=t), 1.0, out=t)
+            dx += tx * t
+            dy += ty * t
+            near = dx * dx + dy * dy <= reach
+            if sides is not None:
+                near &= sides != self.owner[start:end][:, None]
+            near = near.any(axis=1)
+            near &= self.alive[start:end]
+            near &= self.age[start:end] > 0
+            found.append(numpy.flatnonzero(near) + start)
+        return found[0] if len(found) == 1 else numpy.concatenate(found)
+
+    def screen_coords(self, rows, alpha=1.0):
+        world = self.world
+        bounds = world.bounds
+        x, y = self.x[rows], self.y[rows]
+        if alpha < 1.0:
+            back_x, back_y = self.px[rows] - x, self.py[rows] - y
+            if world.topology == 'wrapped':
+                back_x -= numpy.round(back_x / bounds.width()) * bounds.width()
+                back_y -= numpy.round(back_y / bounds.height()) * bounds.height()
+            x = x + back_x * (1.0 - alpha)
+            y = y + back_y * (1.0 - alpha)
+        wh = world.WINDOW_HEIGHT
+        scale = wh / bounds.height()
+        outline = self.outline[self.owner[rows].astype(numpy.intp)]
+        coords = numpy.empty((len(rows), 10))
+        coords[:, 0:8:2] = ((x - bounds.xmin) * scale)[:, None] + outline[:, :, 0] * scale
+        coords[:, 1:8:2] = (wh - (y - bounds.ymin) * scale)[:, None] - outline[:, :, 1] * scale
+        coords[:, 8:10] = coords[:, 0:2]
+        return coords
+
+    def on_show(self):
+        # The live photons' rows, less those off the canvas of an
+        # 'open' world.
+        rows = self.rows()
+        if self.world.topology == 'open':
+            rows = rows[on_canvas(self.world, self.screen_coords(rows))]
+        return rows
+
+    def draw(self, alpha=1.0):
+        rows = self.on_show()
+        colors = self.colors
+        self.sprites.draw(self.world.canvas, self.screen_coords(rows, alpha).tolist(),
+                          [colors[owner] for owner in self.owner[rows].tolist()])
+
+    def render_snapshot(self):
+        # For Game.render_snapshot: (key, coords, color) per photon.
+        rows = self.on_show()
+        colors = self.colors
+        owners = self.owner[rows].tolist()
+        return tuple((('photon', n), row, colors[owners[n]]) for n, row in enumerate(self.screen_coords(rows).tolist()))
+
+    def hash(self, crc):
+        # Game.state_hash's CRC, carried on over every photon in flight.
+        rows = self.rows()
+        state = numpy.stack((self.x[rows], self.y[rows], self.vx[rows], self.vy[rows]), axis=1)
+        return zlib.crc32(state.tobytes(), crc)
+
+    def pack(self):
+        # The photons in flight as bytes, for snapshot.py.
+        rows = self.rows()
+        return b''.join([self.ROW.pack(len(rows))] +
+                        [array[rows].tobytes() for array in (self.x, self.y, self.vx, self.vy, self.px, self.py, self.age, self.owner)])
+
+    def unpack(self, data, offset):
+        # Put back what 'pack' saved at 'offset'; returns the offset
+        # just past it.
+        count, = self.ROW.unpack_from(data, offset)
+        offset += self.ROW.size
+        self.clear()
+        for array in (self.x, self.y, self.vx, self.vy, self.px, self.py, self.age, self.owner):
+            size = count * array.itemsize
+            array[:count] = numpy.frombuffer(bytes(data[offset:offset + size]), dtype=array.dtype)
+            offset += size
+        self.alive[:count] = True
+        self.tail = count
+        return offset
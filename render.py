@@ -0,0 +1,251 @@
+import numpy
+
+#
+# render.py
+#
+# Draws a world's agents with a few array operations per frame instead
+# of a Point2D list and a loop of arithmetic per agent. A world turns
+# it on by setting its 'renderer', e.g.
+#
+#   self.renderer = Renderer(self)
+#
+# and Game.draw (and render_snapshot) then go through it.
+#
+# Every agent describes its shape by 'outline', which returns a
+# template -- the shape's corners as (x, y) offsets from its position,
+# x along a heading and y across it -- and the heading, or None for
+# shapes that don't turn (then x and y are just x and y). A template
+# that is returned again (the same object) is only turned into an
+# array once, so agents whose shape never changes cost one call here.
+#
+# Each frame, agents are put in groups by how many corners they have.
+# A group's templates are stacked, turned by their headings, moved to
+# their positions (or 'alpha' of the way from where they were a tick
+# ago) and put through one affine world-to-window transform; every
+# agent's window coordinates then come out as one flat, closed row,
+# x0,y0,x1,y1,...,x0,y0, as Game.screen_coords gives, ready to hand to
+# the canvas.
+#
+# 'window_to_world' is the same transform the other way round, for a
+# whole batch of window points (e.g. a frame's queued mouse events).
+#
+# In an 'open' world, agents entirely off the canvas are left out
+# (and their polygons hidden). And when frames take too long, the
+# renderer's Governor lowers the level of detail: agents whose class
+# says DETAIL_OPTIONAL (asteroids) are drawn with only every second or
+# third corner, and the emitter skips its dimmer sparks. Ships,
+# paddles, balls and photons are always drawn in full. Game.draw tells
+# the governor how long each frame took, and detail comes back by
+# itself once frames are quick again.
+#
+
+class Governor:
+    # Picks the level of detail from how long frames take. 'frame' is
+    # told each frame's time; it keeps a running average, and when that
+    # stays above BUSY (or below IDLE) of the time a frame has, goes one
+    # level down (or up). After a change it waits HOLD frames before
+    # the next, so the level doesn't flap between two.
+
+    CORNER_STEPS = (1, 2, 3) # per level: draw every n-th corner of DETAIL_OPTIONAL outlines
+    SPARK_BANDS  = (3, 2, 1) # per level: how many of the sparks' bands (brightest first) are drawn
+    BUSY      = 0.75
+    IDLE      = 0.4
+    SMOOTHING = 0.1
+    HOLD      = 30
+
+    def __init__(self, frame_length):
+        self.frame_length = frame_length
+        self.level   = 0   # 0 is full detail
+        self.average = 0.0 # seconds per frame, lately
+        self.since   = 0   # frames since the level last changed
+        self.changes = 0
+
+    def frame(self, seconds):
+        self.average += (seconds - self.average) * self.SMOOTHING
+        self.since += 1
+        if self.since < self.HOLD:
+            return
+        if self.average > self.BUSY * self.frame_length and self.level < len(self.CORNER_STEPS) - 1:
+            self.level += 1
+        elif self.average < self.IDLE * self.frame_length and self.level > 0:
+            self.level -= 1
+        else:
+            return
+        self.since = 0
+        self.changes += 1
+
+    def corner_step(self):
+        return self.CORNER_STEPS[self.level]
+
+    def spark_bands(self):
+        return self.SPARK_BANDS[self.level]
+
+
+class Renderer:
+
+    def __init__(self, world):
+        self.world     = world
+        self.templates = {} # (id(template), step) -> (template, its corners as an array, its reach)
+        self.used      = {} # the ones drawn this frame; the rest are forgotten
+        self.culled    = [] # the agents left out of the last frame
+        self.hidden    = set() # the agents whose polygons 'draw' hid
+        self.governor  = Governor(1.0 / world.FRAMES_PER_SECOND)
+
+    def transform(self):
+        # The world-to-window transform as (scale, x0, y0): a point's
+        # window coordinates are x0 + scale*x and y0 - scale*y.
+        world = self.world
+        bounds = world.bounds
+        wh = world.WINDOW_HEIGHT
+        scale = wh / bounds.height()
+        return scale, -bounds.xmin * scale, wh + bounds.ymin * scale
+
+    def window_to_world(self, x, y):
+        # Arrays of window x and y (in pixels) to arrays of world x and y.
+        scale, x0, y0 = self.transform()
+        return (numpy.asarray(x, dtype=float) - x0) / scale, (y0 - numpy.asarray(y, dtype=float)) / scale
+
+    def world_to_window(self, x, y):
+        scale, x0, y0 = self.transform()
+        return x0 + scale * numpy.asarray(x, dtype=float), y0 - scale * numpy.asarray(y, dtype=float)
+
+    def corners(self, template, step=1):
+        # A template (every 'step'-th corner of it) as a (corners, 2)
+        # array, and how far its farthest corner is from the middle;
+        # remembered for next time.
+        key = (id(template), step)
+        found = self.templates.get(key)
+        if found == None or found[0] is not template:
+            if hasattr(template[0], 'dx'):
+                points = numpy.array([(v.dx, v.dy) for v in template], dtype=float)
+            else:
+                points = numpy.array(template, dtype=float)
+            points = points[::step]
+            found = (template, points, float(numpy.sqrt((points * points).sum(axis=1)).max()))
+        self.used[key] = found
+        return found[1], found[2]
+
+    def shapes(self, alpha=1.0):
+        # (agent, coords, color) for every agent on show, in the order
+        # they are updated, with coords a flat list as described above.
+        world = self.world
+        agents = world.agents
+        count = len(agents)
+        self.culled = []
+        if count == 0:
+            return []
+        self.used = {}
+        step = self.governor.corner_step()
+        integrator = world.integrator
+        xs = [0.0] * count
+        ys = [0.0] * count
+        hx = [1.0] * count
+        hy = [0.0] * count
+        reach = [0.0] * count
+        colors = [None] * count
+        integrated = []   # (number, row) of agents whose position is in the integrator
+        groups = {}       # corners -> ([number], [template array])
+        for n, agent in enumerate(agents):
+            template, heading = agent.outline()
+            if step > 1 and agent.DETAIL_OPTIONAL:
+                points, reach[n] = self.corners(template, step)
+            else:
+                points, reach[n] = self.corners(template)
+            group = groups.get(len(points))
+            if group == None:
+                group = groups[len(points)] = ([], [])
+            group[0].append(n)
+            group[1].append(points)
+            if heading != None:
+                hx[n] = heading.dx
+                hy[n] = heading.dy
+            row = getattr(agent, 'row', None)
+            if row != None:
+                integrated.append((n, row))
+            else:
+                p = agent.position
+                xs[n] = p.x
+                ys[n] = p.y
+            colors[n] = agent.color()
+        self.templates = self.used
+
+        x = numpy.array(xs)
+        y = numpy.array(ys)
+        if integrated:
+            numbers, rows = zip(*integrated)
+            numbers = list(numbers)
+            places = integrator.position[list(rows)]
+            x[numbers] = places[:, 0]
+            y[numbers] = places[:, 1]
+        if alpha < 1.0 and world.previous:
+            x, y = self.in_between(agents, x, y, alpha)
+        hx = numpy.array(hx)
+        hy = numpy.array(hy)
+
+        scale, x0, y0 = self.transform()
+        sx = x0 + scale * x # each agent's position in the window
+        sy = y0 - scale * y
+        visible = None
+        if world.topology == 'open':
+            r = numpy.array(reach) * scale
+            visible = (sx + r >= 0.0) & (sx - r <= world.WINDOW_WIDTH) & (sy + r >= 0.0) & (sy - r <= world.WINDOW_HEIGHT)
+            self.culled = [agents[n] for n in numpy.flatnonzero(~visible).tolist()]
+        shown = [None] * count
+        for corners, (numbers, templates) in groups.items():
+            t = numpy.stack(templates) * scale # (agents, corners, 2)
+            numbers = numpy.array(numbers)
+            if visible is not None:
+                keep = visible[numbers]
+                numbers = numbers[keep]
+                t = t[keep]
+            hxs, hys = hx[numbers][:, None], hy[numbers][:, None]
+            coords = numpy.empty((len(numbers), 2 * corners + 2))
+            coords[:, 0:2 * corners:2] = sx[numbers][:, None] + t[:, :, 0] * hxs - t[:, :, 1] * hys
+            coords[:, 1:2 * corners:2] = sy[numbers][:, None] - t[:, :, 0] * hys - t[:, :, 1] * hxs
+            coords[:, 2 * corners:] = coords[:, 0:2]
+            for n, row in zip(numbers.tolist(), coords.tolist()):
+                shown[n] = (agents[n], row, colors[n])
+        if visible is not None:
+            return [entry for entry in shown if entry != None]
+        return shown
+
+    def in_between(self, agents, x, y, alpha):
+        # Positions 'alpha' of the way from where the agents were a
+        # tick ago (see Game.remember_positions) to where they are now.
+        world = self.world
+        previous = world.previous
+        was_x = x.tolist()
+        was_y = y.tolist()
+        for n, agent in enumerate(agents):
+            p = previous.get(agent)
+            if p != None:
+                was_x[n] = p.x
+                was_y[n] = p.y
+        back_x = numpy.array(was_x) - x
+        back_y = numpy.array(was_y) - y
+        if world.topology == 'wrapped':
+            width, height = world.bounds.width(), world.bounds.height()
+            back_x -= numpy.round(back_x / width) * width
+            back_y -= numpy.round(back_y / height) * height
+        return x + back_x * (1.0 - alpha), y + back_y * (1.0 - alpha)
+
+    def draw(self, alpha=1.0):
+        world = self.world
+        canvas = world.canvas
+        items = world.items
+        hidden = self.hidden
+        shown = self.shapes(alpha)
+        now_hidden = set()
+        for agent in self.culled:
+            item = items.get(agent)
+            if item != None:
+                if agent not in hidden:
+                    canvas.itemconfig(item[0], state='hidden')
+                now_hidden.add(agent)
+        for agent, coords, color in shown:
+            if agent in hidden:
+                item = items.get(agent)
+                if item != None:
+                    canvas.itemconfig(item[0], state='normal')
+            world.draw_coords(agent, coords, color)
+        self.hidden = now_hidden
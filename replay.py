@@ -0,0 +1,183 @@
+import argparse
+import array
+import contextlib
+import importlib
+import os
+import struct
+import sys
+import time
+
+import pool
+
+#
+# replay.py
+#
+# Records a game's inputs so the match can be played again, headless
+# and as fast as the CPU allows, to chase down a stutter or a desync
+# offline.
+#
+# A game is deterministic given its seed (see Game.__init__) and the
+# window events it got on each tick (see Game.dispatch). A Recorder
+# logs both, plus Game.state_hash after every tick:
+#
+#   python3 dogfight.py --record match.rpl
+#
+# and 'replay' builds the same game with the same seed, feeds it the
+# same events before the same ticks, and checks the hash after each
+# one, stopping at the first tick that differs:
+#
+#   python3 replay.py match.rpl
+#
+# A file is a header (magic, version, game class, seed, whether
+# the game was vectorized, and the tick and event counts), then every
+# event as (tick, kind, a, b) -- the character code for a key, the
+# pixel position for the mouse -- then one CRC per tick.
+#
+
+MAGIC   = b'RPLY'
+VERSION = 1
+HEADER  = struct.Struct('<4sHIBII')
+EVENT   = struct.Struct('<IBii')
+KINDS   = ('key', 'motion', 'press', 'release')
+
+
+class Event:
+    # Just the fields the Game.handle_* methods look at.
+
+    def __init__(self, char='', x=0, y=0):
+        self.char = char
+        self.x    = x
+        self.y    = y
+
+
+class Recorder:
+
+    def __init__(self, game, path=None):
+        self.game   = game
+        self.path   = path
+        self.events = []
+        self.hashes = array.array('I')
+        game.recording = self
+
+    def log(self, kind, event):
+        if kind == 'key':
+            char = event.char
+            self.events.append((self.game.tick, KINDS.index(kind), ord(char) if char else 0, 0))
+        else:
+            self.events.append((self.game.tick, KINDS.index(kind), int(event.x), int(event.y)))
+
+    def ticked(self):
+        self.hashes.append(self.game.state_hash())
+
+    def save(self, path=None):
+        if path == None:
+            path = self.path
+        game = self.game
+        module = type(game).__module__
+        if module == '__main__':
+            # Recorded from 'python3 dogfight.py': name the module after the file.
+            module = os.path.splitext(os.path.basename(sys.modules['__main__'].__file__))[0]
+        name = (module + '.' + type(game).__qualname__).encode()
+        vectorized = 1 if game.integrator != None else 0
+        with open(path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, game.seed, vectorized, len(self.hashes), len(self.events)))
+            f.write(struct.pack('<H', len(name)) + name)
+            for event in self.events:
+                f.write(EVENT.pack(*event))
+            self.hashes.tofile(f)
+
+
+class Recording:
+    # A recorded match, as read back by 'load'.
+
+    def __init__(self, name, seed, vectorized, events, hashes):
+        self.name       = name
+        self.seed       = seed
+        self.vectorized = vectorized
+        self.events     = events
+        self.hashes     = hashes
+
+    def make_game(self):
+        module, cls = self.name.rsplit('.', 1)
+        game_class = getattr(importlib.import_module(module), cls)
+        if self.vectorized:
+            return game_class(headless=True, vectorized=True, seed=self.seed)
+        return game_class(headless=True, seed=self.seed)
+
+
+def load(path):
+    with open(path, 'rb') as f:
+        magic, version, seed, vectorized, ticks, count = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(path + " is not a version %d replay" % VERSION)
+        length, = struct.unpack('<H', f.read(2))
+        name = f.read(length).decode()
+        events = [EVENT.unpack(f.read(EVENT.size)) for n in range(count)]
+        hashes = array.array('I')
+        hashes.fromfile(f, ticks)
+    return Recording(name, seed, bool(vectorized), events, hashes)
+
+
+def replay(recording, verify=True):
+    # Play 'recording' back headless. Returns (ticks, seconds, first
+    # tick whose hash differs or None).
+    pool.clear()
+    with contextlib.redirect_stdout(None):
+        game = recording.make_game()
+    # Hashed exactly where the original was (inside Game.update, which
+    # a game's own update may do more after).
+    check = Recorder(game) if verify else None
+    events = recording.events
+    hashes = recording.hashes
+    next_event = 0
+    mismatch = None
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(None):
+        for tick in range(len(hashes)):
+            while next_event < len(events) and events[next_event][0] == tick:
+                kind, a, b = events[next_event][1:]
+                if KINDS[kind] == 'key':
+                    game.dispatch('key', Event(char=chr(a) if a else ''))
+                else:
+                    game.dispatch(KINDS[kind], Event(x=a, y=b))
+                next_event += 1
+            game.update()
+            if check != None and check.hashes[tick] != hashes[tick]:
+                mismatch = tick
+                break
+    seconds = time.perf_counter() - start
+    return (tick + 1 if hashes else 0), seconds, mismatch
+
+
+@contextlib.contextmanager
+def recording(game, argv):
+    # For a game's main: record it to the path after --record, if any,
+    # saving when the game ends.
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--record', help="save the match's inputs to this file for replay.py")
+    args, rest = parser.parse_known_args(argv)
+    recorder = None if args.record == None else Recorder(game, args.record)
+    try:
+        yield recorder
+    finally:
+        if recorder != None:
+            recorder.save()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Re-simulate a recorded match headless and check it plays out the same.")
+    parser.add_argument('path')
+    parser.add_argument('--no-verify', action='store_true', help="just time the replay")
+    args = parser.parse_args(argv)
+
+    recording = load(args.path)
+    ticks, seconds, mismatch = replay(recording, not args.no_verify)
+    rate = ticks / seconds if seconds > 0.0 else float('inf')
+    print("%s, seed %d: %d of %d ticks in %.3fs (%.0f ticks/s)" % (recording.name, recording.seed, ticks, len(recording.hashes), seconds, rate))
+    if mismatch != None:
+        print("DESYNC: state differs from the recording after tick %d" % mismatch)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
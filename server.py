@@ -0,0 +1,521 @@
+import argparse
+import asyncio
+import collections
+import collections.abc
+import contextlib
+import json
+import math
+import random
+import sys
+import time
+import traceback
+
+import dogfight
+import PlayPong
+from replay import Event
+
+#
+# server.py
+#
+# Hosts many matches at once in one process: every match is a headless
+# game, and one asyncio loop ticks them all on a shared fixed-rate
+# schedule, takes the players' inputs from local sockets and sends them
+# the state of their match.
+#
+#   python3 server.py --port 7000 --dogfight 50 --pong 50
+#   python3 server.py --demo 200 --seconds 10
+#
+# The protocol is one JSON object per line, both ways. A client sends
+#
+#   {"new": "dogfight", "seed": 5}   start a match and join it
+#   {"join": 3}                      join match 3
+#   {"key": "w"}                     a key, as Game.dispatch has it
+#   {"motion": [x, y]}               the mouse, in window pixels (also
+#   {"press": [x, y]}                "press" and "release")
+#   {"stats": true}                  ask for the server's numbers
+#
+# and gets back
+#
+#   {"joined": 3, "game": "dogfight"}
+#   {"match": 3, "tick": 120, "agents": [["Ship", x, y], ...]}
+#   {"report": "..."}                what the game printed
+#   {"over": 3}                      the match ended ('q')
+#   {"stats": {...}}
+#   {"error": "..."}
+#
+# Inputs go on the game's 'inputs' queue and are dispatched at the
+# start of its next tick (as in Game.run_threaded), so every match
+# plays out as it would in its own window, seed for seed.
+# A match a client started ends when its last client leaves (or
+# disconnects); the ones the server was started with wait for players.
+#
+# Anything malformed (a key that isn't one character, a point that
+# isn't two finite numbers) gets an error back and never reaches the
+# queue. A match whose tick raises anyway is ended, and the traceback
+# printed; the other matches play on.
+#
+# The scheduler runs the ticks every match owes, one match after the
+# other, then sends the state, then sleeps until the next tick is due.
+# It never runs more than MAX_CATCH_UP rounds in one go: when the
+# process can't keep up the ticks it can't make up are dropped, and
+# counted as skipped. For each match it keeps how long its ticks take
+# and how many of them finished after their deadline (the time the
+# tick after them was due), so 'stats' shows which matches, and how
+# much of the process, the load is going to. A client whose socket
+# can't keep up misses state messages rather than holding the loop up.
+#
+
+GAMES = {
+    'dogfight': dogfight.PlayDogfight,
+    'pong':     PlayPong.PlayPong,
+}
+
+
+class Match:
+
+    TIMINGS = 600 # ticks kept for the tick time percentiles
+
+    def __init__(self, id, kind, seed):
+        self.id      = id
+        self.kind    = kind
+        self.seed    = seed
+        with contextlib.redirect_stdout(None):
+            self.game = GAMES[kind](headless=True, seed=seed)
+        self.game.console.sink = self.report
+        self.clients = set()
+        self.kept    = False # see Server.new_match
+        self.ticks   = 0
+        self.late    = 0 # ticks that finished after their deadline
+        self.skipped = 0 # ticks dropped to catch up
+        self.busy    = 0.0
+        self.timings = collections.deque(maxlen=self.TIMINGS)
+
+    def report(self, chunk):
+        for line in chunk.splitlines():
+            self.send({'report': line})
+
+    def send(self, message):
+        line = (json.dumps(message, separators=(',', ':')) + "\n").encode()
+        for client in list(self.clients):
+            client.send_line(line)
+
+    def tick(self, deadline, clock):
+        start = time.perf_counter()
+        game = self.game
+        game.handle_inputs()
+        game.update()
+        seconds = time.perf_counter() - start
+        self.ticks += 1
+        self.busy += seconds
+        self.timings.append(seconds)
+        if clock() > deadline:
+            self.late += 1
+
+    def state(self):
+        agents = []
+        for agent in self.game.agents:
+            p = getattr(agent, 'position', None)
+            if p != None:
+                agents.append([type(agent).__name__, round(p.x, 2), round(p.y, 2)])
+        return {'match': self.id, 'tick': self.game.tick, 'agents': agents}
+
+    def stats(self):
+        timings = sorted(self.timings)
+        def percentile(q):
+            return round(1000.0 * timings[min(len(timings) - 1, int(q * len(timings)))], 3) if timings else 0.0
+        return {
+            'game': self.kind, 'seed': self.seed, 'tick': self.game.tick,
+            'agents': len(self.game.agents), 'clients': len(self.clients),
+            'late': self.late, 'skipped': self.skipped,
+            'tick_ms_p50': percentile(0.5), 'tick_ms_p99': percentile(0.99),
+        }
+
+
+def is_point(value):
+    # Whether a client's [x, y] is two finite numbers.
+    return (isinstance(value, list) and len(value) == 2 and
+            all(isinstance(v, (int, float)) and not isinstance(v, bool) and math.isfinite(v) for v in value))
+
+
+class Connection:
+    # One client's socket, and the match it is in.
+
+    MAX_BUFFERED = 256 * 1024 # bytes waiting to go out before state is dropped
+
+    def __init__(self, server, reader, writer):
+        self.server  = server
+        self.reader  = reader
+        self.writer  = writer
+        self.match   = None
+        self.dropped = 0
+
+    def send_line(self, line, droppable=False):
+        transport = self.writer.transport
+        if transport.is_closing():
+            return
+        if droppable and transport.get_write_buffer_size() > self.MAX_BUFFERED:
+            self.dropped += 1
+            return
+        self.writer.write(line)
+
+    def send(self, message):
+        self.send_line((json.dumps(message, separators=(',', ':')) + "\n").encode())
+
+    def enter(self, match):
+        self.leave()
+        self.match = match
+        match.clients.add(self)
+        self.send({'joined': match.id, 'game': match.kind})
+
+    def leave(self):
+        match = self.match
+        if match != None:
+            match.clients.discard(self)
+            self.match = None
+            if not match.clients and not match.kept and self.server.matches.get(match.id) is match:
+                self.server.end_match(match) # nobody left to play it
+
+    def handle(self, message):
+        # Everything is checked here, before it gets near a game: a bad
+        # input would otherwise only fail on the match's next tick.
+        server = self.server
+        if 'new' in message:
+            if not isinstance(message['new'], str) or message['new'] not in GAMES:
+                self.send({'error': "no game called %r" % (message['new'],)})
+                return
+            seed = message.get('seed')
+            if seed != None and (not isinstance(seed, int) or isinstance(seed, bool)):
+                self.send({'error': "a seed is a whole number"})
+                return
+            self.enter(server.new_match(message['new'], seed))
+        elif 'join' in message:
+            if not isinstance(message['join'], collections.abc.Hashable):
+                self.send({'error': "no match %r" % (message['join'],)})
+                return
+            match = server.matches.get(message['join'])
+            if match == None:
+                self.send({'error': "no match %r" % message['join']})
+                return
+            self.enter(match)
+        elif 'stats' in message:
+            self.send({'stats': server.stats()})
+        elif 'leave' in message:
+            self.leave()
+        elif self.match == None:
+            self.send({'error': "not in a match"})
+        elif 'key' in message:
+            key = message['key']
+            if not isinstance(key, str) or len(key) != 1:
+                self.send({'error': "a key is one character"})
+                return
+            self.match.game.inputs.put(('key', Event(char=key)))
+        else:
+            for kind in ('motion', 'press', 'release'):
+                if kind in message:
+                    point = message[kind]
+                    if not is_point(point):
+                        self.send({'error': "%s takes [x, y], two numbers" % kind})
+                        return
+                    x, y = point
+                    self.match.game.inputs.put((kind, Event(x=x, y=y)))
+                    return
+            self.send({'error': "don't know what to do with that"})
+
+    async def serve(self):
+        try:
+            while True:
+                line = await self.reader.readline()
+                if not line:
+                    break
+                try:
+                    message = json.loads(line)
+                except ValueError:
+                    self.send({'error': "not JSON"})
+                    continue
+                if not isinstance(message, dict):
+                    self.send({'error': "not a JSON object"})
+                    continue
+                self.handle(message)
+        except ConnectionError:
+            pass
+        finally:
+            self.leave()
+            self.server.connections.discard(self)
+            self.writer.close()
+
+
+class Server:
+
+    TICKS_PER_SECOND = 60
+    MAX_CATCH_UP     = 8 # rounds of ticks run before state is sent again
+    SEND_EVERY       = 2 # ticks between state messages
+
+    def __init__(self, ticks_per_second=None, send_every=None, seed=None):
+        self.ticks_per_second = self.TICKS_PER_SECOND if ticks_per_second == None else ticks_per_second
+        self.send_every  = self.SEND_EVERY if send_every == None else send_every
+        self.random      = random.Random(seed)
+        self.matches     = {}
+        self.connections = set()
+        self.next_id     = 1
+        self.rounds      = 0
+        self.skipped     = 0 # rounds dropped to catch up
+        self.failed      = 0 # matches ended by an exception in their tick
+        self.busy        = 0.0
+        self.started     = None
+        self.listener    = None
+        self.running     = False
+
+    def new_match(self, kind, seed=None, kept=False):
+        # A match ends when its last client leaves, unless it is 'kept'
+        # (the ones the server was started with, which wait for players).
+        if seed == None:
+            seed = self.random.randrange(2**32)
+        match = Match(self.next_id, kind, seed)
+        match.kept = kept
+        self.matches[match.id] = match
+        self.next_id += 1
+        return match
+
+    def end_match(self, match):
+        del self.matches[match.id]
+        match.send({'over': match.id})
+        for client in list(match.clients):
+            client.leave()
+
+    async def start(self, host='127.0.0.1', port=0, path=None):
+        # Listen on a TCP port on this machine (0: any free one, see
+        # 'address'), or on a Unix socket at 'path'.
+        if path != None:
+            self.listener = await asyncio.start_unix_server(self.connect, path=path)
+        else:
+            self.listener = await asyncio.start_server(self.connect, host, port)
+        return self.listener
+
+    def address(self):
+        return self.listener.sockets[0].getsockname()
+
+    async def connect(self, reader, writer):
+        connection = Connection(self, reader, writer)
+        self.connections.add(connection)
+        await connection.serve()
+
+    async def run(self):
+        # The scheduler: runs until 'stop'.
+        loop   = asyncio.get_running_loop()
+        clock  = loop.time
+        period = 1.0 / self.ticks_per_second
+        self.running = True
+        self.started = clock()
+        due = self.started + period
+        while self.running:
+            now = clock()
+            owed = int((now - due) / period) + 1 if now >= due else 0
+            if owed > self.MAX_CATCH_UP:
+                dropped = owed - self.MAX_CATCH_UP
+                self.skipped += dropped
+                for match in self.matches.values():
+                    match.skipped += dropped
+                due += dropped * period
+                owed = self.MAX_CATCH_UP
+            start = time.perf_counter()
+            for n in range(owed):
+                deadline = due + period
+                for match in list(self.matches.values()):
+                    try:
+                        match.tick(deadline, clock)
+                    except Exception:
+                        # A broken match ends; the others play on.
+                        print("match %d (%s, seed %d) failed on tick %d:" % (match.id, match.kind, match.seed, match.game.tick), file=sys.stderr)
+                        traceback.print_exc()
+                        self.failed += 1
+                        match.send({'error': "the match failed"})
+                        self.end_match(match)
+                        continue
+                    if match.game.GAME_OVER:
+                        self.end_match(match)
+                due += period
+                self.rounds += 1
+            if owed > 0:
+                self.broadcast(owed)
+            self.busy += time.perf_counter() - start
+            await asyncio.sleep(max(0.0, due - clock()))
+
+    def broadcast(self, ticks):
+        # Send each match's state if a SEND_EVERY tick went by.
+        for match in self.matches.values():
+            if match.clients and match.game.tick % self.send_every < ticks:
+                line = (json.dumps(match.state(), separators=(',', ':')) + "\n").encode()
+                for client in list(match.clients):
+                    client.send_line(line, droppable=True)
+
+    def stop(self):
+        self.running = False
+        if self.listener != None:
+            self.listener.close()
+
+    def stats(self):
+        # The whole process's numbers, then each match's. 'load' is the
+        # fraction of the time spent ticking and sending: near 1.0 the
+        # server is saturated, and 'late' and 'skipped' start to climb.
+        seconds = asyncio.get_running_loop().time() - self.started if self.started != None else 0.0
+        return {
+            'matches': len(self.matches), 'connections': len(self.connections),
+            'rounds': self.rounds, 'skipped': self.skipped, 'failed': self.failed,
+            'load': round(self.busy / seconds, 3) if seconds > 0.0 else 0.0,
+            'dropped': sum(c.dropped for c in self.connections),
+            'per_match': {match.id: match.stats() for match in self.matches.values()},
+        }
+
+
+class Client:
+    # A client for the server over a local socket, for tests and bots:
+    #
+    #   client = await Client.connect(port=port)
+    #   match = await client.new('pong', seed=3)
+    #   await client.key('x')
+    #   state = await client.expect('tick')
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(cls, host='127.0.0.1', port=7000, path=None):
+        if path != None:
+            reader, writer = await asyncio.open_unix_connection(path)
+        else:
+            reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    async def send(self, message):
+        self.writer.write((json.dumps(message) + "\n").encode())
+        await self.writer.drain()
+
+    async def receive(self):
+        # The next message, or None once the server hangs up.
+        line = await self.reader.readline()
+        return json.loads(line) if line else None
+
+    async def expect(self, field):
+        # Skip messages until one with 'field' arrives.
+        while True:
+            message = await self.receive()
+            if message == None or field in message or 'error' in message:
+                return message
+
+    async def new(self, game, seed=None):
+        await self.send({'new': game} if seed == None else {'new': game, 'seed': seed})
+        return (await self.expect('joined'))['joined']
+
+    async def join(self, match):
+        await self.send({'join': match})
+        return (await self.expect('joined'))['joined']
+
+    async def key(self, char):
+        await self.send({'key': char})
+
+    async def mouse(self, kind, x, y):
+        await self.send({kind: [x, y]})
+
+    async def stats(self):
+        await self.send({'stats': True})
+        return (await self.expect('stats'))['stats']
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+async def demo_player(port, kind, seed, seconds, rng):
+    # Starts a match and mashes its keys a few times a second, reading
+    # every state message, until time is up.
+    client = await Client.connect(port=port)
+    await client.new(kind, seed)
+    keys = 'adwsc]' if kind == 'dogfight' else "az'/x."
+    loop = asyncio.get_running_loop()
+    end = loop.time() + seconds
+    received = 0
+    async def read():
+        nonlocal received
+        while await client.receive() != None:
+            received += 1
+    reading = asyncio.ensure_future(read())
+    while loop.time() < end:
+        await client.key(rng.choice(keys))
+        await asyncio.sleep(0.1)
+    await client.close()
+    await asyncio.gather(reading, return_exceptions=True)
+    return received
+
+
+async def demo(matches, seconds, ticks_per_second, seed):
+    # A server and 'matches' loopback players, half dogfight and half
+    # pong; prints the numbers at the end.
+    server = Server(ticks_per_second, seed=seed)
+    await server.start()
+    port = server.address()[1]
+    scheduler = asyncio.ensure_future(server.run())
+    rng = random.Random(seed)
+    players = [demo_player(port, 'dogfight' if n % 2 == 0 else 'pong', seed + n, seconds, rng) for n in range(matches)]
+    async def numbers():
+        # Before the players leave, which ends their matches.
+        await asyncio.sleep(seconds)
+        return server.stats()
+    stats, *received = await asyncio.gather(numbers(), *players)
+    server.stop()
+    await scheduler
+    print_stats(stats)
+    print("%d state messages received by %d players" % (sum(received), matches))
+
+
+def print_stats(stats):
+    print("%d matches, %d rounds, %d skipped, load %.2f, %d messages dropped" % (
+        stats['matches'], stats['rounds'], stats['skipped'], stats['load'], stats['dropped']))
+    for id, match in sorted(stats['per_match'].items()):
+        print("  match %4d %-8s tick %6d  agents %4d  p50 %6.3f ms  p99 %6.3f ms  late %5d  skipped %5d" % (
+            id, match['game'], match['tick'], match['agents'], match['tick_ms_p50'], match['tick_ms_p99'],
+            match['late'], match['skipped']))
+
+
+async def serve(args):
+    server = Server(args.tps, seed=args.seed)
+    for kind in sorted(GAMES):
+        for n in range(getattr(args, kind)):
+            server.new_match(kind, kept=True)
+    await server.start(args.host, args.port, args.unix)
+    print("serving on %s" % (args.unix if args.unix != None else "%s:%d" % server.address()[:2]))
+    scheduler = asyncio.ensure_future(server.run())
+    try:
+        while args.stats_every > 0.0:
+            await asyncio.sleep(args.stats_every)
+            print_stats(server.stats())
+        await scheduler
+    finally:
+        server.stop()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Host many headless matches in one process, played over local sockets.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=7000)
+    parser.add_argument('--unix', help="listen on this Unix socket instead")
+    parser.add_argument('--tps', type=int, default=Server.TICKS_PER_SECOND, help="ticks per second")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--dogfight', type=int, default=0, help="dogfight matches to start with")
+    parser.add_argument('--pong', type=int, default=0, help="pong matches to start with")
+    parser.add_argument('--stats-every', type=float, default=0.0, help="print the numbers every this many seconds")
+    parser.add_argument('--demo', type=int, default=None, metavar='MATCHES', help="play this many loopback matches and print the numbers")
+    parser.add_argument('--seconds', type=float, default=5.0, help="how long --demo plays")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.demo != None:
+            asyncio.run(demo(args.demo, args.seconds, args.tps, args.seed))
+        else:
+            asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
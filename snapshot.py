@@ -0,0 +1,322 @@
+import array
+import math
+import random
+import struct
+
+from geometry import Point2D, Vector2D
+from pool import Pooled
+
+#
+# snapshot.py
+#
+# Packs a whole world into a few KB of bytes and back, and keeps the
+# last few seconds of those in a ring buffer so a match can be rewound.
+#
+#   data = snapshot.dumps(game)    # bytes
+#   snapshot.restore(game, data)   # back to exactly that moment
+#
+#   snapshot.Rewind(game, seconds=5.0)   # becomes game.rewind
+#   ...
+#   game.rewind.restore(back=60)   # one second ago, at 60 ticks/s
+#
+# Nothing is pickled. Every class says what it is made of in its
+# SNAPSHOT, a tuple of (attribute, kind) pairs, where kind is
+#
+#   'd'   a float           'P'   a Point2D
+#   'i'   an int            'V'   a Vector2D
+#   '?'   a bool            'V*'  a list of Vector2Ds (e.g. a polygon)
+#   'A'   one of the world's agents, or None (world fields only)
+#
+# and subclasses add theirs to their parent's. A missing (or None)
+# 'P' or 'V' comes back missing. The world's own SNAPSHOT holds its
+# counters and the agents it keeps track of; its random state is saved
+# too, so a restored game goes on exactly as the original did.
+#
+# Agents are stored in the order they are updated, each as its class's
+# number and its fields, packed with one struct per class. Agents the
+# world still refers to after they left it (a dead ship) are stored
+# after the live ones, and restored without joining the world.
+#
+# A restored world carries on bit for bit like the original, so the
+# snapshot also holds the two orders that are not part of any agent:
+# the integrator's rows, and how the spatial index has agents filed.
+# A world that keeps its photons in a projectiles.Projectiles has those
+# saved after that.
+#
+# Classes are numbered as they are first seen, so a snapshot can only
+# be restored by the process that took it.
+#
+
+MAGIC   = b'SNAP'
+HEADER  = struct.Struct('<4sII')
+CLASS   = struct.Struct('<H')
+COUNT   = struct.Struct('<H')
+GAUSS   = struct.Struct('<?d')
+ROWS    = struct.Struct('<I')
+INDEX   = struct.Struct('<dI')
+CODES   = {'d': 'd', 'i': 'i', '?': '?', 'P': 'dd', 'V': 'dd', 'A': 'i'}
+MISSING = (math.nan, math.nan)
+
+# Attributes an agent has that are not part of its state.
+NOT_STATE = frozenset(('world', 'pool', 'row'))
+
+
+class Layout:
+    # How one class is packed: its fixed-size fields in one struct, then
+    # each of its 'V*' lists as a count and that many vectors.
+
+    def __init__(self, cls):
+        self.cls    = cls
+        self.fixed  = [(name, kind) for name, kind in cls.SNAPSHOT if kind != 'V*']
+        self.lists  = [name for name, kind in cls.SNAPSHOT if kind == 'V*']
+        self.struct = struct.Struct('<' + ''.join(CODES[kind] for name, kind in self.fixed))
+        self.names  = frozenset(name for name, kind in cls.SNAPSHOT)
+
+    def check(self, obj):
+        # Catch a class that grew state its SNAPSHOT doesn't mention.
+        missing = [name for name in vars(obj) if name not in self.names and name not in NOT_STATE]
+        if missing:
+            raise ValueError("%s.SNAPSHOT leaves out %s" % (self.cls.__name__, ", ".join(sorted(missing))))
+
+    def pack(self, obj, numbers, row=None, rows=None):
+        # With a 'row', the integrated fields are read from 'rows' (the
+        # integrator's arrays as lists) instead of one at a time.
+        values = []
+        for name, kind in self.fixed:
+            if row is not None and name in rows:
+                values.extend(rows[name][row])
+                continue
+            value = getattr(obj, name, None)
+            if kind == 'P':
+                values.extend(MISSING if value is None else (value.x, value.y))
+            elif kind == 'V':
+                values.extend(MISSING if value is None else (value.dx, value.dy))
+            elif kind == 'A':
+                values.append(-1 if value is None else numbers[value])
+            else:
+                values.append(value)
+        parts = [self.struct.pack(*values)]
+        for name in self.lists:
+            vectors = getattr(obj, name)
+            parts.append(COUNT.pack(len(vectors)))
+            parts.append(struct.pack('<%dd' % (2 * len(vectors)), *[c for v in vectors for c in (v.dx, v.dy)]))
+        return parts
+
+    def unpack(self, obj, data, offset, agents):
+        # Fill in 'obj' from 'data' at 'offset'; returns the offset just
+        # past it. Fields go straight into its __dict__ (an integrated
+        # body has no row yet, so that is where they belong). 'A' fields are looked up in 'agents', which must
+        # already be complete, so the world's own fields go last.
+        values = self.struct.unpack_from(data, offset)
+        offset += self.struct.size
+        n = 0
+        state = obj.__dict__
+        for name, kind in self.fixed:
+            if kind == 'P' or kind == 'V':
+                x, y = values[n], values[n+1]
+                n += 2
+                if x != x: # NaN: it wasn't there
+                    state.pop(name, None)
+                elif kind == 'P':
+                    state[name] = Point2D(x, y)
+                else:
+                    state[name] = Vector2D(x, y)
+            elif kind == 'A':
+                state[name] = None if values[n] < 0 else agents[values[n]]
+                n += 1
+            else:
+                state[name] = values[n]
+                n += 1
+        for name in self.lists:
+            count, = COUNT.unpack_from(data, offset)
+            offset += COUNT.size
+            coords = struct.unpack_from('<%dd' % (2 * count), data, offset)
+            offset += 16 * count
+            state[name] = [Vector2D(coords[i], coords[i+1]) for i in range(0, len(coords), 2)]
+        return offset
+
+
+CLASSES = []  # class number -> class
+NUMBERS = {}  # class -> class number
+LAYOUTS = {}  # class -> Layout
+
+def layout_of(obj, check=True):
+    cls = type(obj)
+    layout = LAYOUTS.get(cls)
+    if layout is None:
+        plain = getattr(cls, 'plain_class', cls) # not the integrator's array subclass
+        layout = LAYOUTS.get(plain)
+        if layout is None:
+            layout = Layout(plain)
+            if check:
+                layout.check(obj)
+            NUMBERS[plain] = len(CLASSES)
+            CLASSES.append(plain)
+            LAYOUTS[plain] = layout
+        LAYOUTS[cls] = layout
+    return layout
+
+def blank(cls):
+    # An instance of 'cls' to fill in, without running its __init__.
+    if issubclass(cls, Pooled):
+        return cls.blank()
+    return cls.__new__(cls)
+
+
+def pack(world, buffer):
+    # Pack 'world' into the bytearray 'buffer' (which grows if it has
+    # to) and return the number of bytes used.
+    agents = list(world.agents)
+    numbers = dict((agent, n) for n, agent in enumerate(agents))
+    world_layout = layout_of(world, check=False)
+    for name, kind in world_layout.fixed:
+        if kind == 'A':
+            agent = getattr(world, name, None)
+            if agent is not None and agent not in numbers:
+                numbers[agent] = len(agents)
+                agents.append(agent)
+
+    version, words, gauss = world.random.getstate()
+    parts = [HEADER.pack(MAGIC, len(world.agents), len(agents) - len(world.agents)),
+             array.array('I', words).tobytes(),
+             GAUSS.pack(gauss is not None, 0.0 if gauss is None else gauss)]
+    integrator = world.integrator
+    rows = None
+    if integrator != None:
+        rows = dict((name, getattr(integrator, name)[:integrator.count].tolist()) for name in integrator.FIELDS)
+    for agent in agents:
+        layout = layout_of(agent)
+        parts.append(CLASS.pack(NUMBERS[layout.cls]))
+        parts.extend(layout.pack(agent, numbers, getattr(agent, 'row', None), rows))
+    parts.extend(world_layout.pack(world, numbers))
+
+    # The integrator's row order too: NumPy may round a row differently
+    # depending on where in the array it is.
+    order = array.array('I')
+    if integrator != None:
+        order.extend(numbers[body] for body in integrator.bodies)
+    parts.append(ROWS.pack(len(order)))
+    parts.append(order.tobytes())
+
+    # And how the spatial index has its agents filed, which decides
+    # what a photon that touches two targets at once hits first.
+    filing = array.array('i')
+    for agent, (column, row), place in world.index.filing():
+        filing.extend((numbers[agent], column, row, place))
+    parts.append(INDEX.pack(world.index.max_radius, len(filing) // 4))
+    parts.append(filing.tobytes())
+
+    if world.projectiles != None:
+        parts.append(world.projectiles.pack())
+
+    data = b''.join(parts)
+    buffer[:len(data)] = data
+    return len(data)
+
+def dumps(world):
+    buffer = bytearray()
+    size = pack(world, buffer)
+    return bytes(buffer[:size])
+
+RANDOM_WORDS = len(random.getstate()[1])
+
+def restore(world, data):
+    # Put 'world' back the way it was when 'data' was packed. Every
+    # agent in it now leaves; the snapshot's agents are rebuilt (pooled
+    # ones from their pools) and join in their original order.
+    assert not world.ticking, "restore between ticks, not during one"
+    magic, live, detached = HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError("not a world snapshot")
+    offset = HEADER.size
+
+    words = array.array('I')
+    words.frombytes(bytes(data[offset:offset + 4 * RANDOM_WORDS]))
+    offset += 4 * RANDOM_WORDS
+    has_gauss, gauss = GAUSS.unpack_from(data, offset)
+    offset += GAUSS.size
+    world.random.setstate((random.Random.VERSION, tuple(words), gauss if has_gauss else None))
+
+    if world.integrator != None:
+        world.integrator.remove_all()
+    for agent in list(world.agents):
+        agent.leave()
+    world.previous = {}
+
+    agents = []
+    for n in range(live + detached):
+        number, = CLASS.unpack_from(data, offset)
+        offset += CLASS.size
+        agent = blank(CLASSES[number])
+        offset = LAYOUTS[CLASSES[number]].unpack(agent, data, offset, agents)
+        agent.world = world
+        agents.append(agent)
+    offset = layout_of(world, check=False).unpack(world, data, offset, agents)
+    count, = ROWS.unpack_from(data, offset)
+    offset += ROWS.size
+    rows = array.array('I')
+    rows.frombytes(bytes(data[offset:offset + 4 * count]))
+    offset += 4 * count
+    max_radius, count = INDEX.unpack_from(data, offset)
+    offset += INDEX.size
+    filing = array.array('i')
+    filing.frombytes(bytes(data[offset:offset + 16 * count]))
+    offset += 16 * count
+    if world.projectiles != None:
+        if offset < len(data):
+            world.projectiles.unpack(data, offset)
+        else: # taken without a projectile store
+            world.projectiles.clear()
+
+    for agent in agents[:live]:
+        world.add(agent)
+    if world.integrator != None:
+        if not rows: # taken without an integrator
+            rows = [n for n in range(live) if hasattr(agents[n], 'row')]
+        world.integrator.add_all([agents[n] for n in rows])
+    world.index.refile([(agents[filing[k]], (filing[k+1], filing[k+2]), filing[k+3])
+                        for k in range(0, len(filing), 4)], max_radius)
+
+
+class Rewind:
+    # The snapshots of the last 'seconds' of a world, one every 'every'
+    # ticks, in preallocated buffers that are reused round and round.
+    # A world with one as its 'rewind' adds a snapshot after each tick.
+
+    SLOT_BYTES = 8 * 1024 # initial size of each buffer; they grow to fit
+
+    def __init__(self, world, seconds=5.0, every=1):
+        self.world    = world
+        self.every    = every
+        self.capacity = max(1, int(seconds * world.TICKS_PER_SECOND / every))
+        self.slots    = [bytearray(self.SLOT_BYTES) for n in range(self.capacity)]
+        self.sizes    = [0] * self.capacity
+        self.ticks    = [0] * self.capacity
+        self.newest   = -1
+        self.count    = 0
+        world.rewind  = self
+
+    def __len__(self):
+        return self.count
+
+    def record(self):
+        if self.world.tick % self.every != 0:
+            return
+        slot = (self.newest + 1) % self.capacity
+        self.sizes[slot] = pack(self.world, self.slots[slot])
+        self.ticks[slot] = self.world.tick
+        self.newest = slot
+        self.count = min(self.count + 1, self.capacity)
+
+    def restore(self, back=0):
+        # Go back to the snapshot 'back' snapshots before the newest
+        # (or the oldest one kept). Newer snapshots are dropped, so
+        # recording carries on from there. Returns the tick restored.
+        if self.count == 0:
+            raise IndexError("nothing to rewind to")
+        back = min(back, self.count - 1)
+        slot = (self.newest - back) % self.capacity
+        restore(self.world, memoryview(self.slots[slot])[:self.sizes[slot]])
+        self.newest = slot
+        self.count -= back
+        return self.ticks[slot]
@@ -0,0 +1,147 @@
+import math
+
+#
+# spatial.py
+#
+# A uniform grid over the world, used to find the agents that might be
+# touching a point without looking at every agent in the world.
+#
+# Game keeps one of these as 'world.index', holding every agent that
+# has a 'radius' (the Shootables). Agents are put in the cell that
+# holds their center. Game.update re-buckets them once per tick after
+# they have all moved, so during a tick an agent may have drifted up
+# to 'slack' world units from the cell it is filed under; 'query' looks
+# far enough out to cover that. A game sets 'slack' to the farthest one
+# of its agents can move in a tick (its top speed times TIME_STEP), so
+# a bigger TIME_STEP widens the queries with it.
+#
+# In a 'wrapped' world the grid is a torus too: the cells past the
+# right edge are the cells at the left edge, so a query near one edge
+# also finds agents just across it.
+#
+
+class SpatialHash:
+
+    SLACK = 1.0 # how far (in world units) an agent may move in one tick, unless the game says
+    BULK  = 32  # agents it takes before 'refresh' works out cells in bulk
+
+    def __init__(self, bounds, cell_size, wrapped, slack=None):
+        self.bounds  = bounds
+        self.wrapped = wrapped
+        self.slack   = self.SLACK if slack == None else slack
+        # Whole cells across and up, so that wrapping lines up exactly.
+        self.columns = max(1, int(bounds.width() // cell_size))
+        self.rows    = max(1, int(bounds.height() // cell_size))
+        self.cell_width  = bounds.width() / self.columns
+        self.cell_height = bounds.height() / self.rows
+        self.max_radius = 0.0
+        self.cells = {} # (column,row) -> list of agents
+        self.where = {} # agent -> (column,row)
+
+    def cell_of(self, position):
+        i = math.floor((position.x - self.bounds.xmin) / self.cell_width)
+        j = math.floor((position.y - self.bounds.ymin) / self.cell_height)
+        if self.wrapped:
+            return (i % self.columns, j % self.rows)
+        return (i, j)
+
+    def insert(self, agent):
+        cell = self.cell_of(agent.position)
+        self.where[agent] = cell
+        self.cells.setdefault(cell, []).append(agent)
+        if agent.radius > self.max_radius:
+            self.max_radius = agent.radius
+
+    def remove(self, agent):
+        cell = self.where.pop(agent, None)
+        if cell != None:
+            self.cells[cell].remove(agent)
+
+    def refresh(self, integrator=None):
+        # Move every agent whose center has changed cells. Given the
+        # world's integrator, and enough agents to be worth it, the cells
+        # of the agents that have a row in it are worked out from its
+        # positions all at once.
+        where = self.where
+        if integrator == None or len(where) < self.BULK:
+            for agent, cell in where.items():
+                new_cell = self.cell_of(agent.position)
+                if new_cell != cell:
+                    self.move(agent, cell, new_cell)
+            return
+        filed = list(where.items())
+        rows = [getattr(agent, 'row', None) for agent, cell in filed]
+        for (agent, cell), new_cell in zip(filed, self.cells_of(integrator, rows)):
+            if new_cell == None:
+                new_cell = self.cell_of(agent.position)
+            if new_cell != cell:
+                self.move(agent, cell, new_cell)
+
+    def cells_of(self, integrator, rows):
+        # The cells holding the integrator's positions at 'rows', as
+        # cell_of gives them; None where the row is None.
+        import numpy # only needed with an integrator, which needs it anyway
+        places = integrator.position[[0 if row == None else row for row in rows]]
+        i = numpy.floor((places[:, 0] - self.bounds.xmin) / self.cell_width).astype(int)
+        j = numpy.floor((places[:, 1] - self.bounds.ymin) / self.cell_height).astype(int)
+        if self.wrapped:
+            i %= self.columns
+            j %= self.rows
+        cells = list(zip(i.tolist(), j.tolist()))
+        if None in rows:
+            cells = [None if row == None else cell for row, cell in zip(rows, cells)]
+        return cells
+
+    def move(self, agent, cell, new_cell):
+        self.cells[cell].remove(agent)
+        self.cells.setdefault(new_cell, []).append(agent)
+        self.where[agent] = new_cell
+
+    def filing(self):
+        # (agent, cell, place in the cell's list) for every agent, in
+        # the order 'refresh' goes through them. Two indexes with the
+        # same filing return candidates in the same order; snapshot.py
+        # saves it for that reason.
+        cells = self.cells
+        return [(agent, cell, cells[cell].index(agent)) for agent, cell in self.where.items()]
+
+    def refile(self, filing, max_radius):
+        # Replace the contents with a 'filing' of (other) agents.
+        self.where = {}
+        places = {}
+        for agent, cell, place in filing:
+            self.where[agent] = cell
+            places.setdefault(cell, []).append((place, agent))
+        self.cells = {}
+        for cell, filed in places.items():
+            filed.sort(key=lambda entry: entry[0])
+            self.cells[cell] = [agent for place, agent in filed]
+        self.max_radius = max_radius
+
+    def span(self, low, high, size, count):
+        # The cell numbers from the one holding 'low' to the one holding
+        # 'high', wrapped around if the grid is a torus.
+        first = math.floor(low / size)
+        last  = math.floor(high / size)
+        if not self.wrapped:
+            return range(first, last + 1)
+        if last - first + 1 >= count:
+            return range(count)
+        return [n % count for n in range(first, last + 1)]
+
+    def query(self, position, extra=0.0):
+        # Every agent whose disc could contain 'position', or any point
+        # within 'extra' of it. These are only candidates: callers still
+        # do the exact test.
+        reach = self.max_radius + self.slack + extra
+        x = position.x - self.bounds.xmin
+        y = position.y - self.bounds.ymin
+        columns = self.span(x - reach, x + reach, self.cell_width, self.columns)
+        rows    = self.span(y - reach, y + reach, self.cell_height, self.rows)
+        found = []
+        for i in columns:
+            for j in rows:
+                cell = self.cells.get((i, j))
+                if cell:
+                    found.extend(cell)
+        return found
@@ -0,0 +1,393 @@
+import argparse
+import concurrent.futures
+import contextlib
+import csv
+import itertools
+import math
+import os
+import random
+import sys
+import time
+
+import pool
+import replay
+import dogfight
+import PlayPong
+from replay import Event
+
+#
+# sweep.py
+#
+# Plays thousands of headless matches, with bots at the controls, over
+# a grid of balance parameters, across a pool of worker processes:
+#
+#   python3 sweep.py dogfight --grid hpMax_one=10,15 MIN_DELAY=60,90 --repeats 200 --out df.csv
+#   python3 sweep.py pong --grid length=6,8 --repeats 500 --out pong.parquet
+#
+# Every point of the grid is played --repeats times, match n with seed
+# --seed + n, so any one match can be played again by itself (its
+# bots draw from their own random.Random, seeded from the match's seed,
+# and play through Game.dispatch like a person would).
+#
+# Results are written as matches finish, one row per match: the game,
+# match number, seed, the parameters, the winner ('one'/'two',
+# 'left'/'right', or '' if the match hit --max-ticks), the duration in
+# ticks, the hits each side landed and the power-ups each collected.
+# A .parquet path is written as Parquet (needs pyarrow, which is only
+# imported then), a row group per --flush rows; anything else is CSV.
+#
+# Matches are handed to the workers in chunks, so the processes spend
+# their time playing rather than passing messages, and each worker only
+# sends back a few numbers per match. Nothing is shared between workers,
+# so the sweep scales with the number of cores.
+#
+
+def weights(text):
+    # "2:1:1" -> (2.0, 1.0, 1.0)
+    return tuple(float(w) for w in text.split(":"))
+
+
+class DogfightBots:
+    # Player one flies with the keyboard: turn towards the other ship,
+    # thrust when it is far, shoot when it is in front. Player two puts
+    # the mouse on player one (a little off, like a person would) and
+    # shoots when close. Both only decide every REACTION ticks.
+
+    REACTION   = 4    # ticks between decisions
+    AIM_ERROR  = 2.0  # how far off player two puts the mouse, in world units
+    CONE       = 15.0 # degrees either side of the nose to shoot within
+    TURN_AT    = 30.0 # degrees off before turning
+    THRUST_AT  = 10.0 # distance to close before thrusting stops
+    RANGE      = 25.0 # distance to shoot from
+
+    def __init__(self, game, rng):
+        self.game = game
+        self.rng  = rng
+
+    def act(self):
+        game = self.game
+        if game.tick % self.REACTION != 0:
+            return
+        one, two = game.ship_one, game.ship_two
+        offset = game.offset(one.position, two.position)
+        distance = offset.magnitude()
+
+        off = (math.degrees(math.atan2(offset.dy, offset.dx)) - one.angle + 180.0) % 360.0 - 180.0
+        if off > self.TURN_AT:
+            game.dispatch('key', Event('a'))
+        elif off < -self.TURN_AT:
+            game.dispatch('key', Event('d'))
+        if distance > self.THRUST_AT:
+            game.dispatch('key', Event('w'))
+        if abs(off) < self.CONE and distance < self.RANGE:
+            game.dispatch('key', Event('c'))
+
+        # The mouse goes where player one is, seen from player two
+        # (across the edge if that is shorter).
+        x = two.position.x - offset.dx + self.rng.uniform(-self.AIM_ERROR, self.AIM_ERROR)
+        y = two.position.y - offset.dy + self.rng.uniform(-self.AIM_ERROR, self.AIM_ERROR)
+        game.dispatch('motion', Event(x=int((x - game.bounds.xmin) / game.bounds.width() * game.WINDOW_WIDTH),
+                                      y=int((1.0 - (y - game.bounds.ymin) / game.bounds.height()) * game.WINDOW_HEIGHT)))
+        if distance < self.RANGE:
+            game.dispatch('key', Event(']'))
+
+    def winner(self):
+        if self.game.ship_two.hp == 0:
+            return 'one'
+        if self.game.ship_one.hp == 0:
+            return 'two'
+        return None
+
+    def stats(self):
+        one, two = self.game.ship_one, self.game.ship_two
+        return two.times_hit, one.times_hit, one.powerups, two.powerups
+
+
+class PongBots:
+    # Each paddle follows the ball when it is coming its way, and serves
+    # right away. It aims to meet the ball up to MISS of a paddle length
+    # from its middle; the paddle stops within AGILITY/2 of its aim, so
+    # it misses when the aim is past 0.5 + AGILITY/2 (0.6) -- with 0.75,
+    # about one aim in five, and a 5-point match takes some 8000 ticks.
+
+    MISS = 0.75
+
+    def __init__(self, game, rng, points=5):
+        self.game   = game
+        self.rng    = rng
+        self.points = points
+        self.aim    = {True: 0.0, False: 0.0} # on_left -> where on the paddle to meet the ball
+
+    def act(self):
+        game = self.game
+        ball = game.ball
+        if ball == None:
+            return
+        if game.serving:
+            game.dispatch('key', Event('x' if game.left_turn else '.'))
+            return
+        paddle = game.left_paddle if ball.heading.dx < 0.0 else game.right_paddle
+        if game.tick % 30 == 0:
+            self.aim[paddle.on_left] = self.rng.uniform(-self.MISS, self.MISS) * paddle.length
+        off = ball.position.y + self.aim[paddle.on_left] - paddle.position.y
+        if abs(off) > paddle.length * paddle.AGILITY / 2.0:
+            if paddle.on_left:
+                game.dispatch('key', Event('z' if off > 0.0 else 'a'))
+            else:
+                game.dispatch('key', Event('/' if off > 0.0 else '\''))
+
+    def winner(self):
+        if self.game.left_score >= self.points:
+            return 'left'
+        if self.game.right_score >= self.points:
+            return 'right'
+        return None
+
+    def stats(self):
+        game = self.game
+        return game.left_returns, game.right_returns, 0, 0
+
+
+class Script:
+    # Plays a recorded match's events (see replay.py) on the same ticks,
+    # whatever the game does; for the other side, or to sweep parameters
+    # under fixed inputs. Winner and stats come from 'bots'.
+
+    def __init__(self, bots, events):
+        self.bots   = bots
+        self.events = events
+        self.next   = 0
+
+    def act(self):
+        game = self.bots.game
+        events = self.events
+        while self.next < len(events) and events[self.next][0] == game.tick:
+            kind, a, b = events[self.next][1:]
+            if replay.KINDS[kind] == 'key':
+                game.dispatch('key', Event(char=chr(a) if a else ''))
+            else:
+                game.dispatch(replay.KINDS[kind], Event(x=a, y=b))
+            self.next += 1
+
+    def winner(self):
+        return self.bots.winner()
+
+    def stats(self):
+        return self.bots.stats()
+
+
+# What each game's parameters set, after the game is made.
+
+def set_ship(attribute, *ships):
+    def apply(game, value):
+        for ship in ships:
+            ship = getattr(game, ship)
+            setattr(ship, attribute, value)
+            if attribute == 'hpMax':
+                ship.hp = value
+    return apply
+
+def set_game(attribute):
+    def apply(game, value):
+        setattr(game, attribute, value)
+    return apply
+
+def set_powerup_delay(attribute):
+    def apply(game, value):
+        setattr(game, attribute, value)
+        game.before_powerup = game.random.randint(game.MIN_DELAY, game.MAX_DELAY)
+    return apply
+
+def set_paddles(attribute):
+    def apply(game, value):
+        for paddle in (game.left_paddle, game.right_paddle):
+            setattr(paddle, attribute, value)
+            paddle.keep_within_bounds()
+    return apply
+
+GAMES = {
+    'dogfight': {
+        'make': lambda seed: dogfight.PlayDogfight(headless=True, seed=seed),
+        'bots': DogfightBots,
+        'parameters': {
+            'hpMax':            (int,     set_ship('hpMax', 'ship_one', 'ship_two')),
+            'hpMax_one':        (int,     set_ship('hpMax', 'ship_one')),
+            'hpMax_two':        (int,     set_ship('hpMax', 'ship_two')),
+            'shootDelay':       (int,     set_ship('shootDelay', 'ship_one', 'ship_two')),
+            'MIN_DELAY':        (int,     set_powerup_delay('MIN_DELAY')),
+            'MAX_DELAY':        (int,     set_powerup_delay('MAX_DELAY')),
+            'POWERUP_WEIGHTS':  (weights, set_game('POWERUP_WEIGHTS')), # ReverseLaser:MultiShot:Shield
+        },
+        'sides': ('one', 'two'),
+    },
+    'pong': {
+        'make': lambda seed: PlayPong.PlayPong(headless=True, seed=seed),
+        'bots': PongBots,
+        'parameters': {
+            'points': (int,      None), # match length, for the bots
+            'length': (float,    set_paddles('length')),
+        },
+        'sides': ('left', 'right'),
+    },
+}
+
+def cell(value):
+    # Weights go out as they came in, "2:1:1".
+    if isinstance(value, tuple):
+        return ":".join("%g" % v for v in value)
+    return value
+
+def columns(name, parameters):
+    a, b = GAMES[name]['sides']
+    return (['game', 'match', 'seed'] + list(parameters) +
+            ['winner', 'ticks', 'hits_' + a, 'hits_' + b, 'powerups_' + a, 'powerups_' + b])
+
+
+def play(name, seed, parameters, max_ticks, events=None):
+    # One match; returns (winner, ticks, hits a, hits b, powerups a, powerups b).
+    spec = GAMES[name]
+    game = spec['make'](seed)
+    rng = random.Random(seed)
+    if name == 'pong':
+        bots = spec['bots'](game, rng, parameters.get('points', 5))
+    else:
+        bots = spec['bots'](game, rng)
+    for parameter, value in parameters.items():
+        apply = spec['parameters'][parameter][1]
+        if apply != None:
+            apply(game, value)
+    player = bots if events == None else Script(bots, events)
+    winner = None
+    while game.tick < max_ticks and not game.GAME_OVER:
+        player.act()
+        game.update()
+        winner = bots.winner()
+        if winner != None:
+            break
+    return (winner or '', game.tick) + tuple(bots.stats())
+
+def play_chunk(name, jobs, max_ticks, events):
+    # Runs in a worker: play every (match, seed, parameters) in 'jobs'.
+    # The games report every hit; nobody is reading.
+    rows = []
+    with contextlib.redirect_stdout(None):
+        for match, seed, parameters in jobs:
+            pool.clear()
+            rows.append((match, seed, parameters) + play(name, seed, parameters, max_ticks, events))
+    return rows
+
+
+class CSVResults:
+
+    def __init__(self, path, names):
+        self.out = open(path, 'w', newline='')
+        self.writer = csv.writer(self.out)
+        self.writer.writerow(names)
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+        self.out.flush()
+
+    def close(self):
+        self.out.close()
+
+
+class ParquetResults:
+    # Rows are buffered and written a row group at a time.
+
+    def __init__(self, path, names, flush):
+        import pyarrow # only needed for .parquet output
+        import pyarrow.parquet
+        self.pyarrow = pyarrow
+        self.names   = names
+        self.flush   = flush
+        self.rows    = []
+        self.writer  = None
+        self.path    = path
+
+    def write(self, rows):
+        self.rows.extend(rows)
+        if len(self.rows) >= self.flush:
+            self.write_group()
+
+    def write_group(self):
+        if not self.rows:
+            return
+        table = self.pyarrow.table(dict((name, list(column)) for name, column in zip(self.names, zip(*self.rows))))
+        if self.writer == None:
+            self.writer = self.pyarrow.parquet.ParquetWriter(self.path, table.schema)
+        self.writer.write_table(table)
+        self.rows = []
+
+    def close(self):
+        self.write_group()
+        if self.writer != None:
+            self.writer.close()
+
+def open_results(path, names, flush):
+    if path.endswith('.parquet'):
+        return ParquetResults(path, names, flush)
+    return CSVResults(path, names)
+
+
+def grid(name, settings):
+    # ["hpMax=5,10", "MIN_DELAY=60,90"] -> every combination, as dicts.
+    known = GAMES[name]['parameters']
+    axes = []
+    for setting in settings:
+        parameter, _, values = setting.partition("=")
+        if parameter not in known:
+            raise ValueError("%s has no parameter %r (try: %s)" % (name, parameter, ", ".join(known)))
+        axes.append([(parameter, known[parameter][0](value)) for value in values.split(",")])
+    return [dict(point) for point in itertools.product(*axes)]
+
+def sweep(name, points, repeats, out, seed=1, max_ticks=36000, workers=None, chunk=None, flush=1000, events=None):
+    # Play every point 'repeats' times; returns the number of matches.
+    jobs = []
+    for point in points:
+        for n in range(repeats):
+            jobs.append((len(jobs), seed + len(jobs), point))
+    workers = workers or os.cpu_count() or 1
+    if chunk == None:
+        # A few chunks per worker, so they all finish at about the same time.
+        chunk = max(1, min(50, len(jobs) // (workers * 4)))
+    names = columns(name, points[0] if points else {})
+    results = open_results(out, names, flush)
+    try:
+        with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+            futures = [executor.submit(play_chunk, name, jobs[n:n + chunk], max_ticks, events)
+                       for n in range(0, len(jobs), chunk)]
+            for future in concurrent.futures.as_completed(futures):
+                rows = []
+                for match, match_seed, parameters, *outcome in future.result():
+                    rows.append([name, match, match_seed] + [cell(parameters[p]) for p in parameters] + outcome)
+                results.write(rows)
+    finally:
+        results.close()
+    return len(jobs)
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Play headless bot matches over a grid of parameters, on every core.")
+    parser.add_argument('game', choices=sorted(GAMES))
+    parser.add_argument('--grid', nargs='*', default=[], metavar='NAME=V1,V2', help="parameter values to sweep")
+    parser.add_argument('--repeats', type=int, default=100, help="matches per point of the grid")
+    parser.add_argument('--seed', type=int, default=1, help="seed of the first match; the rest count up")
+    parser.add_argument('--max-ticks', type=int, default=36000, help="give up on a match after this many ticks")
+    parser.add_argument('--workers', type=int, default=None, help="processes (default: one per core)")
+    parser.add_argument('--chunk', type=int, default=None, help="matches per task handed to a worker")
+    parser.add_argument('--flush', type=int, default=1000, help="rows per Parquet row group")
+    parser.add_argument('--script', help="drive the game with this recording's inputs instead of bots")
+    parser.add_argument('--out', default='sweep.csv')
+    args = parser.parse_args(argv)
+
+    points = grid(args.game, args.grid)
+    events = None if args.script == None else replay.load(args.script).events
+    start = time.perf_counter()
+    matches = sweep(args.game, points, args.repeats, args.out, args.seed, args.max_ticks,
+                    args.workers, args.chunk, args.flush, events)
+    seconds = time.perf_counter() - start
+    print("%d matches in %.1fs (%.1f matches/s) -> %s" % (matches, seconds, matches / seconds if seconds > 0.0 else 0.0, args.out))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
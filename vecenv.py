@@ -0,0 +1,371 @@
+import math
+
+import numpy
+
+import dogfight
+import PlayPong
+from geometry import Bounds
+
+#
+# vecenv.py
+#
+# Many independent dogfight or pong worlds, stepped in lockstep, for
+# training bots. Every world's state is a row of a few NumPy arrays, so
+# one 'step' of 1024 worlds is a handful of array operations rather
+# than 1024 Game.update calls.
+#
+#   env = vecenv.DogfightEnv(1024, seed=1)
+#   obs = env.reset()                          # (1024, 2, OBSERVATIONS)
+#   obs, reward, done = env.step(actions)      # actions: (1024, 2) ints
+#
+# Each world has two players (axis 1: ship one and two, or the left
+# and right paddle), and an action is the sum of the controls pressed
+# this tick, the same ones the keyboard calls:
+#
+#   dogfight  SPEED_UP, TURN_LEFT, TURN_RIGHT, SHOOT   (Ship.speed_up, ...)
+#   pong      MOVE_UP, MOVE_DOWN                       (Paddle.move_up, ...)
+#
+# The rules are the games' own, with their own constants, written out
+# for arrays: a tick applies the controls, as Game.dispatch would have
+# just before it, then moves everything the way the agents' update()s
+# do. Only what decides a match is kept: no embers or power-ups in a
+# dogfight, and both ships are flown like ship one (ship two's mouse
+# steering needs a mouse); a pong ball is served as soon as it is up.
+#
+# The reward is the hits (or points) a player made this tick minus the
+# ones it took; in a dogfight, plus (or minus) WIN_REWARD for the kill.
+# A world is done when one side wins or after max_ticks, and is reset
+# before 'step' returns, so its observation is already the new match's.
+#
+
+SPEED_UP, TURN_LEFT, TURN_RIGHT, SHOOT = 1, 2, 4, 8
+MOVE_UP, MOVE_DOWN = 1, 2
+
+
+def wrap(values, low, high):
+    # Into [low, high), in place; nothing moves more than one world
+    # across in a tick. (Coordinates are kept in arrays of their own,
+    # x apart from y, since NumPy is much slower at interleaved ones.)
+    size = high - low
+    numpy.subtract(values, size, out=values, where=values >= high)
+    numpy.add(values, size, out=values, where=values < low)
+
+def torus_offset(p, q, low, high):
+    # Game.offset along one axis, for arrays: from q to p, the short
+    # way round.
+    size = high - low
+    d = p - q
+    numpy.subtract(d, size, out=d, where=d > size / 2.0)
+    numpy.add(d, size, out=d, where=d < -size / 2.0)
+    return d
+
+
+class DogfightEnv:
+
+    Ship   = dogfight.Ship
+    Photon = dogfight.Photon
+    WIN_REWARD = 10.0
+
+    # Per player: own position, velocity, heading (cos, sin), health
+    # (as a fraction), whether it can shoot; then the other ship's
+    # offset from it, velocity and health.
+    OBSERVATIONS = ('x', 'y', 'vx', 'vy', 'hx', 'hy', 'hp', 'ready',
+                    'other_dx', 'other_dy', 'other_vx', 'other_vy', 'other_hp')
+
+    def __init__(self, count, seed=None, max_ticks=36000, hp_max=(None, 5), shoot_delay=10):
+        # 'hp_max' is ship one's and ship two's (None for Ship.hpMax).
+        Ship = self.Ship
+        self.count     = count
+        self.max_ticks = max_ticks
+        self.rng       = numpy.random.default_rng(seed)
+        w, h = dogfight.PlayDogfight.worldW, dogfight.PlayDogfight.worldH
+        self.bounds    = Bounds(-w/2, -h/2, w/2, h/2)
+        self.step_size = dogfight.TIME_STEP
+
+        self.hp_max = numpy.array([Ship.hpMax if hp is None else hp for hp in hp_max], dtype=numpy.int64)
+        scale = numpy.array([3.0, 3.0 * 2.0 / 3.0]) # Ship.SCALE, smaller for ship two
+        self.radius = 1.2 * scale
+        self.shoot_delay = shoot_delay # as Ship.shootDelay
+
+        # Ships, as (count, 2) arrays: axis 1 is ship one, ship two.
+        ships = (count, 2)
+        self.x, self.y   = numpy.zeros(ships), numpy.zeros(ships)
+        self.vx, self.vy = numpy.zeros(ships), numpy.zeros(ships)
+        self.ax, self.ay = numpy.zeros(ships), numpy.zeros(ships)
+        self.hx, self.hy = numpy.zeros(ships), numpy.zeros(ships) # heading, from 'angle'
+        self.angle       = numpy.zeros(ships)
+        self.impulse     = numpy.zeros(ships, dtype=numpy.int64)
+        self.lr_impulse  = numpy.zeros(ships, dtype=numpy.int64)
+        self.hp          = numpy.zeros(ships, dtype=numpy.int64)
+        self.shot_timer  = numpy.zeros(ships, dtype=numpy.int64)
+        self.next_slot   = numpy.zeros(ships, dtype=numpy.int64)
+        self.ticks       = numpy.zeros(count, dtype=numpy.int64)
+
+        # Photons: a few slots per ship, used round and round (a ship
+        # can only have LIFETIME / shoot delay of them in flight).
+        slots = self.Photon.LIFETIME // shoot_delay + 1
+        photons = (count, 2, slots)
+        self.px, self.py   = numpy.zeros(photons), numpy.zeros(photons)
+        self.pvx, self.pvy = numpy.zeros(photons), numpy.zeros(photons)
+        self.age           = numpy.zeros(photons, dtype=numpy.int64)
+        self.flying        = numpy.zeros(photons, dtype=bool)
+
+        self.reset()
+
+    def reset(self, worlds=None):
+        # Start the given worlds (a boolean mask; all of them by default)
+        # over; returns every world's observation.
+        if worlds is None:
+            worlds = numpy.ones(self.count, dtype=bool)
+        self.restart(worlds)
+        return self.observe()
+
+    def restart(self, worlds):
+        Ship = self.Ship
+        self.x[worlds] = (-Ship.START_X, Ship.START_X)
+        self.y[worlds] = (Ship.START_Y, -Ship.START_Y)
+        for name in ('vx', 'vy', 'ax', 'ay', 'impulse', 'lr_impulse', 'ticks', 'next_slot', 'flying'):
+            getattr(self, name)[worlds] = 0
+        self.angle[worlds]       = 90.0
+        self.hx[worlds]          = math.cos(math.radians(90.0))
+        self.hy[worlds]          = 1.0
+        self.hp[worlds]          = self.hp_max
+        self.shot_timer[worlds]  = 120 # as Ship.__init__: no shooting for two seconds
+
+    def step(self, actions):
+        # A world is reset as soon as a ship dies, so here both ships
+        # are always alive and playing.
+        Ship = self.Ship
+        bounds = self.bounds
+        actions = numpy.asarray(actions)
+        hp_before = self.hp.copy()
+
+        # The controls (Ship.turn_left etc.), left before right as in
+        # PlayDogfight.handle_keypress.
+        self.lr_impulse[(actions & TURN_LEFT) != 0] = Ship.TURN_IMPULSE
+        self.lr_impulse[(actions & TURN_RIGHT) != 0] = -Ship.TURN_IMPULSE
+        self.impulse[(actions & SPEED_UP) != 0] = Ship.THRUST_IMPULSE
+        shoot = ((actions & SHOOT) != 0) & (self.shot_timer == 0)
+        if shoot.any():
+            world, ship = numpy.nonzero(shoot)
+            slot = self.next_slot[world, ship]
+            self.px[world, ship, slot]  = self.x[world, ship]
+            self.py[world, ship, slot]  = self.y[world, ship]
+            self.pvx[world, ship, slot] = self.hx[world, ship] * self.Photon.INITIAL_SPEED
+            self.pvy[world, ship, slot] = self.hy[world, ship] * self.Photon.INITIAL_SPEED
+            self.age[world, ship, slot] = 0
+            self.flying[world, ship, slot] = True
+            self.next_slot[world, ship] = (slot + 1) % self.flying.shape[2]
+            self.shot_timer[shoot] = self.shoot_delay
+
+        # Ship.update and Ship.steer.
+        self.shot_timer -= self.shot_timer > 0
+        dt = self.step_size
+        self.x += self.vx * dt
+        self.y += self.vy * dt
+        self.vx += self.ax * dt
+        self.vy += self.ay * dt
+        self.lr_impulse -= numpy.sign(self.lr_impulse)
+        self.angle += self.lr_impulse * Ship.TURN_MULTIPLIER
+        radians = numpy.radians(self.angle)
+        numpy.cos(radians, out=self.hx)
+        numpy.sin(radians, out=self.hy)
+        thrust = self.impulse > 0
+        self.impulse -= thrust
+        numpy.multiply(self.hx, Ship.ACCELERATION * thrust, out=self.ax)
+        numpy.multiply(self.hy, Ship.ACCELERATION * thrust, out=self.ay)
+        wrap(self.x, bounds.xmin, bounds.xmax)
+        wrap(self.y, bounds.ymin, bounds.ymax)
+
+        # Photon.update: move, age, and hit the other ship (ship one's
+        # photons can only hit ship two, and the other way round).
+        flying = self.flying
+        self.px += self.pvx * (dt * flying)
+        self.py += self.pvy * (dt * flying)
+        wrap(self.px, bounds.xmin, bounds.xmax)
+        wrap(self.py, bounds.ymin, bounds.ymax)
+        self.age += flying
+        flying &= self.age < self.Photon.LIFETIME
+        # Swept, like Shootable.hit_time: the photon's whole move this
+        # tick, from where it ends up back along its travel.
+        tx, ty = self.pvx * dt, self.pvy * dt
+        sx = torus_offset(self.px, self.x[:, ::-1, None], bounds.xmin, bounds.xmax) - tx
+        sy = torus_offset(self.py, self.y[:, ::-1, None], bounds.ymin, bounds.ymax) - ty
+        radius = self.radius[::-1, None]
+        c = sx * sx + sy * sy - radius * radius
+        a = tx * tx + ty * ty
+        b = sx * tx + sy * ty
+        discriminant = b * b - a * c
+        reaches = (b < 0.0) & (discriminant >= 0.0) & (-b - numpy.sqrt(numpy.maximum(discriminant, 0.0)) <= a)
+        hit = flying & ((c < 0.0) | reaches)
+        flying &= ~hit
+        self.hp = numpy.maximum(self.hp - hit.sum(axis=2)[:, ::-1], 0)
+
+        # Rewards and the end of matches.
+        taken = hp_before - self.hp
+        reward = (taken[:, ::-1] - taken).astype(float)
+        dead = self.hp == 0
+        won = dead[:, ::-1] & ~dead
+        lost = dead & ~dead[:, ::-1]
+        reward += self.WIN_REWARD * (won.astype(float) - lost)
+        self.ticks += 1
+        done = dead.any(axis=1) | (self.ticks >= self.max_ticks)
+        if done.any():
+            self.restart(done)
+        return self.observe(), reward, done
+
+    def observe(self):
+        bounds = self.bounds
+        obs = numpy.empty((len(self.OBSERVATIONS), self.count, 2), dtype=numpy.float32)
+        obs[0], obs[1] = self.x, self.y
+        obs[2], obs[3] = self.vx, self.vy
+        obs[4], obs[5] = self.hx, self.hy
+        obs[6] = self.hp / self.hp_max
+        obs[7] = self.shot_timer == 0
+        obs[8]  = torus_offset(self.x[:, ::-1], self.x, bounds.xmin, bounds.xmax)
+        obs[9]  = torus_offset(self.y[:, ::-1], self.y, bounds.ymin, bounds.ymax)
+        obs[10] = self.vx[:, ::-1]
+        obs[11] = self.vy[:, ::-1]
+        obs[12] = obs[6][:, ::-1]
+        return obs.transpose(1, 2, 0)
+
+
+class PongEnv:
+
+    Paddle = PlayPong.Paddle
+    Ball   = PlayPong.Ball
+    SERVE_TICKS  = 100 # PlayPong.reset's ticks_before_start
+
+    # Per player: the ball's position and velocity, whether it is in
+    # play, then the player's own paddle and the other one (their y).
+    OBSERVATIONS = ('ball_x', 'ball_y', 'ball_vx', 'ball_vy', 'ball_live', 'y', 'other_y')
+
+    def __init__(self, count, seed=None, max_ticks=36000, points=5):
+        Paddle = self.Paddle
+        self.count     = count
+        self.max_ticks = max_ticks
+        self.points    = points
+        self.rng       = numpy.random.default_rng(seed)
+        self.bounds    = Bounds(-30.0, -22.5, 30.0, 22.5) # as PlayPong's Game.__init__
+        self.length    = Paddle.LENGTH
+        self.half      = self.length / 2.0
+        # Where Paddle.__init__ puts the two paddles.
+        left  = self.bounds.point_at((1.0 - Paddle.START_X) / 2.0, (Paddle.START_Y + 1.0) / 2.0)
+        right = self.bounds.point_at((1.0 + Paddle.START_X) / 2.0, (1.0 - Paddle.START_Y) / 2.0)
+        self.paddle_x = numpy.array([left.x, right.x])
+        self.paddle_y0 = numpy.array([left.y, right.y])
+
+        self.paddle_y  = numpy.zeros((count, 2))
+        self.ball_x    = numpy.zeros(count)
+        self.ball_y    = numpy.zeros(count)
+        self.dx        = numpy.zeros(count) # the ball's heading
+        self.dy        = numpy.zeros(count)
+        self.live      = numpy.zeros(count, dtype=bool)
+        self.countdown = numpy.zeros(count, dtype=numpy.int64)
+        self.left_turn = numpy.zeros(count, dtype=bool)
+        self.score     = numpy.zeros((count, 2), dtype=numpy.int64)
+        self.ticks     = numpy.zeros(count, dtype=numpy.int64)
+        self.reset()
+
+    def reset(self, worlds=None):
+        # Start the given worlds (a boolean mask; all of them by default)
+        # over; returns every world's observation.
+        if worlds is None:
+            worlds = numpy.ones(self.count, dtype=bool)
+        self.restart(worlds)
+        return self.observe()
+
+    def restart(self, worlds):
+        self.paddle_y[worlds]  = self.paddle_y0
+        self.live[worlds]      = False
+        self.countdown[worlds] = self.SERVE_TICKS
+        self.left_turn[worlds] = self.rng.random(worlds.sum()) < 0.5
+        self.score[worlds]     = 0
+        self.ticks[worlds]     = 0
+
+    def step(self, actions):
+        actions = numpy.asarray(actions)
+        bounds = self.bounds
+        step = self.length * self.Paddle.AGILITY
+        top, bottom = bounds.ymin + self.half, bounds.ymax - self.half
+
+        # Paddle.move_up/move_down, each then kept within bounds.
+        self.paddle_y -= step * ((actions & MOVE_UP) != 0)
+        numpy.clip(self.paddle_y, top, bottom, out=self.paddle_y)
+        self.paddle_y += step * ((actions & MOVE_DOWN) != 0)
+        numpy.clip(self.paddle_y, top, bottom, out=self.paddle_y)
+
+        # Ball.update, for the balls in play (before this tick's serves).
+        moving = self.live.copy()
+        x0, y0 = self.ball_x, self.ball_y
+        speed = self.Ball.SPEED * moving
+        x = x0 + self.dx * speed
+        y = y0 + self.dy * speed
+        for side in (0, 1):
+            paddle = self.paddle_x[side]
+            hits = moving & self.hits_between(side, x0, y0, x, y)
+            if side == 0: # Ball.check_bounce_vertical(from_left=False)
+                bounce = hits & (x <= paddle)
+            else:
+                bounce = hits & (x >= paddle)
+            x = numpy.where(bounce, 2.0 * paddle - x, x)
+            self.dx[bounce] *= -1.0
+        for wall in (bounds.ymin, bounds.ymax): # Ball.check_bounce_horizontal
+            bounce = moving & ((y <= wall) if wall == bounds.ymin else (y >= wall))
+            y = numpy.where(bounce, 2.0 * wall - y, y)
+            self.dy[bounce] *= -1.0
+        self.ball_x, self.ball_y = x, y
+
+        # PlayPong.update: serve when the countdown runs out, score when
+        # the ball gets past a paddle.
+        waiting = ~self.live
+        self.countdown -= waiting
+        serve = waiting & (self.countdown <= 0)
+        if serve.any():
+            left = self.left_turn[serve]
+            self.dx[serve] = numpy.where(left, 1.0, -1.0)
+            self.dy[serve] = self.rng.uniform(-3.0, 3.0, serve.sum())
+            self.ball_x[serve] = numpy.where(left, self.paddle_x[0], self.paddle_x[1])
+            self.ball_y[serve] = numpy.where(left, self.paddle_y[serve, 0], self.paddle_y[serve, 1])
+            self.live[serve] = True
+        left_point  = moving & (self.ball_x >= bounds.xmax)
+        right_point = moving & (self.ball_x <= bounds.xmin)
+        self.score[:, 0] += left_point
+        self.score[:, 1] += right_point
+        scored = left_point | right_point
+        self.live[scored] = False
+        self.countdown[scored] = self.SERVE_TICKS
+        self.left_turn[scored] = ~self.left_turn[scored]
+
+        point = numpy.stack((left_point, right_point), axis=1).astype(float)
+        reward = point - point[:, ::-1]
+        self.ticks += 1
+        done = (self.score >= self.points).any(axis=1) | (self.ticks >= self.max_ticks)
+        if done.any():
+            self.restart(done)
+        return self.observe(), reward, done
+
+    def hits_between(self, side, x0, y0, x1, y1):
+        # Paddle.hits_between, for every world: did the ball cross the
+        # paddle's x, coming from the front, within the paddle?
+        x = self.paddle_x[side]
+        dx = x1 - x0
+        if side == 0:
+            crossed = (x1 <= x) & (x0 >= x)
+        else:
+            crossed = (x1 >= x) & (x0 <= x)
+        crossed &= numpy.abs(dx) >= 0.0000001
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            y_intercept = y0 + (y1 - y0) * ((x - x0) / dx)
+        return crossed & (numpy.abs(y_intercept - self.paddle_y[:, side]) < self.half)
+
+    def observe(self):
+        obs = numpy.empty((len(self.OBSERVATIONS), self.count, 2), dtype=numpy.float32)
+        obs[0] = self.ball_x[:, None]
+        obs[1] = self.ball_y[:, None]
+        obs[2] = (self.dx * self.Ball.SPEED)[:, None]
+        obs[3] = (self.dy * self.Ball.SPEED)[:, None]
+        obs[4] = self.live[:, None]
+        obs[5] = self.paddle_y
+        obs[6] = self.paddle_y[:, ::-1]
+        return obs.transpose(1, 2, 0)